@@ -9,6 +9,7 @@ Currently supported datasets are
 - Oxford Flowers
 - Oxford FGVC Aircraft
 - Tsinghua Dogs
+- Danish Fungi (DF20-Mini and the full DF20)
 
 Datasets are constructed and used following the pytorch
 data.utils.data.Dataset paradigm, and have the signature
@@ -24,24 +25,74 @@ The use of training or test data can also be specified through the use of the
 
 `transform` and `target_transform` are optional callables that preprocess data
 and targets respectively; for instance, torchvision.transforms.
+
+Any of the datasets can be packed into a few large shard files with
+`fgvcdata.packed.pack`, and read back with `fgvcdata.PackedDataset`.
+Decoded images can be kept in memory across epochs with the caches in
+`fgvcdata.imcache`. For sequential I/O, datasets can be re-sharded into tar
+files with `fgvcdata.streaming.write_tar_shards` and streamed through
+`fgvcdata.StreamingDataset`. With `output='tensor'`, datasets decode images
+straight to uint8 tensors; `fgvcdata.tensors` batches and normalizes them.
+`fgvcdata.samplers` has class-balanced, square-root-frequency and PxK
+samplers for imbalanced datasets, and `fgvcdata.episodes` N-way K-shot
+episodes for few-shot learning.
+
+`fgvcdata.fixtures` writes synthetic copies of every dataset in its on-disk
+layout, and `python -m fgvcdata.bench` measures import and construction
+times, `__getitem__` latency and DataLoader throughput and memory on them.
+A `fgvcdata.profiling.Profiler` passed as `profiler` breaks `__getitem__`
+down into read, open, decode, convert and transform times across DataLoader
+workers. On network file systems, a `fgvcdata.prefetch.Prefetcher` reads
+the images of the upcoming samples ahead, in the sampler's order.
+`fgvcdata.dedup` finds exact and near-duplicate images within and across
+datasets and splits, for datasets to `exclude`.
+
+`fgvcdata.CombinedDataset` joins several datasets into one, optionally
+merging classes with the same name, with per-dataset sampling weights.
+
+Datasets can also be constructed by name with `fgvcdata.get(name, root, ...)`;
+`fgvcdata.registry` describes each dataset (files, URLs, class and sample
+counts) and checks dataset roots without loading them.
+
+Dataset modules, and the libraries they need (torch, scipy, ...), are only
+imported when first used, so `import fgvcdata` itself is cheap.
 '''
-from . import birds
-from .birds import *
-from . import cars
-from .cars import *
-from . import dogs
-from .dogs import *
-from . import aircraft
-from .aircraft import *
-from . import flowers
-from .flowers import *
-from . import icub
-from .icub import *
-from .fungi import *
+import importlib
+
+from . import registry
+from .registry import get
 
 
 IMAGENET_STATS = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
 
-datasets = []
-for f in [birds,icub,cars,dogs,aircraft,flowers,fungi]:
-    datasets += f.__all__
+# modules of the lazily imported classes that aren't in the registry
+_CLASSES = {'CombinedDataset': 'combined', 'PackedDataset': 'packed',
+            'StreamingDataset': 'streaming'}
+
+_MODULES = ['aircraft', 'base', 'bench', 'birds', 'cache', 'cars', 'combined', 'dedup',
+            'distributed', 'dogs', 'download', 'episodes', 'fixtures', 'flowers', 'fungi',
+            'icub', 'imcache', 'packed', 'prefetch', 'prepare', 'profiling', 'registry',
+            'samplers', 'store', 'streaming', 'tensors', 'utils']
+
+# names of the dataset classes; listing them imports nothing
+datasets = registry.names()
+
+__all__ = datasets + ['CombinedDataset', 'PackedDataset', 'StreamingDataset',
+                      'IMAGENET_STATS', 'datasets', 'get', 'registry']
+
+
+def __getattr__(name):
+    if name in registry.names():
+        value = registry.info(name).cls
+    elif name in _CLASSES:
+        value = getattr(importlib.import_module('.' + _CLASSES[name], __name__), name)
+    elif name in _MODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(registry.names()) | set(_CLASSES) | set(_MODULES))
@@ -1,22 +1,15 @@
 from pathlib import Path
 
-from PIL import Image
-import torch, torchvision
+import numpy as np
 
+from . import registry
 from .base import _BaseDataset
+from .utils import StringArray, lookup, read_columns
 
 
 __all__ = ['Aircraft']
 
 
-def _read_file(fname):
-    with open(fname) as f:
-        anno = [x.split(' ',1) for x in f.read().strip().split('\n')]
-    files = [x[0] for x in anno]
-    labels = [x[1] for x in anno]
-    return files, labels
-
-
 class Aircraft(_BaseDataset):
     '''The Oxford FGVC Aircraft dataset, consisting of 100 categories of
     aircraft.
@@ -24,38 +17,33 @@ class Aircraft(_BaseDataset):
     http://www.robots.ox.ac.uk/~vgg/data/fgvc-aircraft/
     '''
     name = 'FGVC Aircraft'
-    train_file = 'data/images_variant_trainval.txt'
-    test_file = 'data/images_variant_test.txt'
+    train_file = registry.info('Aircraft').files['train'][0]
+    test_file = registry.info('Aircraft').files['test'][0]
     bounding_box_file = 'data/images_box.txt'
-    url_files = {
-        'fgvc-aircraft-2013b.tar.gz':
-        'http://www.robots.ox.ac.uk/~vgg/data/fgvc-aircraft/archives/fgvc-aircraft-2013b.tar.gz'
-    }
-        
+    image_folders = registry.info('Aircraft').imfolder
+    url_files = registry.info('Aircraft').url_files
+    checksums = registry.info('Aircraft').checksums
+
+    def _metadata_files(self):
+        files = [self.train_file if self.train else self.test_file]
+        if self.load_bboxes:
+            files.append(self.bounding_box_file)
+        return files
+
     def _setup(self):
-        self.imfolder = 'data/images'
+        self.imfolder = self.image_folders['train' if self.train else 'test']
         anno_file = self.train_file if self.train else self.test_file
 
-        files, labels = _read_file(self.root/anno_file)
-        classes = sorted(list(set(labels)))
-        class_to_idx = {c:i for i, c in enumerate(classes)}
-
-        imgs, targets = [], []
-        for im, targ in zip(files, labels):
-            imgs.append(im+'.jpg')
-            targets.append(class_to_idx[targ])
-        self.imgs = imgs
-        self.targets = targets
-        self.classes = classes
-        self.class_to_idx = class_to_idx
+        files, labels = read_columns(self.root/anno_file)
+        classes, targets = np.unique(labels, return_inverse=True)
+        self.imgs = StringArray.from_list([f + '.jpg' for f in files.tolist()])
+        self.targets = targets.astype(np.int32)
+        self.classes = classes.tolist()
+        self.class_to_idx = {c:i for i, c in enumerate(self.classes)}
 
         if self.load_bboxes:
-            names, boxes = _read_file(self.root/self.bounding_box_file)
-            boxes = {n+'.jpg': b for n, b in zip(names, boxes)}
-            bboxes = []
-            for im in self.imgs:
-                box = [float(x) for x in boxes[im].split(' ')]
-                # x1,y1,x2,y2 -> x1,y1,w,h
-                box[2], box[3] = box[2]-box[0], box[3]-box[1] 
-                bboxes.append(box)
-            self.bboxes = bboxes
+            names, boxes = read_columns(self.root/self.bounding_box_file, np.float64)
+            boxes = lookup(names, boxes, files)
+            # x1,y1,x2,y2 -> x1,y1,w,h
+            boxes[:, 2:] = boxes[:, 2:] - boxes[:, :2]
+            self.bboxes = boxes.astype(np.float32)
@@ -1,12 +1,19 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
-from torchvision.datasets.utils import download_url, extract_archive
+
+from . import cache
+from .store import ImageStore
+from .utils import RaggedArray, StringArray, bbox_array, take
 
 
 def download_and_extract(url, download_root, extract_root=None, filename=None,
                                  md5=None, remove_finished=False):
+    from torchvision.datasets.utils import download_url, extract_archive
     download_root = os.path.expanduser(download_root)
     if extract_root is None:
         extract_root = download_root
@@ -24,48 +31,428 @@ def download_and_extract(url, download_root, extract_root=None, filename=None,
         pass
 
 
+def _split_root(root, train):
+    '''Returns the dataset root and split of a ``root`` argument: a root
+    ending in ``/train``, ``/test`` or ``/val`` names the split, overriding
+    ``train``.'''
+    root = Path(root)
+    if root.name == 'train':
+        return root.parent, True
+    if root.name in ['test', 'val']:
+        return root.parent, False
+    return root, train
+
+
+def _reduction(size, decode_size):
+    '''Returns the largest power-of-two factor (up to 8, the most JPEG DCT
+    scaling supports) by which an image of ``size`` can be shrunk while still
+    covering ``decode_size``: a short side length, or an (h, w) pair, as in
+    ``torchvision.transforms.Resize``.'''
+    w, h = size
+    for f in (8, 4, 2):
+        rw, rh = -(-w // f), -(-h // f)
+        if isinstance(decode_size, int):
+            if min(rw, rh) >= decode_size:
+                return f
+        elif rh >= decode_size[0] and rw >= decode_size[1]:
+            return f
+    return 1
+
+
+def _derived_name(img, suffix):
+    '''Relative path of the copy of ``img`` written by ``fgvcdata.prepare``'''
+    return img if suffix is None else os.path.splitext(img)[0] + suffix
+
+
+def _image_size(fp):
+    '''Returns the (w, h) size of an image, reading only its header'''
+    if str(fp).endswith('.npy'):
+        shape = np.load(fp, mmap_mode='r').shape
+        return shape[1], shape[0]
+    return Image.open(fp).size
+
+
+def _crop_region(box, size, padding=0.0):
+    '''Returns the (left, upper, right, lower) region of an image of ``size``
+    that covers the (x, y, w, h) ``box``, or the union of a (k,4) array of
+    boxes, grown by ``padding`` times the box width and height on each side
+    and clipped to the image. Empty boxes give the whole image.'''
+    w, h = size
+    box = np.asarray(box, dtype=np.float64).reshape(-1, 4)
+    if len(box) == 0:
+        return 0, 0, w, h
+    x1, y1 = box[:, 0].min(), box[:, 1].min()
+    x2, y2 = (box[:, 0] + box[:, 2]).max(), (box[:, 1] + box[:, 3]).max()
+    px, py = padding * (x2 - x1), padding * (y2 - y1)
+    left, upper = max(0, int(np.floor(x1 - px))), max(0, int(np.floor(y1 - py)))
+    right, lower = min(w, int(np.ceil(x2 + px))), min(h, int(np.ceil(y2 + py)))
+    if right <= left or lower <= upper:
+        return 0, 0, w, h
+    return left, upper, right, lower
+
+
+def _open_image(fp, decode_size=None, box=None, padding=0.0):
+    '''Opens an image, reduced by a power of two towards ``decode_size`` if
+    given. JPEGs are reduced during decoding, through draft mode.
+
+    If ``box`` is given, only the region around it (see ``_crop_region``) is
+    returned, and the reduction is chosen so that the region still covers
+    ``decode_size``.'''
+    if str(fp).endswith('.npy'):
+        # raw pixels written by fgvcdata.prepare
+        pixels = np.load(fp, mmap_mode='r')
+        if box is not None:
+            # only the region is read from the file
+            left, upper, right, lower = _crop_region(
+                box, (pixels.shape[1], pixels.shape[0]), padding)
+            pixels, box = pixels[upper:lower, left:right], None
+        img = Image.fromarray(np.ascontiguousarray(pixels))
+    else:
+        img = Image.open(fp)
+    region = None if box is None else _crop_region(box, img.size, padding)
+    if decode_size is not None:
+        size = img.size if region is None else (region[2] - region[0], region[3] - region[1])
+        f = _reduction(size, decode_size)
+        if f > 1:
+            w, h = img.size
+            if img.format == 'JPEG':
+                img.draft(None, (max(1, w // f), max(1, h // f)))
+                if region is not None:
+                    # draft mode scaled the image, so scale the region
+                    sx, sy = w / img.width, h / img.height
+                    region = (int(region[0] // sx), int(region[1] // sy),
+                              min(img.width, int(-(-region[2] // sx))),
+                              min(img.height, int(-(-region[3] // sy))))
+            else:
+                img, region = img.reduce(f, region), None
+    if region is not None:
+        img = img.crop(region)
+    return img
+
+
+class _NoStages(object):
+    '''Stands in for ``Profiler.stages`` when a dataset has no profiler:
+    the stages it marks are not timed'''
+    def __call__(self, stage):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self, source):
+        return source
+
+
+_NO_STAGES = _NoStages()
+
+
 class _BaseDataset(object):
-    '''Base class for FGVC datasets. Should not be used directly.'''
+    '''Base class for FGVC datasets. Should not be used directly.
+
+    If ``store`` is given, it is the path to a packed copy of the dataset
+    (see ``fgvcdata.packed.pack``), and images are decoded from the
+    memory-mapped store instead of being opened one file at a time.
+
+    With ``cache_metadata``, the parsed annotations are cached on disk (see
+    ``fgvcdata.cache``) and reused by later constructions.
+
+    After setup, ``imgs`` is a ``StringArray``, ``targets`` an int32 array and
+    ``bboxes`` an (N,4) float32 array (a ``RaggedArray`` of (k,4) arrays for
+    datasets with several boxes per image). These index like the lists they
+    replace, but don't grow the memory of forked DataLoader workers.
+
+    ``image_cache`` keeps decoded images in memory across epochs; see
+    ``fgvcdata.imcache``.
+
+    If ``decode_size`` is given (a short side length, or an (h, w) pair, as
+    for ``torchvision.transforms.Resize``), images are decoded at the smallest
+    power-of-two reduction (1/2, 1/4 or 1/8) that still covers that size, which
+    is much cheaper for large JPEGs. Use ``bbox(index)`` to get bounding boxes
+    in the coordinates of the reduced image.
+
+    ``image_root`` points at a resized copy of the images written by
+    ``fgvcdata.prepare``; images are read from there, and loaded bounding
+    boxes are scaled to match.
+
+    DataLoader fetches whole batches through ``__getitems__``. With
+    ``decode_threads`` > 0 the images of a batch are read and decoded by that
+    many threads (PIL releases the GIL while decoding), in on-disk order.
+
+    With ``shard`` set to ``'auto'`` or ``(rank, world_size)``, only the
+    samples that ``DistributedSampler`` would give this rank (with seed
+    ``shard_seed`` in epoch 0) are kept; see ``fgvcdata.distributed``. The
+    full metadata is still read and held by every rank until then.
+    ``indices`` holds the positions of the kept samples in the full dataset.
+    Samples in ``exclude`` (positions, or image paths as in ``imgs``), such
+    as the duplicates found by ``fgvcdata.dedup``, are left out first.
+
+    With ``crop_to_bbox``, images are cropped to their bounding box while
+    they are decoded, grown by ``bbox_padding`` times the box size on each
+    side for context. Datasets with several boxes per image are cropped to
+    the union of the boxes (``True`` or ``'union'``), or give one sample per
+    box (``'each'``). ``decode_size`` then applies to the crop, so large boxes
+    are still decoded reduced, and only the crop is converted and cached.
+    Images written as ``.npy`` by ``fgvcdata.prepare`` read only the crop.
+
+    With ``output='tensor'``, images are decoded straight to RGB uint8
+    tensors of shape (3, H, W) instead of PIL images; see
+    ``fgvcdata.tensors``.
+
+    ``profiler`` times every stage of ``__getitem__``; see
+    ``fgvcdata.profiling``. ``prefetcher`` reads the encoded images of the
+    upcoming samples ahead; see ``fgvcdata.prefetch``.
+    '''
     def __init__(self, root, transform=None, target_transform=None, train=True,
-                 download=False, load_bboxes=False):
-        self.root = Path(root)
-        if self.root.name == 'train':
-            is_train = True
-            self.root = self.root.parent
-        elif self.root.name in ['test', 'val']:
-            is_train = False
-            self.root = self.root.parent
-        else:
-            is_train = train
+                 download=False, load_bboxes=False, store=None, cache_metadata=True,
+                 image_cache=None, decode_size=None, image_root=None, decode_threads=0,
+                 shard=None, shard_seed=0, crop_to_bbox=False, bbox_padding=0.0,
+                 output='pil', profiler=None, prefetcher=None, exclude=None):
+        self.root, self.train = _split_root(root, train)
         self.transform = transform
         self.target_transform = target_transform
-        self.train = is_train
-        self.load_bboxes = load_bboxes
+        if crop_to_bbox not in (False, True, 'union', 'each'):
+            raise ValueError("crop_to_bbox must be False, True, 'union' or 'each', not {!r}".format(
+                crop_to_bbox))
+        self.load_bboxes = load_bboxes or bool(crop_to_bbox)
+        self.crop_to_bbox = crop_to_bbox
+        if output not in ('pil', 'tensor'):
+            raise ValueError("output must be 'pil' or 'tensor', not {!r}".format(output))
+        self.output = output
+        self.profiler = profiler
+        self.prefetcher = prefetcher
+        self.bbox_padding = bbox_padding
+
+        self.store = None
+        self.image_cache = image_cache
+        self.decode_size = decode_size
+        self.image_root = None
+        self.decode_threads = decode_threads
+        self._pool = None
 
         if download: self.download()
-        self._setup()
+        if not (cache_metadata and cache.load_metadata(self)):
+            self._setup()
+            if cache_metadata: cache.save_metadata(self)
+        self._compact()
+        self.indices = np.arange(len(self))
+
+        if image_root is not None:
+            self._use_prepared(image_root)
+
+        if store is not None:
+            self.store = ImageStore(store, self.train)
+            if len(self.store) != len(self):
+                raise ValueError('Store {} has {} images, but the dataset has {}'.format(
+                    store, len(self.store), len(self)))
+            # the names are compared as their encoded bytes
+            if not np.array_equal(self.store.index['imgs'], self.imgs.data):
+                raise ValueError('Store {} holds different images than the dataset'.format(store))
+        if exclude is not None:
+            self._select(np.flatnonzero(~self._excluded(exclude)))
+        if crop_to_bbox == 'each' and isinstance(self.bboxes, RaggedArray):
+            # one sample per box
+            boxes = self.bboxes.data
+            self._select(np.repeat(np.arange(len(self)), np.diff(self.bboxes.offsets)))
+            self.bboxes = np.asarray(boxes)
+        if shard is not None:
+            from .distributed import resolve_shard, sampler_indices
+            rank, world_size = resolve_shard(shard)
+            self._select(sampler_indices(len(self), rank, world_size, seed=shard_seed))
+        if image_cache is not None:
+            image_cache.bind(len(self))
 
     def _setup(self):
         raise NotImplementedError
 
+    def _metadata_files(self):
+        '''Paths, relative to root, of the files read by ``_setup``. Used to
+        key the metadata cache; ``None`` disables caching.'''
+        return None
+
+    def _compact(self):
+        '''Converts the metadata lists built by ``_setup`` to arrays'''
+        if not isinstance(self.imgs, StringArray):
+            self.imgs = StringArray.from_list([str(x) for x in self.imgs])
+        self.targets = np.asarray(self.targets, dtype=np.int32)
+        if getattr(self, 'bboxes', None) is not None:
+            self.bboxes = bbox_array(self.bboxes)
+
+    def _use_prepared(self, image_root):
+        from .prepare import MANIFEST_FILE, scales_file
+        self.image_root = Path(image_root)
+        manifest = json.load(open(self.image_root/MANIFEST_FILE))
+        if not manifest.get('complete', True):
+            raise ValueError('{} is only partly prepared; run fgvcdata.prepare again to '
+                             'finish it'.format(image_root))
+        self._image_suffix = manifest['suffix']
+        # (x, y) scale factor of every image
+        scales = np.load(self.image_root/scales_file('train' if self.train else 'test'))
+        if len(scales) != len(self):
+            raise ValueError('{} has {} images, but the dataset has {}'.format(
+                image_root, len(scales), len(self)))
+        bboxes = getattr(self, 'bboxes', None)
+        if isinstance(bboxes, RaggedArray):
+            scales = np.repeat(scales, np.diff(bboxes.offsets), axis=0)
+            self.bboxes = RaggedArray(bboxes.data * np.tile(scales, 2), bboxes.offsets)
+        elif bboxes is not None:
+            self.bboxes = bboxes * np.tile(scales, 2)
+
+    def _select(self, indices):
+        '''Keeps only the samples at ``indices``, in that order'''
+        indices = np.asarray(indices, dtype=np.int64)
+        self.imgs = self.imgs.take(indices)
+        self.targets = self.targets[indices]
+        if getattr(self, 'bboxes', None) is not None:
+            self.bboxes = take(self.bboxes, indices)
+        if self.store is not None:
+            self.store = self.store.take(indices)
+        self.indices = self.indices[indices]
+
+    def _excluded(self, exclude):
+        '''Mask of the samples in ``exclude``'''
+        exclude = np.asarray(list(exclude))
+        mask = np.zeros(len(self), dtype=bool)
+        if exclude.dtype.kind in 'US':
+            mask[np.isin(np.asarray(list(self.imgs)), exclude)] = True
+        elif len(exclude):
+            mask[exclude.astype(np.int64)] = True
+        return mask
+
     def __len__(self):
         return len(self.imgs)
 
     def filepath(self, index):
         '''Returns Path to image in ``self.imgs[index]``'''
+        if self.image_root is not None:
+            return self.image_root / self.imfolder / _derived_name(
+                self.imgs[index], self._image_suffix)
         return self.root / self.imfolder / self.imgs[index]
 
+    def _load_image(self, index):
+        '''Returns the decoded RGB image at ``index``'''
+        if self.image_cache is None:
+            return self._decode_image(index)
+        if self.output == 'tensor':
+            import torch
+            arr = self.image_cache.get_array(index)
+            if arr is not None:
+                return torch.from_numpy(arr).permute(2, 0, 1)
+            img = self._decode_image(index)
+            self.image_cache.put(index, img.permute(1, 2, 0).numpy().copy())
+            return img
+        img = self.image_cache.get(index)
+        if img is None:
+            img = self._decode_image(index)
+            self.image_cache.put(index, img)
+        return img
+
+    def _source(self, index):
+        '''Returns a path or file object for the encoded image at ``index``'''
+        if self.prefetcher is not None:
+            return self.prefetcher.open(self, index)
+        return self._raw_source(index)
+
+    def _raw_source(self, index):
+        if self.store is not None:
+            return self.store.open(index)
+        return self.filepath(index)
+
+    def _stages(self, index):
+        '''Marks the stages of reading sample ``index`` for the profiler'''
+        return _NO_STAGES if self.profiler is None else self.profiler.stages(index)
+
+    def _decode_image(self, index):
+        stages = self._stages(index)
+        source = stages.read(self._source(index))
+        box = self.bboxes[index] if self.crop_to_bbox else None
+        if self.output == 'tensor':
+            from .tensors import decode_tensor
+            with stages('decode'):
+                return decode_tensor(source, self.decode_size, box, self.bbox_padding)
+        with stages('open'):
+            img = _open_image(source, self.decode_size, box, self.bbox_padding)
+        with stages('decode'):
+            img.load()
+        with stages('convert'):
+            return img.convert('RGB')
+
+    def bbox(self, index):
+        '''Returns the bounding box(es) of image ``index``, in the coordinates
+        of the image returned by ``__getitem__`` (before any transform).'''
+        box = self.bboxes[index]
+        if self.decode_size is None and not self.crop_to_bbox:
+            return box
+        size = _image_size(self._raw_source(index))
+        if self.crop_to_bbox:
+            left, upper, right, lower = _crop_region(box, size, self.bbox_padding)
+            box = box - np.array([left, upper, 0, 0], dtype=box.dtype)
+            size = (right - left, lower - upper)
+        if self.decode_size is None:
+            return box
+        return box / _reduction(size, self.decode_size)
+
     def __getitem__(self, index):
-        path = self.filepath(index)
-        target = self.targets[index]
-        img = Image.open(path).convert('RGB')
-        if self.transform is not None:
-            img = self.transform(img)
-        if self.target_transform is not None:
-            target = self.target_transform(target)
+        stages = self._stages(index)
+        with stages('getitem'):
+            img = self._load_image(index)
+            target = int(self.targets[index])
+            if self.transform is not None:
+                with stages('transform'):
+                    img = self.transform(img)
+            if self.target_transform is not None:
+                target = self.target_transform(target)
 
         return img, target
 
+    def _location(self, index):
+        '''Sort key that approximates where image ``index`` is on disk'''
+        if self.store is not None:
+            return int(self.store.shards[index]), int(self.store.offsets[index])
+        return 0, str(self.filepath(index))
+
+    def _thread_pool(self):
+        # pools don't survive fork, so there is one per process
+        if self._pool is None or self._pool[0] != os.getpid():
+            self._pool = (os.getpid(), ThreadPoolExecutor(self.decode_threads))
+        return self._pool[1]
+
+    def __getitems__(self, indices):
+        '''Returns the list of samples at ``indices``. Used by DataLoader to
+        fetch a batch at once.'''
+        order = sorted(range(len(indices)), key=lambda i: self._location(indices[i]))
+        ordered = [indices[i] for i in order]
+        if self.decode_threads > 0:
+            samples = list(self._thread_pool().map(self.__getitem__, ordered))
+        else:
+            samples = [self[i] for i in ordered]
+        batch = [None] * len(indices)
+        for i, sample in zip(order, samples):
+            batch[i] = sample
+        return batch
+
+    def get_batch(self, indices, collate_fn=None):
+        '''Returns the samples at ``indices`` as ``(imgs, targets)``, as
+        returned by ``collate_fn`` if given. Otherwise, when the images are
+        tensors, these are stacked into batch tensors.'''
+        batch = self.__getitems__(indices)
+        if collate_fn is not None:
+            return collate_fn(batch)
+        imgs, targets = [x[0] for x in batch], [x[1] for x in batch]
+        import torch
+        if imgs and torch.is_tensor(imgs[0]):
+            imgs = torch.stack(imgs)
+            if not torch.is_tensor(targets[0]):
+                targets = torch.as_tensor(targets)
+        return imgs, targets
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
     def __repr__(self):
         head = '{} Dataset ({}.{})'.format(
             self.name, self.__class__.__module__, self.__class__.__name__)
@@ -76,8 +463,13 @@ class _BaseDataset(object):
         return '\n'.join(lines)
 
     def download(self):
-        if self.root.is_dir():
+        '''Downloads and extracts the files in ``url_files`` into root, in
+        parallel; an interrupted download is resumed. A ``checksums`` class
+        attribute, if set, maps file names to their checksums. See
+        ``fgvcdata.download``.'''
+        from .download import MANIFEST_FILE, download_files
+        if self.root.is_dir() and not (self.root/MANIFEST_FILE).is_file():
+            # not downloaded by fgvcdata, e.g. copied in by hand
             print('{} already exists - skipping download'.format(str(self.root)))
             return
-        for fname, url in self.url_files.items():
-            download_and_extract(url, self.root, filename=fname)
+        download_files(self.url_files, self.root, getattr(self, 'checksums', None))
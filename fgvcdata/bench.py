@@ -0,0 +1,273 @@
+'''Data loading benchmarks.
+
+Runs every dataset class against synthetic fixtures in its on-disk layout
+(see ``fgvcdata.fixtures``), or against existing dataset folders, and
+measures:
+
+- the time to ``import fgvcdata`` and to then load a dataset class, in a new
+  interpreter
+- construction time, parsing the metadata files and from the metadata cache
+- ``__getitem__`` latency percentiles, in random order
+- samples per second through a DataLoader with each number of workers, and
+  the memory (RSS and PSS) of the main process and every worker
+
+Results are JSON, along with the library and environment versions, so runs
+can be compared across versions and storage backends (``files``, or a
+``packed`` store, see ``fgvcdata.packed``):
+
+    python -m fgvcdata.bench --datasets CUB NABirds --workers 0 2 4 -o bench.json
+'''
+import importlib.metadata
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+
+__all__ = ['bench_dataset', 'construction_time', 'getitem_latency', 'import_time',
+           'loader_throughput', 'run']
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _memory_mb(pid):
+    '''Returns the RSS and PSS of process ``pid`` in MB, ``None`` where
+    /proc doesn't have them'''
+    def read(fname, key):
+        try:
+            with open('/proc/{}/{}'.format(pid, fname)) as f:
+                for line in f:
+                    if line.startswith(key + ':'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+    return dict(rss_mb=read('status', 'VmRSS'), pss_mb=read('smaps_rollup', 'Pss'))
+
+
+def _percentiles(seconds):
+    ms = np.asarray(seconds) * 1e3
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return dict(mean=float(ms.mean()), p50=float(p50), p90=float(p90), p99=float(p99),
+                max=float(ms.max()))
+
+
+def import_time(repeat=3):
+    '''Times ``import fgvcdata``, then loading a dataset class, each in a new
+    interpreter. Loading the class imports its module with numpy, PIL and the
+    metadata parsers, but not torch. Returns the fastest of ``repeat`` runs,
+    in seconds.'''
+    code = ('import time; t0 = time.perf_counter(); import fgvcdata; '
+            't1 = time.perf_counter(); fgvcdata.CUB; t2 = time.perf_counter(); '
+            'print(t1 - t0, t2 - t1)')
+    env = dict(os.environ)
+    # the same fgvcdata as this one
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(Path(__file__).resolve().parents[1])] + env.get('PYTHONPATH', '').split(os.pathsep))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append([float(x) for x in out.split()])
+    package, dataset = np.min(runs, axis=0)
+    return dict(fgvcdata_s=float(package), dataset_class_s=float(dataset))
+
+
+def construction_time(cls, root, repeat=3, **kwargs):
+    '''Times constructing ``cls(root, **kwargs)`` by parsing the metadata
+    files, and from the metadata cache. Returns the fastest of ``repeat``
+    runs, in seconds.'''
+    parse = min(_timed(lambda: cls(root, cache_metadata=False, **kwargs)) for _ in range(repeat))
+    # fills the cache
+    cls(root, **kwargs)
+    cached = min(_timed(lambda: cls(root, **kwargs)) for _ in range(repeat))
+    return dict(parse_s=parse, cached_s=cached)
+
+
+def getitem_latency(dataset, num_samples=100, seed=0):
+    '''Times ``dataset[i]`` for ``num_samples`` random indices. Returns
+    latency statistics in milliseconds.'''
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(len(dataset), size=num_samples).tolist()
+    return _percentiles([_timed(lambda: dataset[i]) for i in indices])
+
+
+def _count(batch):
+    return len(batch)
+
+
+def loader_throughput(dataset, workers=(0, 2), batch_size=32, num_samples=512, seed=0):
+    '''Reads ``num_samples`` random samples through a DataLoader with each
+    number of ``workers``. Returns a list of results with samples per second,
+    the time to the first batch, and the memory of every process after the
+    samples were read.'''
+    import torch
+    results = []
+    for num_workers in workers:
+        g = torch.Generator()
+        g.manual_seed(seed)
+        sampler = torch.utils.data.RandomSampler(
+            dataset, replacement=True, num_samples=num_samples, generator=g)
+        # persistent workers stay alive to be measured after the epoch
+        loader = torch.utils.data.DataLoader(
+            dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+            collate_fn=_count, persistent_workers=num_workers > 0)
+        start = time.perf_counter()
+        it = iter(loader)
+        n = next(it)
+        first = time.perf_counter() - start
+        for count in it:
+            n += count
+        elapsed = time.perf_counter() - start
+        results.append(dict(
+            workers=num_workers, samples=n, seconds=elapsed, samples_per_s=n / elapsed,
+            first_batch_s=first, main=_memory_mb(os.getpid()),
+            worker_memory=[_memory_mb(w.pid) for w in getattr(it, '_workers', [])]))
+        del it, loader
+    return results
+
+
+def _backend_dataset(cls, root, backend, tmp, **kwargs):
+    if backend == 'files':
+        return cls(root, **kwargs)
+    if backend == 'packed':
+        from .packed import pack
+        store = Path(tmp)/'packed'/cls.__name__
+        if not store.is_dir():
+            pack(cls(root, **kwargs), store)
+        return cls(root, store=store, **kwargs)
+    raise ValueError('Unknown backend {!r}'.format(backend))
+
+
+def bench_dataset(name, root, backends=('files',), workers=(0, 2), batch_size=32,
+                  num_samples=512, getitem_samples=100, tmp=None, **kwargs):
+    '''Runs the benchmarks on the train split of dataset ``name`` in ``root``,
+    read from each of ``backends``. Keyword arguments go to the dataset.'''
+    from . import registry
+    cls = registry.info(name).cls
+    kwargs.setdefault('train', True)
+    result = dict(root=str(root), construct=construction_time(cls, root, **kwargs),
+                  backends={})
+    with tempfile.TemporaryDirectory(dir=tmp) as tmp:
+        for backend in backends:
+            ds = _backend_dataset(cls, root, backend, tmp, **kwargs)
+            result['num_samples'] = len(ds)
+            result['backends'][backend] = dict(
+                getitem_ms=getitem_latency(ds, getitem_samples),
+                loader=loader_throughput(ds, workers, batch_size, num_samples))
+    return result
+
+
+def _environment():
+    import PIL
+    import torch
+    try:
+        version = importlib.metadata.version('fgvcdata')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    return dict(fgvcdata=version, python=platform.python_version(), numpy=np.__version__,
+                pillow=PIL.__version__, torch=torch.__version__, platform=platform.platform(),
+                cpus=os.cpu_count(), time=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+
+def run(names=None, root=None, num_images=200, num_classes=20, image_size=(500, 375), **kwargs):
+    '''Benchmarks the datasets ``names`` (all by default). Fixtures are
+    written to a temporary folder, unless ``root`` holds the datasets in
+    subfolders named after them. The metadata cache goes to a temporary
+    folder too. Other keyword arguments go to ``bench_dataset``. Returns the
+    results as a JSON-serializable dict.'''
+    from . import registry
+    from .fixtures import make_fixtures
+    names = [registry.info(name).name for name in names or registry.names()]
+    saved = os.environ.get('FGVCDATA_CACHE_DIR')
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.environ['FGVCDATA_CACHE_DIR'] = os.path.join(tmp, 'cache')
+            if root is None:
+                roots = make_fixtures(Path(tmp)/'fixtures', names, num_images=num_images,
+                                      num_classes=num_classes, image_size=image_size)
+                fixtures = dict(num_images=num_images, num_classes=num_classes,
+                                image_size=list(image_size))
+            else:
+                roots = {name: Path(root)/name for name in names}
+                fixtures = None
+            results = dict(environment=_environment(), fixtures=fixtures,
+                           config=kwargs,
+                           import_time=import_time(), datasets={})
+            for name in names:
+                results['datasets'][name] = bench_dataset(name, roots[name], tmp=tmp, **kwargs)
+        finally:
+            if saved is None:
+                os.environ.pop('FGVCDATA_CACHE_DIR', None)
+            else:
+                os.environ['FGVCDATA_CACHE_DIR'] = saved
+    return results
+
+
+def _summary(results):
+    lines = ['import fgvcdata {:.1f} ms, dataset class {:.0f} ms'.format(
+        results['import_time']['fgvcdata_s'] * 1e3,
+        results['import_time']['dataset_class_s'] * 1e3)]
+    for name, r in results['datasets'].items():
+        lines.append('{} ({} samples): parse {:.1f} ms, cached {:.1f} ms'.format(
+            name, r['num_samples'], r['construct']['parse_s'] * 1e3,
+            r['construct']['cached_s'] * 1e3))
+        for backend, b in r['backends'].items():
+            loader = ', '.join('{} workers {:.0f}/s'.format(x['workers'], x['samples_per_s'])
+                               for x in b['loader'])
+            lines.append('  {:<7} getitem p50 {:.1f} ms p99 {:.1f} ms; {}'.format(
+                backend, b['getitem_ms']['p50'], b['getitem_ms']['p99'], loader))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark FGVC data loading')
+    parser.add_argument('--datasets', nargs='+', help='datasets to run (default: all)')
+    parser.add_argument('--root', help='folder with the datasets in subfolders named after '
+                        'them (default: write fixtures to a temporary folder)')
+    parser.add_argument('--num-images', type=int, default=200, help='fixture images per split')
+    parser.add_argument('--num-classes', type=int, default=20)
+    parser.add_argument('--image-size', type=int, nargs=2, default=[500, 375],
+                        metavar=('W', 'H'))
+    parser.add_argument('--backends', nargs='+', default=['files'], choices=['files', 'packed'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-samples', type=int, default=512,
+                        help='samples read through each DataLoader')
+    parser.add_argument('--getitem-samples', type=int, default=100)
+    parser.add_argument('--decode-size', type=int)
+    parser.add_argument('--tensor', action='store_true', help="use output='tensor'")
+    parser.add_argument('-o', '--output', help='JSON file to write (default: stdout)')
+    args = parser.parse_args(args)
+
+    kwargs = {}
+    if args.decode_size is not None:
+        kwargs['decode_size'] = args.decode_size
+    if args.tensor:
+        kwargs['output'] = 'tensor'
+    results = run(args.datasets, args.root, args.num_images, args.num_classes,
+                  tuple(args.image_size), backends=args.backends, workers=args.workers,
+                  batch_size=args.batch_size, num_samples=args.num_samples,
+                  getitem_samples=args.getitem_samples, **kwargs)
+    if args.output is None:
+        print(json.dumps(results, indent=1))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(_summary(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,74 +1,65 @@
 from pathlib import Path
 
-from PIL import Image
-import torch, torchvision
+import numpy as np
 
+from . import registry
 from .base import _BaseDataset
+from .utils import StringArray, int_keys, lookup, read_columns
 
 
 __all__ = ['CUB', 'CUBPlus', 'NABirds']
 
 
-def _parse_ints(vals):
-    for i in range(len(vals)):
-        try:
-            vals[i] = int(vals[i])
-        except:
-            pass
-    return vals
-
-
-def _read_file(fname):
-    with open(fname) as f:
-        txt = f.read().strip()
-        res = dict(_parse_ints(x.split(' ', 1)) for x in txt.split('\n'))
-    return res
-
-
 class _BirdData(_BaseDataset):
-    image_file = 'images.txt'
-    train_test_split_file = 'train_test_split.txt'
-    class_names_file = 'classes.txt'
-    image_class_labels_file = 'image_class_labels.txt'
+    (image_file, train_test_split_file, class_names_file,
+     image_class_labels_file) = registry.info('CUB').files['train']
     bounding_box_file = 'bounding_boxes.txt'
+    image_folders = registry.info('CUB').imfolder
 
-    def _setup(self):
-        self.imfolder = 'images'
-
-        images = _read_file(self.root/self.image_file)
-        split = _read_file(self.root/self.train_test_split_file)
-        classes = _read_file(self.root/self.class_names_file)
-        labels = _read_file(self.root/self.image_class_labels_file)
-
-        imgs, targets = [], []
-        cls = set()
-        for id in sorted(images.keys()):
-            if id in labels and split[id] == self.train:
-                imgs.append(images[id])
-                targets.append(labels[id])
-                cls.add(labels[id])
-        self.imgs = imgs
-        self.targets = targets
+    def _metadata_files(self):
+        files = [self.image_file, self.train_test_split_file,
+                 self.class_names_file, self.image_class_labels_file]
+        if self.load_bboxes:
+            files.append(self.bounding_box_file)
+        return files
 
+    def _setup(self):
+        self.imfolder = self.image_folders['train' if self.train else 'test']
+
+        ids, paths = read_columns(self.root/self.image_file)
+        ids = int_keys(ids)
+        label_ids, labels = read_columns(self.root/self.image_class_labels_file, np.int64)
+        label_ids = int_keys(label_ids)
+        split_ids, split = read_columns(self.root/self.train_test_split_file, np.int64)
+        class_ids, class_names = read_columns(self.root/self.class_names_file)
+
+        # images without a label are skipped
+        if len(label_ids) != len(ids) or (label_ids != ids).any():
+            keep = np.isin(ids, label_ids)
+            ids, paths = ids[keep], paths[keep]
+        labels = lookup(label_ids, labels[:, 0], ids)
+        split = lookup(int_keys(split_ids), split[:, 0], ids)
+        # samples of this split, ordered by image id
+        order = np.flatnonzero(split == self.train)
+        order = order[np.argsort(ids[order], kind='stable')]
+        labels = labels[order]
+        self.imgs = StringArray.from_list(paths[order].tolist())
+
+        # classes with images in this split, in id order, numbered from 0
+        class_ids = int_keys(class_ids)
+        cls_order = np.argsort(class_ids, kind='stable')
+        cls_order = cls_order[np.isin(class_ids[cls_order], labels)]
         self.class_to_idx = {}
-        idx_shift = {}
-        i = 0
-        for k, v in sorted(classes.items()):
-            if k in cls:
-                self.class_to_idx[v] = i
-                idx_shift[k] = i
-                i += 1
+        for i, name in enumerate(class_names[cls_order].tolist()):
+            self.class_to_idx[name] = i
         self.classes = [x[0] for x in sorted(self.class_to_idx.items(),
                                              key=lambda a:a[1])]
-        self.targets = [idx_shift[i] for i in self.targets]
+        self.targets = lookup(class_ids[cls_order],
+                              np.arange(len(cls_order), dtype=np.int32), labels)
 
         if self.load_bboxes:
-            boxes = _read_file(self.root/self.bounding_box_file)
-            bboxes = []
-            for id in sorted(images.keys()):
-                if id in labels and split[id] == self.train:
-                    bboxes.append([float(x) for x in boxes[id].split(' ')])
-            self.bboxes = bboxes
+            box_ids, boxes = read_columns(self.root/self.bounding_box_file, np.float32)
+            self.bboxes = lookup(int_keys(box_ids), boxes, ids)[order]
 
 
 class NABirds(_BirdData):
@@ -85,16 +76,12 @@ class CUB(_BirdData):
     http://www.vision.caltech.edu/visipedia/CUB-200-2011.html
     '''
     name = 'Caltech UCSD Birds (CUB)'
-    url_files = {
-        'CUB_200_2011.tgz':
-            'http://www.vision.caltech.edu/visipedia-data/CUB-200-2011/CUB_200_2011.tgz',
-        'README.txt':
-            'http://www.vision.caltech.edu/visipedia-data/CUB-200-2011/README.txt'
-    }
+    url_files = registry.info('CUB').url_files
+    checksums = registry.info('CUB').checksums
 
 
 class CUBPlus(CUB):
     '''The CUB++ dataset: CUB with expert-validated labels'''
     name = 'Caltech UCSD Birds (CUB++)'
-    image_class_labels_file = 'cubplus_image_class_labels.txt'
+    image_class_labels_file = registry.info('CUBPlus').files['train'][3]
 
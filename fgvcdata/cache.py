@@ -0,0 +1,110 @@
+'''Persistent cache of parsed dataset metadata.
+
+The result of a dataset's ``_setup`` (image paths, targets, classes and
+bounding boxes) is stored in a small ``.npz`` file, so that later
+constructions skip parsing the annotation files altogether. Cache entries are
+keyed by the dataset class, root, split, whether bounding boxes are loaded and
+the modification time and size of every metadata file the dataset reads, so
+changing any of them invalidates the entry.
+
+The cache lives in ``$FGVCDATA_CACHE_DIR`` if set, otherwise in
+``$XDG_CACHE_HOME/fgvcdata`` (``~/.cache/fgvcdata`` by default).
+'''
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .utils import StringArray, flatten_bboxes, unflatten_bboxes
+
+
+# bump when the layout of cache files changes
+VERSION = 3
+
+
+def cache_dir():
+    '''Returns the folder used for fgvcdata's caches'''
+    path = os.environ.get('FGVCDATA_CACHE_DIR')
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache'))
+        path = os.path.join(base, 'fgvcdata')
+    return Path(os.path.expanduser(path))
+
+
+def _cache_file(dataset):
+    files = dataset._metadata_files()
+    if files is None:
+        return None
+    cls = dataset.__class__
+    parts = [VERSION, cls.__module__ + '.' + cls.__qualname__,
+             str(dataset.root.resolve()), bool(dataset.train),
+             bool(dataset.load_bboxes)]
+    for f in files:
+        try:
+            st = os.stat(dataset.root/f)
+        except OSError:
+            # let _setup report the missing file
+            return None
+        parts += [str(f), st.st_mtime_ns, st.st_size]
+    key = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+    return cache_dir()/'metadata'/'{}-{}.npz'.format(cls.__name__, key)
+
+
+def load_metadata(dataset):
+    '''Sets the metadata attributes of ``dataset`` from the cache. Returns
+    ``False`` if there is no valid cache entry.'''
+    fname = _cache_file(dataset)
+    if fname is None or not fname.is_file():
+        return False
+    try:
+        with np.load(fname) as data:
+            info = json.loads(data['info'].tobytes().decode('utf-8'))
+            imgs = StringArray(data['imgs'])
+            targets = data['targets']
+            if info['bboxes']:
+                bboxes = unflatten_bboxes(data['bboxes'], data['bbox_offsets'],
+                                          info['multi_box'])
+    except Exception:
+        # unreadable entries are treated as missing and get rewritten
+        return False
+    dataset.imfolder = info['imfolder']
+    dataset.imgs = imgs
+    dataset.targets = targets
+    dataset.classes = info['classes']
+    dataset.class_to_idx = {k: v for k, v in info['class_to_idx']}
+    if info['bboxes']:
+        dataset.bboxes = bboxes
+    return True
+
+
+def save_metadata(dataset):
+    '''Writes the metadata attributes of ``dataset`` to the cache. Failures
+    (e.g. a read-only cache folder) are ignored.'''
+    fname = _cache_file(dataset)
+    if fname is None:
+        return
+    bboxes = getattr(dataset, 'bboxes', None)
+    info = dict(imfolder=str(dataset.imfolder), classes=list(dataset.classes),
+                # stored as pairs so that non-string keys survive
+                class_to_idx=[[k, int(v)] for k, v in dataset.class_to_idx.items()],
+                bboxes=bboxes is not None, multi_box=False)
+    imgs = dataset.imgs
+    if not isinstance(imgs, StringArray):
+        imgs = StringArray.from_list([str(x) for x in imgs])
+    data = dict(imgs=imgs.data, targets=np.asarray(dataset.targets, dtype=np.int32))
+    if bboxes is not None:
+        data['bboxes'], data['bbox_offsets'], info['multi_box'] = flatten_bboxes(bboxes)
+    data['info'] = np.frombuffer(json.dumps(info).encode('utf-8'), dtype=np.uint8)
+    tmp = fname.with_name('{}.{}.tmp'.format(fname.name, os.getpid()))
+    try:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp, fname)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
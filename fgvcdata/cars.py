@@ -1,9 +1,6 @@
 from pathlib import Path
 
-from PIL import Image
-from scipy.io import loadmat
-import torch, torchvision
-
+from . import registry
 from .base import _BaseDataset
 
 
@@ -11,6 +8,7 @@ __all__ = ['StanfordCars']
 
 
 def _read_anno_file(fname):
+    from scipy.io import loadmat
     anno = loadmat(fname)['annotations'][0]
     files, targets, boxes = [], [], []
     for x in anno:
@@ -22,6 +20,7 @@ def _read_anno_file(fname):
 
 
 def _read_class_file(fname):
+    from scipy.io import loadmat
     class_names = loadmat(fname)['class_names'][0]
     names = [x[0].item() for x in class_names]
     class_to_idx = {v: i for i, v in enumerate(names)}
@@ -34,20 +33,18 @@ class StanfordCars(_BaseDataset):
     https://ai.stanford.edu/~jkrause/cars/car_dataset.html
     '''
     name = 'Stanford Cars'
-    train_anno_file = 'devkit/cars_train_annos.mat'
-    test_anno_file = 'devkit/cars_test_annos_withlabels.mat'
-    class_file = 'devkit/cars_meta.mat'
-    url_files = {
-        'cars_train.tgz':
-        'http://imagenet.stanford.edu/internal/car196/cars_train.tgz',
-        'cars_test.tgz':
-        'http://imagenet.stanford.edu/internal/car196/cars_test.tgz',
-        'car_devkit.tgz':
-        'https://ai.stanford.edu/~jkrause/cars/car_devkit.tgz',
-    }
-        
+    train_anno_file, class_file = registry.info('StanfordCars').files['train']
+    test_anno_file = registry.info('StanfordCars').files['test'][0]
+    image_folders = registry.info('StanfordCars').imfolder
+    url_files = registry.info('StanfordCars').url_files
+    checksums = registry.info('StanfordCars').checksums
+
+    def _metadata_files(self):
+        return [self.train_anno_file if self.train else self.test_anno_file,
+                self.class_file]
+
     def _setup(self):
-        self.imfolder = 'cars_' + ('train' if self.train else 'test')
+        self.imfolder = self.image_folders['train' if self.train else 'test']
         anno_file = self.train_anno_file if self.train else self.test_anno_file
 
         imgs, targets, bboxes = _read_anno_file(self.root/anno_file)
@@ -0,0 +1,179 @@
+'''Several datasets as one, with a shared label space.
+
+``CombinedDataset`` concatenates datasets (e.g. CUB, NABirds and InatCUB for
+pretraining) without copying their metadata: two arrays give the source
+dataset and the index within it of every sample, so a lookup is two array
+reads rather than ``ConcatDataset``'s bisect. Its ``targets`` are the labels
+of the combined class space, and ``classes`` and ``class_to_idx`` describe
+it, so the samplers and episodes work on it as on any dataset.
+
+By default every dataset keeps its own classes, named ``'<dataset>/<class>'``.
+With ``unify_classes``, classes of different datasets with the same name are
+merged: ``True`` compares names by ``normalize_class_name`` (so that CUB's
+``001.Black_footed_Albatross`` is NABirds' ``Black-footed Albatross``), and
+a function or dict maps class names to the unified names.
+
+``weights`` sets the share of each dataset in the samples that
+``sampler()`` draws:
+
+    ds = fgvcdata.CombinedDataset(
+        [fgvcdata.CUB(cub_root), fgvcdata.NABirds(nabirds_root)],
+        unify_classes=True, weights=[1, 1], transform=tf)
+    loader = DataLoader(ds, batch_size=64, sampler=ds.sampler(shard='auto'))
+'''
+import re
+
+import numpy as np
+
+from .samplers import ClassWeightedSampler
+
+
+__all__ = ['CombinedDataset', 'SourceSampler', 'normalize_class_name']
+
+
+def normalize_class_name(name):
+    '''Lower case ``name`` without a leading number (as in ``001.``) and
+    with runs of other characters than letters and digits as single spaces'''
+    name = re.sub(r'^\d+\.', '', str(name).strip())
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', name.lower()).split())
+
+
+def _index_dtype(n):
+    return np.int32 if n < 1 << 31 else np.int64
+
+
+class CombinedDataset(object):
+    '''The samples of ``datasets``, one dataset after the other. Images come
+    from each dataset's ``__getitem__`` (so their transforms apply), and
+    then go through ``transform``; targets are labels of the combined
+    classes, passed to ``target_transform``.
+
+    ``weights`` are the relative shares of the datasets in the samples drawn
+    by ``sampler()``; by default, in proportion to their sizes.'''
+    def __init__(self, datasets, unify_classes=False, weights=None, transform=None,
+                 target_transform=None):
+        self.datasets = list(datasets)
+        self.transform = transform
+        self.target_transform = target_transform
+        sizes = np.array([len(ds) for ds in self.datasets], dtype=np.int64)
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        # source dataset and index within it of every sample
+        self.sources = np.repeat(np.arange(len(sizes)), sizes).astype(
+            np.uint8 if len(sizes) <= 1 << 8 else np.int32)
+        self.local = (np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], sizes)).astype(
+            _index_dtype(sizes.max(initial=0)))
+        if weights is None:
+            weights = sizes
+        self.weights = np.asarray(weights, dtype=np.float64)
+        if self.weights.shape != (len(self.datasets),):
+            raise ValueError('Expected {} weights, got {}'.format(len(self.datasets), weights))
+
+        self._build_classes(unify_classes)
+        self.targets = np.concatenate(
+            [np.zeros(0, dtype=np.int32)] + [m[np.asarray(ds.targets, dtype=np.int64)]
+                                             for m, ds in zip(self.label_maps, self.datasets)])
+        self.name = ' + '.join(ds.name for ds in self.datasets)
+
+    def _build_classes(self, unify_classes):
+        '''Sets the combined ``classes`` and ``class_to_idx``, and
+        ``label_maps``: for every dataset, the combined label of each of its
+        labels'''
+        if unify_classes is True:
+            rename = normalize_class_name
+        elif isinstance(unify_classes, dict):
+            rename = lambda name: unify_classes.get(name, name)
+        elif callable(unify_classes):
+            rename = unify_classes
+        elif not unify_classes:
+            rename = None
+        else:
+            raise ValueError('unify_classes must be a bool, dict or function, not {!r}'.format(
+                unify_classes))
+        names = [ds.name for ds in self.datasets]
+        self.classes, self.class_to_idx, self.label_maps = [], {}, []
+        for k, ds in enumerate(self.datasets):
+            if rename is not None:
+                combined = [rename(c) for c in ds.classes]
+            else:
+                prefix = names[k] if names.count(names[k]) == 1 else '{} #{}'.format(names[k], k)
+                combined = ['{}/{}'.format(prefix, c) for c in ds.classes]
+            for c in combined:
+                if c not in self.class_to_idx:
+                    self.class_to_idx[c] = len(self.classes)
+                    self.classes.append(c)
+            self.label_maps.append(np.array([self.class_to_idx[c] for c in combined],
+                                            dtype=np.int32).reshape(-1))
+
+    def __len__(self):
+        return len(self.sources)
+
+    def source(self, index):
+        '''Returns the dataset of sample ``index`` and the index within it'''
+        return self.datasets[self.sources[index]], int(self.local[index])
+
+    def filepath(self, index):
+        ds, i = self.source(index)
+        return ds.filepath(i)
+
+    def _sample(self, img, index):
+        target = int(self.targets[index])
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+    def __getitem__(self, index):
+        ds, i = self.source(index)
+        return self._sample(ds[i][0], index)
+
+    def __getitems__(self, indices):
+        '''Returns the list of samples at ``indices``, fetching those of
+        each dataset together'''
+        indices = np.asarray(indices, dtype=np.int64)
+        sources, local = self.sources[indices], self.local[indices]
+        batch = [None] * len(indices)
+        for k in np.unique(sources).tolist():
+            pos = np.flatnonzero(sources == k).tolist()
+            ds = self.datasets[k]
+            if hasattr(ds, '__getitems__'):
+                samples = ds.__getitems__(local[pos].tolist())
+            else:
+                samples = [ds[i] for i in local[pos].tolist()]
+            for p, (img, _) in zip(pos, samples):
+                batch[p] = self._sample(img, indices[p])
+        return batch
+
+    def sample_weights(self):
+        '''Returns the weight of every sample, for
+        ``torch.utils.data.WeightedRandomSampler``'''
+        sizes = np.diff(self.offsets)
+        return (self.weights / np.maximum(sizes, 1))[self.sources]
+
+    def sampler(self, num_samples=None, shard=None, seed=0):
+        '''Returns a ``SourceSampler`` for this dataset'''
+        return SourceSampler(self, num_samples, shard, seed)
+
+    def __repr__(self):
+        head = 'Combined Dataset ({}.{})'.format(
+            self.__class__.__module__, self.__class__.__name__)
+        body = ['Images: {}'.format(len(self)),
+                'Classes: {}'.format(len(self.classes)),
+                'Transform: {}'.format(self.transform)]
+        body += ['{}: {} images, weight {:g}'.format(ds.name, len(ds), w)
+                 for ds, w in zip(self.datasets, self.weights)]
+        lines = [head]+[' '*2 + line for line in body]
+        return '\n'.join(lines)
+
+
+class SourceSampler(ClassWeightedSampler):
+    '''Samples a ``CombinedDataset`` with replacement, drawing a dataset with
+    probability proportional to its weight and then one of its samples
+    uniformly. Each epoch has ``num_samples`` samples in total (the dataset
+    size by default), split between the ranks; see
+    ``fgvcdata.samplers``.'''
+    def __init__(self, dataset, num_samples=None, shard=None, seed=0):
+        super().__init__(dataset.sources, 1.0, num_samples, shard, seed)
+        weights = np.where(self.counts > 0, dataset.weights[:len(self.counts)], 0.0)
+        self.probs = weights / weights.sum()
@@ -0,0 +1,307 @@
+'''Exact and near-duplicate images, within and across datasets.
+
+Several of the datasets share images: Stanford Dogs comes from ImageNet, and
+CUB overlaps with NABirds and with iNaturalist (``InatCUB``). ``build_index``
+hashes every image of a dataset in a pass over a process pool, keeping the
+SHA-1 of its bytes and a 64-bit difference hash (dHash) of its content, which
+stays close (in Hamming distance) under re-encoding and resizing. Indexes are
+saved as ``.npz`` files and cached under ``fgvcdata.cache.cache_dir()``.
+
+Queries are vectorized: near duplicates are found by multi-index hashing, so
+only pairs of hashes that agree on one of ``max_distance + 1`` bit blocks
+are compared, instead of all pairs.
+
+    train = fgvcdata.dedup.build_index(fgvcdata.CUB(root, train=True))
+    test = fgvcdata.dedup.build_index(fgvcdata.CUB(root, train=False))
+    leaked = train.overlap(test, max_distance=4)
+    ds = fgvcdata.CUB(root, train=True, exclude=leaked)
+
+``python -m fgvcdata.dedup`` reports the duplicates within and between the
+splits of a dataset, and against the splits of another one.
+'''
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .base import _open_image
+from .cache import cache_dir
+from .utils import StringArray, _ranges
+
+
+__all__ = ['DedupIndex', 'build_index', 'load_index']
+
+
+# bounds the candidate pairs compared at once
+_CHUNK = 1 << 22
+# images per task of the hashing pass
+_TASK_SIZE = 256
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(x):
+    '''Number of set bits of each uint64'''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.uint8)
+
+
+def dhash(img):
+    '''64-bit difference hash of a PIL image: whether each pixel of a 9x8
+    grayscale thumbnail is brighter than its left neighbour'''
+    px = np.asarray(img.convert('L').resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return np.packbits(px[:, 1:] > px[:, :-1]).view('>u8')[0]
+
+
+_dataset = None
+
+
+def _init_worker(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def _hash_images(indices):
+    sha1 = np.zeros((len(indices), 20), dtype=np.uint8)
+    hashes = np.zeros(len(indices), dtype=np.uint64)
+    for k, i in enumerate(indices):
+        source = _dataset._raw_source(i)
+        if hasattr(source, 'read'):
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        sha1[k] = np.frombuffer(hashlib.sha1(data).digest(), dtype=np.uint8)
+        # raw .npy images are memory-mapped from their path
+        fp = source if str(source).endswith('.npy') else io.BytesIO(data)
+        hashes[k] = dhash(_open_image(fp, (64, 64)))
+    return sha1, hashes
+
+
+def _block_pairs(a, b, shift, bits):
+    '''Yields chunks of pairs ``(i, j)`` where bits ``shift`` to
+    ``shift + bits`` of ``a[i]`` and ``b[j]`` are equal'''
+    mask = np.uint64((1 << bits) - 1)
+    ka = (a >> np.uint64(shift)) & mask
+    kb = (b >> np.uint64(shift)) & mask
+    order = np.argsort(kb, kind='stable')
+    kb = kb[order]
+    lo = np.searchsorted(kb, ka, 'left')
+    hi = np.searchsorted(kb, ka, 'right')
+    ends = np.cumsum(hi - lo)
+    bounds = np.searchsorted(ends, np.arange(0, ends[-1] if len(ends) else 0, _CHUNK), 'right')
+    for start, end in zip(bounds, list(bounds[1:]) + [len(a)]):
+        counts = hi[start:end] - lo[start:end]
+        i = np.repeat(np.arange(start, end), counts)
+        yield i, order[_ranges(lo[start:end], hi[start:end])]
+
+
+class DedupIndex(object):
+    '''SHA-1 and dHash of the images of a dataset. Row ``r`` is the image of
+    ``names[r]``, sample ``indices[r]`` of the (unsharded) dataset; each
+    image has one row.'''
+    def __init__(self, names, indices, sha1, hashes, info=None):
+        self.names = names
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.sha1 = np.asarray(sha1, dtype=np.uint8).reshape(-1, 20)
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.info = info or {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def save(self, fname):
+        '''Writes the index to a ``.npz`` file'''
+        names = self.names
+        if not isinstance(names, StringArray):
+            names = StringArray.from_list([str(x) for x in names])
+        info = np.frombuffer(json.dumps(self.info).encode('utf-8'), dtype=np.uint8)
+        tmp = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, names=names.data, indices=self.indices, sha1=self.sha1,
+                     hashes=self.hashes, info=info)
+        os.replace(tmp, fname)
+
+    def pairs(self, other=None, max_distance=None):
+        '''Returns the pairs of duplicate images, as arrays ``(i, j,
+        distance)`` of rows of this index and of ``other`` (this index, with
+        ``i < j``, by default), sorted by ``i`` then ``j``.
+
+        With ``max_distance=None``, images are duplicates when their bytes
+        are identical, otherwise when their dHashes differ in at most
+        ``max_distance`` bits (up to 31).'''
+        same = other is None
+        other = self if same else other
+        if max_distance is None:
+            # the first 8 bytes of the SHA-1 find the candidates
+            a = self.sha1[:, :8].copy().view(np.uint64).reshape(-1)
+            b = other.sha1[:, :8].copy().view(np.uint64).reshape(-1)
+            edges = [0, 64]
+        else:
+            if not 0 <= max_distance < 32:
+                raise ValueError('max_distance must be between 0 and 31, not {}'.format(
+                    max_distance))
+            a, b = self.hashes, other.hashes
+            # pigeonhole: hashes at most max_distance bits apart agree on at
+            # least one of max_distance + 1 blocks
+            edges = np.linspace(0, 64, max_distance + 2).astype(int).tolist()
+        found = [[], [], []]
+        for k, (shift, end) in enumerate(zip(edges[:-1], edges[1:])):
+            for i, j in _block_pairs(a, b, shift, end - shift):
+                if same:
+                    keep = i < j
+                    i, j = i[keep], j[keep]
+                x = a[i] ^ b[j]
+                if max_distance is None:
+                    keep = (self.sha1[i] == other.sha1[j]).all(axis=1)
+                    distance = np.zeros(len(x), dtype=np.uint8)
+                else:
+                    distance = _popcount(x)
+                    keep = distance <= max_distance
+                    # each pair is reported for the first block it agrees on
+                    for s, e in zip(edges[:k], edges[1:k + 1]):
+                        keep &= (x >> np.uint64(s)) & np.uint64((1 << (e - s)) - 1) != 0
+                for out, v in zip(found, (i, j, distance)):
+                    out.append(v[keep])
+        i, j, distance = (np.concatenate(v) if v else np.zeros(0, dtype=np.int64)
+                          for v in found)
+        order = np.lexsort((j, i))
+        return i[order], j[order], distance[order].astype(np.int64)
+
+    def duplicates(self, max_distance=None):
+        '''Returns the dataset indices of the images that duplicate an
+        earlier image of this index (see ``pairs``), so that excluding them
+        keeps one image of each group'''
+        _, j, _ = self.pairs(max_distance=max_distance)
+        return self.indices[np.unique(j)]
+
+    def overlap(self, other, max_distance=None):
+        '''Returns the dataset indices of the images that duplicate an image
+        of index ``other`` (see ``pairs``)'''
+        i, _, _ = self.pairs(other, max_distance)
+        return self.indices[np.unique(i)]
+
+    def __repr__(self):
+        return 'DedupIndex({} images of {})'.format(len(self), self.info.get('dataset'))
+
+
+def load_index(fname):
+    '''Reads an index written by ``DedupIndex.save``'''
+    with np.load(fname) as data:
+        return DedupIndex(StringArray(data['names']), data['indices'], data['sha1'],
+                          data['hashes'], json.loads(data['info'].tobytes().decode('utf-8')))
+
+
+def _image_positions(dataset):
+    '''Positions in ``dataset`` of the first sample of each image, in order;
+    datasets with one sample per box repeat images'''
+    _, first = np.unique(dataset.indices, return_index=True)
+    return np.sort(first)
+
+
+def _image_files(dataset, positions):
+    '''Files holding the images at ``positions``'''
+    if dataset.store is not None:
+        return dataset.store.files
+    return [dataset.filepath(i) for i in positions.tolist()]
+
+
+def _index_file(dataset, positions):
+    cls = dataset.__class__
+    parts = [cls.__module__ + '.' + cls.__qualname__, str(dataset.root.resolve()),
+             str(dataset.image_root), bool(dataset.train),
+             hashlib.sha1(dataset.indices.tobytes()).hexdigest()]
+    # like the metadata cache, changed images invalidate the index
+    mtime, size = 0, 0
+    for f in _image_files(dataset, positions):
+        try:
+            st = os.stat(f)
+        except OSError:
+            # let the hashing report the missing file
+            return None
+        mtime, size = max(mtime, st.st_mtime_ns), size + st.st_size
+    parts += [mtime, size]
+    key = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+    return cache_dir()/'dedup'/'{}-{}.npz'.format(cls.__name__, key)
+
+
+def build_index(dataset, workers=None, cache=True):
+    '''Hashes the images of ``dataset`` with ``workers`` processes (all cores
+    by default), once per image for datasets with a sample per box. With
+    ``cache``, the index is read from and saved to the cache folder, keyed
+    by the latest modification time and total size of the image files.'''
+    positions = _image_positions(dataset)
+    fname = _index_file(dataset, positions) if cache else None
+    if fname is not None and fname.is_file():
+        return load_index(fname)
+    tasks = [positions[start:start + _TASK_SIZE]
+             for start in range(0, len(positions), _TASK_SIZE)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(dataset,)) as pool:
+        results = list(pool.map(_hash_images, tasks))
+    sha1 = np.concatenate([r[0] for r in results]) if results else np.zeros((0, 20), np.uint8)
+    hashes = np.concatenate([r[1] for r in results]) if results else np.zeros(0, np.uint64)
+    info = dict(dataset=dataset.name, root=str(dataset.root), train=bool(dataset.train))
+    index = DedupIndex(dataset.imgs.take(positions), dataset.indices[positions], sha1, hashes,
+                       info)
+    if fname is not None:
+        try:
+            fname.parent.mkdir(parents=True, exist_ok=True)
+            index.save(fname)
+        except OSError:
+            pass
+    return index
+
+
+def main(args=None):
+    import argparse
+    import fgvcdata
+
+    parser = argparse.ArgumentParser(description='Find duplicate images in FGVC datasets')
+    parser.add_argument('dataset', choices=fgvcdata.datasets)
+    parser.add_argument('root', help='root folder of the dataset')
+    parser.add_argument('--other', nargs=2, metavar=('DATASET', 'ROOT'),
+                        help='also compare with the splits of another dataset')
+    parser.add_argument('--max-distance', type=int, default=4,
+                        help='dHash bits in which near duplicates may differ')
+    parser.add_argument('--workers', type=int, help='number of processes (default: all cores)')
+    parser.add_argument('--out', help='folder to write the duplicate image lists to')
+    args = parser.parse_args(args)
+
+    def split_indexes(name, root):
+        cls = getattr(fgvcdata, name)
+        indexes = {}
+        for train in (True, False):
+            ds = cls(root, train=train)
+            split = '{} {}'.format(name, 'train' if train else 'test')
+            indexes[split] = build_index(ds, args.workers)
+        return indexes
+
+    indexes = split_indexes(args.dataset, args.root)
+    if args.other:
+        indexes.update(split_indexes(*args.other))
+    splits = list(indexes)
+    found = {}
+    for n, a in enumerate(splits):
+        for b in splits[n:]:
+            other = None if a == b else indexes[b]
+            exact = indexes[a].pairs(other)
+            near = indexes[a].pairs(other, args.max_distance)
+            found[a, b] = near
+            print('{} / {}: {} identical, {} within {} bits'.format(
+                a, b, len(exact[0]), len(near[0]), args.max_distance))
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for (a, b), (i, j, distance) in found.items():
+            fname = os.path.join(args.out, '{}--{}.txt'.format(a, b).replace(' ', '-'))
+            with open(fname, 'w') as f:
+                for x, y, d in zip(i.tolist(), j.tolist(), distance.tolist()):
+                    f.write('{}\t{}\t{}\n'.format(indexes[a].names[x], indexes[b].names[y], d))
+
+
+if __name__ == '__main__':
+    main()
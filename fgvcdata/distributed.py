@@ -0,0 +1,92 @@
+'''Per-rank sharding of datasets for distributed training.
+
+Passing ``shard='auto'`` (or an explicit ``(rank, world_size)`` pair) to a
+dataset keeps only the samples that ``torch.utils.data.DistributedSampler``
+would give that rank in epoch 0, seeded with the dataset's ``shard_seed`` (0
+by default), with the same shuffling and padding. The metadata, bounding
+boxes and cache entries of the other ranks' samples are dropped right after
+setup.
+
+Sharding saves memory for the rest of training, not during setup: every rank
+still parses (or loads from the metadata cache) the metadata of the whole
+dataset and holds all of it until its shard is taken. The shard is drawn
+from the final list of samples, after ``exclude`` and ``crop_to_bbox='each'``,
+and a ``store`` or ``image_root`` is checked against the full dataset, so
+it cannot be taken any earlier. Each rank's peak memory and setup time are thus
+those of the unsharded dataset.
+
+The assignment of samples to ranks is fixed by the sharding. Use
+``ShardSampler`` and its ``set_epoch`` to get a deterministic reshuffle of
+the local shard every epoch:
+
+    ds = fgvcdata.NABirds(root, transform=tf, shard='auto')
+    sampler = fgvcdata.distributed.ShardSampler(ds)
+    loader = DataLoader(ds, batch_size=64, sampler=sampler)
+    for epoch in range(epochs):
+        sampler.set_epoch(epoch)
+'''
+import math
+
+import numpy as np
+import torch
+
+
+__all__ = ['ShardSampler', 'resolve_shard', 'sampler_indices']
+
+
+def resolve_shard(shard):
+    '''Returns ``(rank, world_size)`` for a dataset's ``shard`` argument:
+    ``'auto'`` reads them from torch.distributed.'''
+    if shard == 'auto':
+        import torch.distributed as dist
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+    rank, world_size = shard
+    if not 0 <= rank < world_size:
+        raise ValueError('Invalid rank {} for world size {}'.format(rank, world_size))
+    return rank, world_size
+
+
+def sampler_indices(n, rank, world_size, epoch=0, seed=0, shuffle=True, drop_last=False):
+    '''Returns the indices that ``DistributedSampler`` yields for ``rank``.'''
+    if shuffle:
+        g = torch.Generator()
+        g.manual_seed(seed + epoch)
+        indices = torch.randperm(n, generator=g).numpy()
+    else:
+        indices = np.arange(n)
+    if drop_last and n % world_size != 0:
+        num_samples = math.ceil((n - world_size) / world_size)
+    else:
+        num_samples = math.ceil(n / world_size)
+    total_size = num_samples * world_size
+    if total_size > n:
+        # padded with repeats, exactly like DistributedSampler
+        indices = np.resize(indices, total_size)
+    else:
+        indices = indices[:total_size]
+    return indices[rank:total_size:world_size]
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    '''Samples all of a (sharded) dataset in a new order every epoch, seeded
+    with ``seed + epoch`` as ``DistributedSampler`` does.'''
+    def __init__(self, dataset, shuffle=True, seed=0):
+        self.num_samples = len(dataset)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        if not self.shuffle:
+            return iter(range(self.num_samples))
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.num_samples, generator=g).tolist())
+
+    def __len__(self):
+        return self.num_samples
@@ -1,48 +1,174 @@
+import hashlib
 import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
-from PIL import Image
-from scipy.io import loadmat
-import torch, torchvision
+import numpy as np
 
+from . import registry
 from .base import _BaseDataset
+from .cache import cache_dir
+from .utils import RaggedArray, bbox_array
 
 
 __all__ = ['StanfordDogs', 'TsinghuaDogs']
 
 
 def _read_anno_file(fname):
+    from scipy.io import loadmat
     anno = loadmat(fname)
     files = [x.item() for x in anno['file_list'].ravel()]
     targets = [x.item() for x in anno['labels'].ravel()]
     return files, targets
 
 
-def _load_bbox_anno_files(filelist, tag='bndbox'):
-    import xml.etree.ElementTree as etree
+# leaf elements, e.g. <xmin>12</xmin>
+_LEAF = re.compile(rb'<(\w+)>\s*([^<\s]*)\s*</\1>')
+
+
+def _parse_bbox_file(fname, tag='bndbox'):
+    '''Returns the (x, y, w, h) boxes of all ``tag`` elements in an
+    annotation file, read with a regex rather than a full XML parse.'''
+    with open(fname, 'rb') as f:
+        txt = f.read()
+    pattern = b'<%s>(.*?)</%s>' % (tag.encode(), tag.encode())
     boxes = []
-    for f in filelist:
-        root = etree.parse(f).getroot()
-        elements = root.findall(f'.//{tag}')
-        # some images have multiple bounding boxes
-        bbs = []
-        for el in elements:
-            x1, y1, x2, y2 = [float(x.text) for x in el.findall('.//')]
-            bbs.append([x1, y1, x2-x1, y2-y1])
-        boxes.append(bbs)
+    # some images have multiple bounding boxes
+    for el in re.finditer(pattern, txt, re.S):
+        x1, y1, x2, y2 = [float(v) for _, v in _LEAF.findall(el.group(1))[:4]]
+        boxes.append((x1, y1, x2-x1, y2-y1))
     return boxes
 
 
+def _load_bbox_anno_files(filelist, tag='bndbox', workers=None):
+    '''Parses the annotation files in ``filelist`` (in a process pool, for
+    long lists) into a ``RaggedArray`` of (k,4) boxes.'''
+    filelist = [str(f) for f in filelist]
+    if len(filelist) < 2000 or workers == 0:
+        boxes = [_parse_bbox_file(f, tag) for f in filelist]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            boxes = list(pool.map(_parse_bbox_file, filelist, repeat(tag), chunksize=500))
+    offsets = np.zeros(len(boxes) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in boxes], out=offsets[1:])
+    flat = np.array([x for b in boxes for x in b], dtype=np.float32).reshape(-1, 4)
+    return RaggedArray(flat, offsets)
+
+
+def _bbox_cache_dirs(root):
+    '''Folders that can hold cached boxes: the dataset root, and a folder in
+    the user cache for read-only roots.'''
+    key = hashlib.sha1(str(root.resolve()).encode('utf-8')).hexdigest()[:16]
+    return [root, cache_dir()/'bboxes'/key]
+
+
+def _offsets_file(fname):
+    return fname.with_name(fname.stem + '_offsets.npy')
+
+
+def _key_file(fname):
+    return fname.with_name(fname.stem + '_key.json')
+
+
+def _bbox_sources(root, name, anno_folder, anno_file):
+    '''Files, relative to root, that the boxes are read from: a JSON cache
+    written by older versions or the annotation folder, and the list of
+    annotation files.'''
+    legacy = Path(name).with_suffix('.json')
+    return [legacy if (root/legacy).is_file() else anno_folder, anno_file]
+
+
+def _sources_key(root, sources):
+    '''Key of cached boxes: the mtime and size of their sources, as for the
+    metadata cache. ``None`` if a source is missing.'''
+    parts = []
+    for f in sources:
+        try:
+            st = os.stat(root/f)
+        except OSError:
+            return None
+        parts += [str(f), st.st_mtime_ns, st.st_size]
+    return json.dumps(parts)
+
+
+def _find_cached_bboxes(root, name, key=None):
+    '''Cached boxes written with ``key``, or with any key if it is ``None``'''
+    for d in _bbox_cache_dirs(root):
+        fname = d/name
+        if not (fname.is_file() and _offsets_file(fname).is_file()):
+            continue
+        if key is None:
+            return fname
+        try:
+            if _key_file(fname).read_text() == key:
+                return fname
+        except OSError:
+            pass
+    return None
+
+
+def _load_cached_bboxes(fname):
+    return RaggedArray(np.load(fname, mmap_mode='r'), np.load(_offsets_file(fname)))
+
+
 def _load_bbox_json(fname):
-    return json.load(open(fname))
+    return bbox_array(json.load(open(fname)))
+
+
+def _cache_bboxes(boxes, root, name, key):
+    for d in _bbox_cache_dirs(root):
+        fname = d/name
+        try:
+            d.mkdir(parents=True, exist_ok=True)
+            for f, arr in [(fname, boxes.data), (_offsets_file(fname), boxes.offsets)]:
+                tmp = f.with_name('{}.{}.tmp'.format(f.name, os.getpid()))
+                with open(tmp, 'wb') as fp:
+                    np.save(fp, arr)
+                os.replace(tmp, f)
+            # written last, so that the key never validates partly written boxes
+            key_file = _key_file(fname)
+            tmp = key_file.with_name('{}.{}.tmp'.format(key_file.name, os.getpid()))
+            tmp.write_text(key or '')
+            os.replace(tmp, key_file)
+            return
+        except OSError:
+            continue
+    print('Unable to cache bounding boxes')
+
 
+def _bbox_metadata_file(root, name, anno_folder):
+    '''File that the boxes are parsed from, for the metadata cache key. It
+    isn't the cached boxes, which loading writes, so that the key is the same
+    before and after they are cached.'''
+    legacy = Path(name).with_suffix('.json')
+    if (root/legacy).is_file():
+        return legacy
+    if (root/anno_folder).exists():
+        return anno_folder
+    # only the cached boxes are left
+    cached = _find_cached_bboxes(root, name)
+    return anno_folder if cached is None else cached
 
-def _cache_bbox_json(boxes, fname):
-    try:
-        json.dump(boxes, open(fname, 'w'))
-    except PermissionError as e:
-        print('Unable to cache bounding boxes (permission denied)')
-        print(e)
+
+def _get_bboxes(root, name, paths, tag, sources):
+    '''Loads boxes from the cache, from a JSON cache written by older
+    versions, or by parsing the annotation files listed by ``paths()``.
+    Cached boxes are only used while the files in ``sources`` (see
+    ``_bbox_sources``) are unchanged, or if they are gone.'''
+    key = _sources_key(root, sources)
+    cached = _find_cached_bboxes(root, name, key)
+    if cached is not None:
+        return _load_cached_bboxes(cached)
+    legacy = root/Path(name).with_suffix('.json')
+    if legacy.is_file():
+        boxes = _load_bbox_json(legacy)
+    else:
+        boxes = _load_bbox_anno_files(paths(), tag)
+    _cache_bboxes(boxes, root, name, key)
+    return boxes
 
 
 class StanfordDogs(_BaseDataset):
@@ -52,23 +178,24 @@ class StanfordDogs(_BaseDataset):
     http://vision.stanford.edu/aditya86/ImageNetDogs/
     '''
     name = 'Stanford Dogs'
-    train_anno_file = 'train_list.mat'
-    test_anno_file = 'test_list.mat'
-    train_bounding_box_file = 'train_bbox.json'
-    test_bounding_box_file = 'test_bbox.json'
-    url_files = {
-        'images.tar':
-        'http://vision.stanford.edu/aditya86/ImageNetDogs/images.tar',
-        'annotations.tar':
-        'http://vision.stanford.edu/aditya86/ImageNetDogs/annotation.tar',
-        'lists.tar':
-        'http://vision.stanford.edu/aditya86/ImageNetDogs/lists.tar',
-        'README.txt':
-        'http://vision.stanford.edu/aditya86/ImageNetDogs/README.txt',
-    }
-        
+    train_anno_file = registry.info('StanfordDogs').files['train'][0]
+    test_anno_file = registry.info('StanfordDogs').files['test'][0]
+    train_bounding_box_file = 'train_bbox.npy'
+    test_bounding_box_file = 'test_bbox.npy'
+    image_folders = registry.info('StanfordDogs').imfolder
+    url_files = registry.info('StanfordDogs').url_files
+    checksums = registry.info('StanfordDogs').checksums
+
+    def _metadata_files(self):
+        files = [self.train_anno_file if self.train else self.test_anno_file]
+        if self.load_bboxes:
+            bbox_file = (self.train_bounding_box_file if self.train
+                         else self.test_bounding_box_file)
+            files.append(_bbox_metadata_file(self.root, bbox_file, 'Annotation'))
+        return files
+
     def _setup(self):
-        self.imfolder = 'Images'
+        self.imfolder = self.image_folders['train' if self.train else 'test']
         anno_file = self.train_anno_file if self.train else self.test_anno_file
 
         files, labels = _read_anno_file(self.root/anno_file)
@@ -85,16 +212,14 @@ class StanfordDogs(_BaseDataset):
         self.class_to_idx = class_to_idx
 
         if self.load_bboxes:
-            bbox_file = self.root.joinpath(self.train_bounding_box_file if self.train
-                                           else self.test_bounding_box_file)
-            if bbox_file.is_file():
-                self.bboxes = _load_bbox_json(bbox_file)
-            else:
+            def paths():
+                from scipy.io import loadmat
                 anno = loadmat(self.root/anno_file)['annotation_list']
-                paths = [self.root.joinpath('Annotation', a[0].item()) for a in anno]
-                bboxes = _load_bbox_anno_files(paths)
-                _cache_bbox_json(bboxes, bbox_file)
-                self.bboxes = bboxes
+                return [self.root.joinpath('Annotation', a[0].item()) for a in anno]
+            bbox_file = (self.train_bounding_box_file if self.train
+                         else self.test_bounding_box_file)
+            sources = _bbox_sources(self.root, bbox_file, 'Annotation', anno_file)
+            self.bboxes = _get_bboxes(self.root, bbox_file, paths, 'bndbox', sources)
 
 
 class TsinghuaDogs(_BaseDataset):
@@ -103,13 +228,22 @@ class TsinghuaDogs(_BaseDataset):
     https://cg.cs.tsinghua.edu.cn/ThuDogs/
     '''
     name = 'Tsinghua Dogs'
-    train_anno_file = 'TrainAndValList/train.lst'
-    val_anno_file = 'TrainAndValList/validation.lst'
-    train_bounding_box_file = 'train_bbox.json'
-    test_bounding_box_file = 'test_bbox.json'
+    train_anno_file = registry.info('TsinghuaDogs').files['train'][0]
+    val_anno_file = registry.info('TsinghuaDogs').files['test'][0]
+    train_bounding_box_file = 'train_bbox.npy'
+    test_bounding_box_file = 'test_bbox.npy'
+    image_folders = registry.info('TsinghuaDogs').imfolder
+
+    def _metadata_files(self):
+        files = [self.train_anno_file if self.train else self.val_anno_file]
+        if self.load_bboxes:
+            bbox_file = (self.train_bounding_box_file if self.train
+                         else self.test_bounding_box_file)
+            files.append(_bbox_metadata_file(self.root, bbox_file, 'Low-Annotations'))
+        return files
 
     def _setup(self):
-        self.imfolder = 'low-resolution'
+        self.imfolder = self.image_folders['train' if self.train else 'test']
         anno_file = self.train_anno_file if self.train else self.val_anno_file
 
         # odd byte at beginning of file, thats why [1:]
@@ -133,12 +267,9 @@ class TsinghuaDogs(_BaseDataset):
         self.class_to_idx = class_to_idx
 
         if self.load_bboxes:
-            bbox_file = self.root.joinpath(self.train_bounding_box_file if self.train
-                                           else self.test_bounding_box_file)
-            if bbox_file.is_file():
-                self.bboxes = _load_bbox_json(bbox_file)
-            else:
-                paths = [self.root.joinpath('Low-Annotations', x+'.xml') for x in self.imgs]
-                bboxes = _load_bbox_anno_files(paths, 'bodybndbox')
-                _cache_bbox_json(bboxes, bbox_file)
-                self.bboxes = bboxes
+            def paths():
+                return [self.root.joinpath('Low-Annotations', x+'.xml') for x in self.imgs]
+            bbox_file = (self.train_bounding_box_file if self.train
+                         else self.test_bounding_box_file)
+            sources = _bbox_sources(self.root, bbox_file, 'Low-Annotations', anno_file)
+            self.bboxes = _get_bboxes(self.root, bbox_file, paths, 'bodybndbox', sources)
@@ -0,0 +1,301 @@
+'''Parallel, resumable downloads of dataset files.
+
+``download_files`` fetches all the files of a dataset concurrently, and
+extracts each archive as soon as it has been downloaded. Files are written
+through a ``.part`` file and resumed with HTTP range requests after an
+interruption. Tar archives that are downloaded from the start are extracted
+while they download (into a temporary folder until their checksum is
+verified, when one is expected).
+
+The SHA-256 checksum and size of every finished file are recorded in
+``.fgvcdata-download.json`` in the dataset root, together with whether it was
+extracted, so a partial download or extraction is finished by the next call
+rather than mistaken for a complete one. Expected checksums can be passed to
+verify the downloads against: SHA-256 digests, or MD5 digests written as
+``'md5:<digest>'`` where only those are published. The registry records the
+published checksums of the dataset archives.
+
+Any URL that ``urllib`` can open works, including ``file://`` mirrors:
+
+    python -m fgvcdata.download StanfordCars path/to/cars
+'''
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import threading
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+
+__all__ = ['MANIFEST_FILE', 'download_files', 'fetch', 'unpack']
+
+
+MANIFEST_FILE = '.fgvcdata-download.json'
+
+CHUNK_SIZE = 1 << 20
+
+
+def _open_url(url, offset=0, timeout=60):
+    '''Opens ``url`` for reading from byte ``offset``. Returns the file
+    object, the offset it actually starts at (0 if the server can't resume)
+    and the full size of the file, if known.'''
+    parts = urlparse(url)
+    if parts.scheme in ('', 'file'):
+        f = open(urllib.request.url2pathname(parts.path), 'rb')
+        f.seek(offset)
+        return f, offset, os.fstat(f.fileno()).st_size
+    request = urllib.request.Request(url, headers={'User-Agent': 'fgvcdata'})
+    if offset:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    response = urllib.request.urlopen(request, timeout=timeout)
+    length = response.headers.get('Content-Length')
+    if response.status != 206:
+        # the range was ignored, so this is the whole file
+        offset = 0
+    size = None if length is None else offset + int(length)
+    return response, offset, size
+
+
+def _parse_checksum(checksum):
+    '''Returns the hash name and digest of an expected checksum'''
+    if checksum is None:
+        return None, None
+    name, _, digest = checksum.rpartition(':')
+    return name or 'sha256', digest.lower()
+
+
+class _Hashes(object):
+    '''Updates several hashes at once'''
+    def __init__(self, names):
+        self.hashes = {name: hashlib.new(name) for name in names}
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def hexdigest(self, name):
+        return self.hashes[name].hexdigest()
+
+
+class _Tee(io.RawIOBase):
+    '''Reads from ``src``, writing all data read to ``out`` and ``hasher``'''
+    def __init__(self, src, out, hasher):
+        self.src = src
+        self.out = out
+        self.hasher = hasher
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.src.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.out.write(data)
+        self.hasher.update(data)
+        return n
+
+
+def _is_tar_name(fname):
+    return fname.endswith(('.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tar.xz'))
+
+
+def _extract_tar(tar, out):
+    if hasattr(tarfile, 'data_filter'):
+        # refuses absolute paths and links out of the destination
+        tar.extractall(out, filter='data')
+    else:
+        tar.extractall(out)
+
+
+def _merge_into(src, dst):
+    '''Moves the contents of folder ``src`` into folder ``dst``'''
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir(follow_symlinks=False) and os.path.isdir(target):
+            _merge_into(entry.path, target)
+        else:
+            os.replace(entry.path, target)
+
+
+def fetch(url, dest, sha256=None, extract_to=None, md5=None):
+    '''Downloads ``url`` to ``dest``, through ``dest.part``, resuming from an
+    existing ``dest.part``. Raises ``ValueError`` if the SHA-256 checksum of
+    the file doesn't match ``sha256``, or its MD5 checksum ``md5``.
+
+    If ``extract_to`` is given and ``url`` is a tar archive downloaded from the
+    start, it is extracted there while downloading. With a checksum, it is
+    extracted into a temporary folder in ``extract_to`` first, and only moved
+    into place once the checksum matches. Returns the SHA-256 checksum and
+    whether the file was extracted.'''
+    dest = Path(dest)
+    part = dest.with_name(dest.name + '.part')
+    offset = part.stat().st_size if part.is_file() else 0
+    try:
+        src, offset, size = _open_url(url, offset)
+    except HTTPError as e:
+        if e.code != 416:
+            raise
+        # range not satisfiable: the part file is complete
+        src, size = io.BytesIO(), offset
+    if size is not None and offset > size:
+        # the part file is longer than the file (e.g. a mirror replaced it),
+        # so it can't be resumed
+        src.close()
+        src, offset, size = _open_url(url)
+
+    expected = {name: digest for name, digest in [('sha256', sha256), ('md5', md5)] if digest}
+    hasher = _Hashes({'sha256'} | set(expected))
+    if offset:
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    stream = extract_to is not None and offset == 0 and _is_tar_name(dest.name)
+    staging = None
+    if stream and expected:
+        # unverified files stay out of extract_to
+        staging = Path(extract_to)/'.{}.{}.extract'.format(dest.name, os.getpid())
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+    try:
+        with src, open(part, 'ab' if offset else 'wb') as out:
+            if stream:
+                tee = _Tee(src, out, hasher)
+                with tarfile.open(fileobj=io.BufferedReader(tee, CHUNK_SIZE), mode='r|*') as tar:
+                    _extract_tar(tar, extract_to if staging is None else staging)
+                # the rest of the file is padding after the end of the archive
+                while tee.read(CHUNK_SIZE):
+                    pass
+            else:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+                    hasher.update(chunk)
+
+        if size is not None and part.stat().st_size != size:
+            # the connection dropped; the part file is resumed next time
+            raise IOError('Downloaded {} of {} bytes of {}'.format(
+                part.stat().st_size, size, url))
+        for name, digest in expected.items():
+            if hasher.hexdigest(name) != digest.lower():
+                part.unlink()
+                raise ValueError('{} checksum mismatch for {}: expected {}, got {}'.format(
+                    name.upper(), url, digest, hasher.hexdigest(name)))
+        if staging is not None:
+            _merge_into(staging, extract_to)
+    finally:
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+    os.replace(part, dest)
+    return hasher.hexdigest('sha256'), stream
+
+
+def unpack(archive, out):
+    '''Extracts a tar or zip archive, or decompresses a ``.gz`` file, into the
+    folder ``out``. Returns ``False`` if ``archive`` is none of these.'''
+    archive = str(archive)
+    if tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as tar:
+            _extract_tar(tar, out)
+    elif zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            z.extractall(out)
+    elif archive.endswith('.gz'):
+        name = os.path.basename(archive)[:-3]
+        with gzip.open(archive) as src, open(os.path.join(out, name), 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        return False
+    return True
+
+
+def _load_manifest(fname):
+    if fname.is_file():
+        with open(fname) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(fname, manifest):
+    tmp = fname.with_name('{}.{}.tmp'.format(fname.name, os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, fname)
+
+
+def download_files(url_files, root, checksums=None, workers=None, extract=True, stream=True):
+    '''Downloads the ``{filename: url}`` pairs of ``url_files`` into ``root``
+    with ``workers`` threads (one per file by default), and extracts archives
+    into ``root``. Files already recorded as downloaded (and extracted) are
+    skipped. ``checksums`` optionally maps file names to expected SHA-256
+    checksums (or MD5 checksums, as ``'md5:<digest>'``). With ``stream``, tar
+    archives are extracted while they download.'''
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    checksums = checksums or {}
+    manifest_file = root/MANIFEST_FILE
+    manifest = _load_manifest(manifest_file)
+    # marks root as a download in progress
+    _save_manifest(manifest_file, manifest)
+    lock = threading.Lock()
+
+    def task(item):
+        fname, url = item
+        dest = root/fname
+        entry = manifest.get(fname)
+        name, expected = _parse_checksum(checksums.get(fname))
+        if (entry is None or not dest.is_file() or entry['size'] != dest.stat().st_size
+                or (expected is not None and entry.get(name) != expected)):
+            print('Downloading {} to {}'.format(url, dest))
+            extract_to = root if extract and stream else None
+            digest, extracted = fetch(url, dest, expected if name == 'sha256' else None,
+                                      extract_to, expected if name == 'md5' else None)
+            entry = dict(url=url, sha256=digest, size=dest.stat().st_size, extracted=extracted)
+            if name == 'md5':
+                # verified by fetch
+                entry['md5'] = expected
+            with lock:
+                manifest[fname] = entry
+                _save_manifest(manifest_file, manifest)
+        if extract and not entry['extracted']:
+            if unpack(dest, root):
+                print('Extracted {} to {}'.format(dest, root))
+            with lock:
+                entry['extracted'] = True
+                _save_manifest(manifest_file, manifest)
+
+    with ThreadPoolExecutor(workers or max(1, len(url_files))) as pool:
+        list(pool.map(task, url_files.items()))
+    return manifest
+
+
+def main(args=None):
+    import argparse
+    from . import registry
+
+    parser = argparse.ArgumentParser(description='Download and extract an FGVC dataset')
+    parser.add_argument('dataset', help='dataset name, one of: ' + ', '.join(registry.names()))
+    parser.add_argument('root', help='folder to download the dataset to')
+    parser.add_argument('--workers', type=int, help='number of parallel downloads')
+    parser.add_argument('--no-extract', action='store_true', help="don't extract archives")
+    parser.add_argument('--no-stream', action='store_true',
+                        help='extract archives after, not while, downloading them')
+    args = parser.parse_args(args)
+
+    info = registry.info(args.dataset)
+    if not info.url_files:
+        parser.error('{} has no download URLs'.format(info.name))
+    download_files(info.url_files, args.root, info.checksums, workers=args.workers,
+                   extract=not args.no_extract, stream=not args.no_stream)
+    print('Downloaded {} to {}'.format(info.name, args.root))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+'''N-way K-shot episodes for few-shot learning.
+
+``EpisodeSampler`` draws episodes of ``n_way`` classes with ``k_shot``
+support and ``n_query`` query samples each, from the class index of a
+dataset's ``targets`` (see ``fgvcdata.samplers.class_index``). All the
+episodes of an epoch are drawn at once with vectorized NumPy operations,
+reproducibly from ``seed`` and ``set_epoch``. Each episode is a list of
+dataset indices (the support samples, class by class, then the query
+samples), so it can be used as a DataLoader ``batch_sampler``.
+
+``EpisodicDataset`` wraps a dataset so that item ``i`` is episode ``i``:
+its images are fetched together through the dataset's ``__getitems__``
+(decoded by ``decode_threads`` threads, in on-disk order) and returned as
+``(support, support_labels, query, query_labels)``, with labels numbered
+0 to ``n_way - 1`` within the episode. DataLoader workers then prefetch
+whole episodes:
+
+    split = fgvcdata.episodes.load_class_split('cub_split.json')
+    episodes = fgvcdata.episodes.EpisodicDataset(
+        ds, n_way=5, k_shot=1, n_query=15, classes=split['novel'], seed=0)
+    loader = DataLoader(episodes, batch_size=None, num_workers=4)
+
+Class splits (such as base/val/novel) are JSON files mapping split names to
+lists of class names; see ``make_class_split``.
+'''
+import json
+
+import numpy as np
+import torch
+
+from .samplers import _targets, class_index
+
+
+__all__ = ['EpisodeSampler', 'EpisodicDataset', 'load_class_split', 'make_class_split',
+           'save_class_split']
+
+
+# bounds the random keys drawn at once, in elements
+_CHUNK = 1 << 22
+
+
+def make_class_split(classes, sizes=(0.5, 0.25, 0.25), names=('base', 'val', 'novel'), seed=0):
+    '''Splits ``classes`` (names, e.g. ``dataset.classes``) at random into
+    disjoint lists, one per name. ``sizes`` are class counts, or fractions of
+    the classes; the last split takes the remaining classes.'''
+    classes = list(classes)
+    order = np.random.default_rng(seed).permutation(len(classes))
+    sizes = [int(round(s * len(classes))) if isinstance(s, float) else s for s in sizes]
+    bounds = np.cumsum([0] + sizes[:-1]).tolist() + [len(classes)]
+    return {name: [classes[i] for i in sorted(order[start:end])]
+            for name, start, end in zip(names, bounds[:-1], bounds[1:])}
+
+
+def save_class_split(fname, split):
+    '''Writes a ``{split name: [class names]}`` dict to a JSON file'''
+    with open(fname, 'w') as f:
+        json.dump(split, f, indent=1)
+
+
+def load_class_split(fname):
+    '''Reads a class split written by ``save_class_split``'''
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _class_ids(data, classes):
+    '''Class indices of ``classes``, given as indices or as names'''
+    if len(classes) and isinstance(classes[0], str):
+        class_to_idx = data.class_to_idx
+        missing = [c for c in classes if c not in class_to_idx]
+        if missing:
+            raise KeyError('Unknown classes: {}'.format(', '.join(missing[:5])))
+        classes = [class_to_idx[c] for c in classes]
+    return np.asarray(classes, dtype=np.int64)
+
+
+class EpisodeSampler(torch.utils.data.Sampler):
+    '''Yields ``num_episodes`` episodes per epoch, each a list of the dataset
+    indices of ``k_shot`` support and then ``n_query`` query samples of
+    ``n_way`` distinct classes. Classes are drawn from ``classes`` (indices
+    or names; all classes by default), and samples within a class without
+    replacement.'''
+    def __init__(self, data, n_way=5, k_shot=1, n_query=15, num_episodes=1000,
+                 classes=None, seed=0):
+        self.index = class_index(_targets(data))
+        counts = np.diff(self.index.offsets)
+        if classes is None:
+            self.classes = np.flatnonzero(counts)
+        else:
+            self.classes = _class_ids(data, classes)
+        self.n_way, self.k_shot, self.n_query = n_way, k_shot, n_query
+        self.num_episodes = num_episodes
+        self.seed = seed
+        self.epoch = 0
+        if n_way > len(self.classes):
+            raise ValueError('Cannot draw {}-way episodes from {} classes'.format(
+                n_way, len(self.classes)))
+        per_class = k_shot + n_query
+        small = self.classes[counts[self.classes] < per_class]
+        if len(small):
+            raise ValueError('{} classes have fewer than {} samples, e.g. class {}'.format(
+                len(small), per_class, small[0]))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _draw(self, rng, num_episodes):
+        n_way, per_class = self.n_way, self.k_shot + self.n_query
+        # n_way distinct classes per episode, in random order
+        keys = rng.random((num_episodes, len(self.classes)))
+        classes = self.classes[np.argsort(keys, axis=1)[:, :n_way]].reshape(-1)
+        # per_class distinct positions within each class: the smallest of
+        # random keys, with the positions past the class size excluded
+        counts = np.diff(self.index.offsets)[classes]
+        keys = rng.random((len(classes), counts.max()))
+        keys[np.arange(keys.shape[1]) >= counts[:, None]] = 2
+        pos = np.argpartition(keys, per_class - 1, axis=1)[:, :per_class]
+        samples = self.index.data[self.index.offsets[classes][:, None] + pos]
+        return samples.reshape(num_episodes, n_way, per_class)
+
+    def episodes(self):
+        '''Returns the episodes of the current epoch as an array of shape
+        (num_episodes, n_way, k_shot + n_query)'''
+        rng = np.random.default_rng([self.seed, self.epoch])
+        max_count = np.diff(self.index.offsets)[self.classes].max()
+        step = max(1, _CHUNK // (self.n_way * max(max_count, len(self.classes))))
+        return np.concatenate([self._draw(rng, min(step, self.num_episodes - start))
+                               for start in range(0, self.num_episodes, step)])
+
+    def flat_episodes(self):
+        '''Returns the episodes of the current epoch as rows of support
+        indices followed by query indices'''
+        episodes = self.episodes()
+        support = episodes[:, :, :self.k_shot].reshape(len(episodes), -1)
+        query = episodes[:, :, self.k_shot:].reshape(len(episodes), -1)
+        return np.concatenate([support, query], axis=1)
+
+    def __iter__(self):
+        return iter(self.flat_episodes().tolist())
+
+    def __len__(self):
+        return self.num_episodes
+
+
+class EpisodicDataset(torch.utils.data.Dataset):
+    '''Dataset of the episodes of ``dataset`` drawn by an ``EpisodeSampler``
+    (the other arguments are passed to it). Item ``i`` is
+    ``(support, support_labels, query, query_labels)``; images are stacked
+    into tensors when the dataset returns tensors.
+
+    Episodes are drawn when the dataset is created and by ``set_epoch``;
+    call it before creating each epoch's DataLoader iterator.'''
+    def __init__(self, dataset, n_way=5, k_shot=1, n_query=15, num_episodes=1000,
+                 classes=None, seed=0):
+        self.dataset = dataset
+        self.sampler = EpisodeSampler(dataset, n_way, k_shot, n_query, num_episodes,
+                                      classes, seed)
+        self.support_labels = torch.arange(n_way).repeat_interleave(k_shot)
+        self.query_labels = torch.arange(n_way).repeat_interleave(n_query)
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        self.sampler.set_epoch(epoch)
+        self.episodes = self.sampler.flat_episodes()
+
+    def classes(self, index):
+        '''Returns the dataset classes of episode ``index``, in label order'''
+        k_shot = self.sampler.k_shot
+        return self.dataset.targets[self.episodes[index, :self.sampler.n_way * k_shot:k_shot]]
+
+    def __getitem__(self, index):
+        batch = self.dataset.__getitems__(self.episodes[index].tolist())
+        imgs = [x[0] for x in batch]
+        if torch.is_tensor(imgs[0]):
+            imgs = torch.stack(imgs)
+        n = len(self.support_labels)
+        return imgs[:n], self.support_labels, imgs[n:], self.query_labels
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __repr__(self):
+        s = self.sampler
+        return '{}-way {}-shot episodes ({} queries, {} episodes) of {}'.format(
+            s.n_way, s.k_shot, s.n_query, s.num_episodes, self.dataset.name)
@@ -0,0 +1,278 @@
+'''Synthetic datasets in the exact on-disk layout of each supported dataset.
+
+Fixtures hold small random images and metadata files in the same formats as
+the real datasets (the CUB and NABirds text files, the Cars, Dogs and Flowers
+``.mat`` files, Dogs XML annotations, the Aircraft text files and the Danish
+Fungi CSVs), so that every dataset class can be constructed and read without
+downloading anything. They are used by ``fgvcdata.bench``:
+
+    root = fgvcdata.fixtures.make_fixture('CUB', 'fixtures/cub', num_images=500)
+    ds = fgvcdata.CUB(root)
+
+or from the command line:
+
+    python -m fgvcdata.fixtures fixtures/ --num-images 500
+
+``num_images`` is the number of images per split. Images are encoded once per
+variant and their bytes reused, so large fixtures are quick to write; decoding
+them costs the same as decoding distinct images.
+'''
+import io
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+__all__ = ['FIXTURES', 'make_fixture', 'make_fixtures']
+
+
+class _ImageWriter(object):
+    '''Writes JPEGs of about ``size`` (w, h), picked from ``variants`` smooth
+    random images per image mode'''
+    def __init__(self, rng, size=(500, 375), variants=8):
+        self.rng = rng
+        self.size = size
+        self.variants = variants
+        self._encoded = {}
+
+    def _encode(self, mode):
+        from PIL import Image
+        images = []
+        for _ in range(self.variants):
+            # up to 10% bigger or smaller than size
+            w, h = (int(s * self.rng.uniform(0.9, 1.1)) for s in self.size)
+            coarse = self.rng.integers(0, 256, (max(1, h // 16), max(1, w // 16), 3), dtype=np.uint8)
+            pixels = np.asarray(Image.fromarray(coarse).resize((w, h), Image.BILINEAR), np.int16)
+            # fine grain, so images don't compress unrealistically well
+            pixels = pixels + self.rng.integers(-12, 13, pixels.shape, dtype=np.int16)
+            img = Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).convert(mode)
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=90)
+            images.append((buf.getvalue(), (w, h)))
+        return images
+
+    def write(self, path, mode='RGB'):
+        '''Writes an image to ``path`` and returns its (w, h) size'''
+        if mode not in self._encoded:
+            self._encoded[mode] = self._encode(mode)
+        data, size = self._encoded[mode][self.rng.integers(self.variants)]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return size
+
+
+def _box(size, rng):
+    '''A random (x, y, w, h) box covering 30-80% of an image of ``size``'''
+    w, h = size
+    bw, bh = int(w * rng.uniform(0.3, 0.8)), int(h * rng.uniform(0.3, 0.8))
+    return int(rng.integers(0, w - bw + 1)), int(rng.integers(0, h - bh + 1)), bw, bh
+
+
+def _write_lines(fname, lines):
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    fname.write_text('\n'.join(lines) + '\n')
+
+
+def _birds(root, n, num_classes, images, rng, nabirds=False, plus=False):
+    n *= 2
+    class_ids = list(range(1, num_classes + 2))
+    if nabirds:
+        ids = ['{:08x}-{:04x}-{:04x}'.format(i * 7919, i % 7, i % 11) for i in range(n)]
+        # NABirds lists parent classes that have no images
+        names = ['Bird species {} (Adult)'.format(c) for c in class_ids]
+    else:
+        ids = [str(i + 1) for i in range(n)]
+        names = ['{:03d}.Bird_{}'.format(c, c) for c in class_ids]
+    image_lines, split_lines, label_lines, box_lines = [], [], [], []
+    for i, id in enumerate(ids):
+        c = class_ids[i % num_classes]
+        path = '{}/{}_{:05d}.jpg'.format(names[c - 1].replace(' ', '_'), c, i)
+        size = images.write(root/'images'/path)
+        image_lines.append('{} {}'.format(id, path))
+        split_lines.append('{} {:d}'.format(id, i // num_classes % 2 == 0))
+        label_lines.append('{} {}'.format(id, c))
+        box_lines.append('{} {:.1f} {:.1f} {:.1f} {:.1f}'.format(id, *_box(size, rng)))
+    files = [('images.txt', image_lines), ('train_test_split.txt', split_lines),
+             ('image_class_labels.txt', label_lines), ('bounding_boxes.txt', box_lines)]
+    if plus:
+        files.append(('cubplus_image_class_labels.txt', label_lines))
+    for fname, lines in files:
+        if nabirds:
+            # NABirds files aren't in image order
+            lines = [lines[i] for i in rng.permutation(len(lines))]
+        _write_lines(root/fname, lines)
+    _write_lines(root/'classes.txt', ['{} {}'.format(c, name) for c, name in zip(class_ids, names)])
+
+
+def _cars(root, n, num_classes, images, rng):
+    from scipy.io import savemat
+    fields = ['bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2', 'class', 'fname']
+    (root/'devkit').mkdir(exist_ok=True)
+    for split, anno_file in [('train', 'cars_train_annos.mat'),
+                             ('test', 'cars_test_annos_withlabels.mat')]:
+        annos = np.zeros((1, n), dtype=[(f, 'O') for f in fields])
+        for i in range(n):
+            fname = '{:05d}.jpg'.format(i + 1)
+            # a few of the real images are grayscale
+            size = images.write(root/'cars_{}'.format(split)/fname, 'L' if i % 50 == 0 else 'RGB')
+            x, y, w, h = _box(size, rng)
+            annos[0, i] = tuple(np.array([[v]]) for v in (x, y, x + w, y + h, i % num_classes + 1)) + (
+                np.array([fname]),)
+        savemat(root/'devkit'/anno_file, {'annotations': annos})
+    names = np.zeros((1, num_classes), dtype=object)
+    for c in range(num_classes):
+        names[0, c] = np.array(['Car Model {}'.format(c)])
+    savemat(root/'devkit'/'cars_meta.mat', {'class_names': names})
+
+
+def _stanford_dogs(root, n, num_classes, images, rng):
+    from scipy.io import savemat
+    for split in ['train', 'test']:
+        files = np.zeros((n, 1), dtype=object)
+        annos = np.zeros((n, 1), dtype=object)
+        labels = np.zeros((n, 1))
+        for i in range(n):
+            c = i % num_classes
+            name = 'n02{:06d}-breed_{}/n02{:06d}_{}{}'.format(c, c, c, split, i)
+            size = images.write(root/'Images'/(name + '.jpg'))
+            files[i, 0], annos[i, 0], labels[i, 0] = np.array([name + '.jpg']), np.array([name]), c + 1
+            objects = []
+            for _ in range(1 + (i % 4 == 0)):
+                x, y, w, h = _box(size, rng)
+                objects.append('<object><name>dog</name><bndbox><xmin>{}</xmin><ymin>{}</ymin>'
+                               '<xmax>{}</xmax><ymax>{}</ymax></bndbox></object>'.format(
+                                   x, y, x + w, y + h))
+            _write_lines(root/'Annotation'/name, [
+                '<annotation><filename>{}</filename>{}</annotation>'.format(name, ''.join(objects))])
+        savemat(root/'{}_list.mat'.format(split),
+                {'file_list': files, 'annotation_list': annos, 'labels': labels})
+
+
+def _tsinghua_dogs(root, n, num_classes, images, rng):
+    for split in ['train', 'validation']:
+        # the lists start with a byte order mark, and paths with './/'
+        lines = ['\ufeff']
+        for i in range(n):
+            name = '{}-breed/{}_{}.jpg'.format(i % num_classes, split, i)
+            size = images.write(root/'low-resolution'/name)
+            lines.append('.//' + name)
+            x, y, w, h = _box(size, rng)
+            _write_lines(root/'Low-Annotations'/(name + '.xml'), [
+                '<annotation><object><bodybndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax>'
+                '<ymax>{}</ymax></bodybndbox></object></annotation>'.format(x, y, x + w, y + h)])
+        _write_lines(root/'TrainAndValList'/(split + '.lst'), lines)
+
+
+def _aircraft(root, n, num_classes, images, rng):
+    boxes = []
+    for s, split in enumerate(['trainval', 'test']):
+        lines = []
+        for i in range(n):
+            name = '{:07d}'.format(s * n + i)
+            size = images.write(root/'data/images'/(name + '.jpg'))
+            lines.append('{} Boeing 7{}7'.format(name, i % num_classes))
+            x, y, w, h = _box(size, rng)
+            boxes.append('{} {} {} {} {}'.format(name, x, y, x + w, y + h))
+        _write_lines(root/'data'/'images_variant_{}.txt'.format(split), lines)
+    _write_lines(root/'data/images_box.txt', boxes)
+
+
+def _flowers(root, n, num_classes, images, rng):
+    from scipy.io import savemat
+    ids = np.arange(1, 2 * n + 1)
+    for i in ids:
+        images.write(root/'jpg'/'image_{:05d}.jpg'.format(i))
+    savemat(root/'imagelabels.mat', {'labels': (ids % num_classes + 1)[None]})
+    # train and val images form the train split
+    savemat(root/'setid.mat', {'trnid': ids[ids % 4 == 0][None], 'valid': ids[ids % 4 == 2][None],
+                               'tstid': ids[ids % 2 == 1][None]})
+
+
+def _fungi(root, n, num_classes, images, rng, prefix='DF20M'):
+    for split, fname in [('train', 'train_metadata_PROD.csv'),
+                         ('test', 'public_test_metadata_PROD.csv')]:
+        lines = ['ImageUniqueID,habitat,image_path,taxonID,species,gbifID']
+        for i in range(n):
+            path = '{}-{}.JPG'.format(split, i)
+            images.write(root/'images'/path)
+            c = i % num_classes
+            lines.append('{},"Mixed woodland, with beech",{},{}.0,Fungus species {},{}'.format(
+                i, path, 10000 + c, c, 2000000 + i))
+        _write_lines(root/'{}-{}'.format(prefix, fname), lines)
+
+
+def _inat_cub(root, n, num_classes, images, rng):
+    lines, boxes = [], []
+    for i in range(n):
+        name = 'species_{}/{:05d}.jpg'.format(i % num_classes, i)
+        size = images.write(root/'images'/name)
+        lines.append(name)
+        boxes.append('{} {} {} {}'.format(*_box(size, rng)))
+    _write_lines(root/'images.txt', lines)
+    _write_lines(root/'bounding_boxes.txt', boxes)
+
+
+# generator of each registered dataset
+FIXTURES = {
+    'CUB': _birds,
+    'CUBPlus': lambda *args: _birds(*args, plus=True),
+    'NABirds': lambda *args: _birds(*args, nabirds=True),
+    'InatCUB': _inat_cub,
+    'StanfordCars': _cars,
+    'StanfordDogs': _stanford_dogs,
+    'TsinghuaDogs': _tsinghua_dogs,
+    'Aircraft': _aircraft,
+    'OxfordFlowers': _flowers,
+    'DanishFungi': _fungi,
+    'DanishFungi20': lambda *args: _fungi(*args, prefix='DF20'),
+}
+
+
+def make_fixture(name, root, num_images=100, num_classes=10, image_size=(500, 375), seed=0):
+    '''Writes a synthetic copy of dataset ``name`` (a registry name) into
+    ``root``, with ``num_images`` images per split (for InatCUB, in total)
+    of about ``image_size`` (w, h) in ``num_classes`` classes. Returns
+    ``root``.'''
+    from . import registry
+    name = registry.info(name).name
+    if num_classes > num_images:
+        raise ValueError('Need at least one image per class')
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    FIXTURES[name](root, num_images, num_classes, _ImageWriter(rng, image_size), rng)
+    return root
+
+
+def make_fixtures(base, names=None, **kwargs):
+    '''Writes fixtures of the datasets ``names`` (all by default) into
+    subfolders of ``base`` named after them. Keyword arguments are passed to
+    ``make_fixture``. Returns ``{name: root}``.'''
+    from . import registry
+    base = Path(base)
+    names = [registry.info(name).name for name in names or FIXTURES]
+    return {name: make_fixture(name, base/name, **kwargs) for name in names}
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Write synthetic FGVC datasets')
+    parser.add_argument('out', help='folder to write the datasets to')
+    parser.add_argument('--datasets', nargs='+', help='datasets to write (default: all)')
+    parser.add_argument('--num-images', type=int, default=100, help='images per split')
+    parser.add_argument('--num-classes', type=int, default=10)
+    parser.add_argument('--image-size', type=int, nargs=2, default=[500, 375],
+                        metavar=('W', 'H'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    roots = make_fixtures(args.out, args.datasets, num_images=args.num_images,
+                          num_classes=args.num_classes, image_size=tuple(args.image_size),
+                          seed=args.seed)
+    for name, root in roots.items():
+        print('Wrote {} to {}'.format(name, os.fspath(root)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,6 @@
 from pathlib import Path
 
-from PIL import Image
-from scipy.io import loadmat
-import torch, torchvision
-
+from . import registry
 from .base import _BaseDataset
 
 
@@ -11,11 +8,13 @@ __all__ = ['OxfordFlowers']
 
 
 def _read_labels(fname):
+    from scipy.io import loadmat
     labels = loadmat(fname)['labels'].ravel()
     return [x.item() for x in labels]
 
 
 def _read_split(fname):
+    from scipy.io import loadmat
     splits = loadmat(fname)
     split = {}
     for k in 'trnid valid tstid'.split():
@@ -31,23 +30,19 @@ class OxfordFlowers(_BaseDataset):
     https://www.robots.ox.ac.uk/~vgg/data/flowers/102/index.html
     '''
     name = 'Oxford Flowers 102'
-    label_file = 'imagelabels.mat'
-    split_file = 'setid.mat'
-    url_files = {
-        '102flowers.tgz':
-        'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/102flowers.tgz',
-        'imagelabels.mat':
-        'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/imagelabels.mat',
-        'setid.mat':
-        'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/setid.mat',
-        'README.txt':
-        'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/README.txt',
-    }
+    label_file, split_file = registry.info('OxfordFlowers').files['train']
+    image_folders = registry.info('OxfordFlowers').imfolder
+    url_files = registry.info('OxfordFlowers').url_files
+    checksums = registry.info('OxfordFlowers').checksums
+
+    def _metadata_files(self):
+        # the image folder is listed, so its mtime is part of the key
+        return [self.image_folders['train' if self.train else 'test'], self.label_file, self.split_file]
 
     def _setup(self):
         if self.load_bboxes:
             raise AttributeError('Oxford Flowers does not have any available bounding boxes')
-        self.imfolder = 'jpg'
+        self.imfolder = self.image_folders['train' if self.train else 'test']
         files = sorted([x.name for x in
                         self.root.joinpath(self.imfolder).iterdir()])
         labels = _read_labels(self.root/self.label_file)
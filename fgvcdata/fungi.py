@@ -1,56 +1,72 @@
+import csv
+from operator import itemgetter
 from pathlib import Path
 
-from PIL import Image
-import torch, torchvision
+import numpy as np
 
+from . import registry
 from .base import _BaseDataset
+from .utils import StringArray
+
+
+__all__ = ['DanishFungi', 'DanishFungi20']
+
+
+def _read_csv_arrow(fpath, columns, dtypes):
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+    types = {c: pa.float64() if c in dtypes else pa.string() for c in columns}
+    table = pacsv.read_csv(fpath, convert_options=pacsv.ConvertOptions(
+        include_columns=columns, column_types=types))
+    return {c: table.column(c).to_numpy().astype(dtypes.get(c, str)) for c in columns}
+
+
+def _read_csv(fpath, columns, dtypes):
+    with open(fpath, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise KeyError('Columns {} not found in {}'.format(missing, fpath))
+        inds = [header.index(c) for c in columns]
+        if len(inds) > 1:
+            getter = itemgetter(*inds)
+        else:
+            getter = lambda row: (row[inds[0]],)
+        # only the wanted fields of each row are kept
+        values = list(zip(*map(getter, reader))) or [()] * len(columns)
+    cols = {}
+    for c, v in zip(columns, values):
+        cols[c] = np.array(v, dtype=str)
+        if c in dtypes:
+            # empty fields are missing values, as pyarrow reads them
+            cols[c] = np.where(cols[c] == '', 'nan', cols[c]).astype(dtypes[c])
+    return cols
+
+
+def read_csv_columns(fpath, columns, dtypes=None):
+    '''Reads the named ``columns`` of a CSV file into arrays: of the type
+    given in ``dtypes`` (a dict) for numeric columns, and strings otherwise.
+    Empty numeric fields are read as NaN. Uses pyarrow if it is installed,
+    and the csv module if not.'''
+    dtypes = dtypes or {}
+    try:
+        import pyarrow.csv
+    except ImportError:
+        return _read_csv(fpath, columns, dtypes)
+    return _read_csv_arrow(fpath, columns, dtypes)
+
+
+def parse_csv(fpath, wanted_key_list):
+    '''Returns the rows of a CSV file as dicts, with the columns and types
+    in the ``(key, type)`` pairs of ``wanted_key_list``. Kept for
+    compatibility; ``read_csv_columns`` is much faster.'''
+    keys = [k for k, _ in wanted_key_list]
+    cols = read_csv_columns(fpath, keys)
+    cols = [[t(x) for x in cols[k].tolist()] for k, t in wanted_key_list]
+    return [dict(zip(keys, row)) for row in zip(*cols)]
 
 
-__all__ = ['DanishFungi']
-
-
-
-def parse_csv(fpath,wanted_key_list):
-    f = open(fpath,'r')
-    lines = [x.strip().split(',') for x in f.readlines()]
-    header = lines[0]
-    #print(header)
-    #print(lines[1])
-    inds = []
-    for k,t in wanted_key_list:
-        for c in range(len(header)):
-            if header[c]==k:
-                inds.append( (k,c,t) )
-    #print(inds)
-    records = []
-    for parts in lines[1:]:
-        p2 = []
-        infrag = False
-        for part in parts:
-            if len(part)==0:
-                p2.append(part)
-            elif infrag:
-                if part[-1]=='"':
-                    p2[-1] += ','+part[:-1]
-                    infrag = False
-                else:
-                    p2[-1] += ','+part
-            elif part[0]=='"':
-                if part[-1]=='"':
-                    p2.append(part[1:-1])
-                else:
-                    p2.append(part[1:])
-                    infrag = True
-            else:
-                p2.append(part)
-        parts = p2
-        #print( len(parts),parts)
-        needed = {k:t(parts[ind]) for k,ind,t in inds}
-        records.append( needed )
-    return records
-    
-    
-    
 def get_images_classes_and_labels( db_data ):
     
     imgs = [x['image_path'] for x in db_data]
@@ -59,7 +75,6 @@ def get_images_classes_and_labels( db_data ):
     classes = sorted(set(lbls))
     classes = dict([ (i,cl) for i,cl in zip(range(1,len(classes)+1),list(classes)) ])
     rev_class = dict([ (classes[i],i) for i in classes.keys() ])
-    #print(rev_class)
     labels = dict([ (i,rev_class[lbl]) for i,lbl in zip(range(1,len(lbls)+1),lbls)])
     return images,classes,labels
 
@@ -69,37 +84,51 @@ class DanishFungi(_BaseDataset):
     Contains 32753 training images and 3640 test images across 139 categories.
     '''
     name = 'DanishFungi'
-    TRAIN_FILE = 'DF20M-train_metadata_PROD.csv'
-    TEST_FILE  = 'DF20M-public_test_metadata_PROD.csv'
+    TRAIN_FILE = registry.info('DanishFungi').files['train'][0]
+    TEST_FILE  = registry.info('DanishFungi').files['test'][0]
+    image_folders = registry.info('DanishFungi').imfolder
     KEY_LIST   = [('ImageUniqueID',str),('image_path',str),('taxonID',lambda x:int(float(x))),('species',str)]
 
+    def _metadata_files(self):
+        return [self.TRAIN_FILE if self.train else self.TEST_FILE]
+
     def _setup(self):
-        self.imfolder = 'images'
-
-        db_data = parse_csv( self.root/(self.TRAIN_FILE if self.train else self.TEST_FILE), self.KEY_LIST )
-
-        images,classes,labels = get_images_classes_and_labels(db_data)
-        split = dict([(i,self.train) for i in images.keys()])
-
-        imgs, targets = [], []
-        cls = set()
-        for id in sorted(images.keys()):
-            if id in labels and split[id] == self.train:
-                imgs.append(images[id])
-                targets.append(labels[id])
-                cls.add(labels[id])
-        self.imgs = imgs
-        self.targets = targets
-
-        self.class_to_idx = {}
-        idx_shift = {}
-        i = 0
-        for k, v in sorted(classes.items()):
-            if k in cls:
-                self.class_to_idx[v] = i
-                idx_shift[k] = i
-                i += 1
-        self.classes = [x[0] for x in sorted(self.class_to_idx.items(),
-                                             key=lambda a:a[1])]
-        self.targets = [idx_shift[i] for i in self.targets]
+        if self.load_bboxes:
+            raise ValueError('Danish Fungi does not have any available bounding boxes, '
+                             'so load_bboxes and crop_to_bbox cannot be used')
+        self.imfolder = self.image_folders['train' if self.train else 'test']
+
+        fname = self.root/(self.TRAIN_FILE if self.train else self.TEST_FILE)
+        # taxonID is read as float, so that missing values are NaN
+        cols = read_csv_columns(fname, [k for k, _ in self.KEY_LIST], {'taxonID': np.float64})
+        missing = np.flatnonzero(np.isnan(cols['taxonID']))
+        if len(missing):
+            # the first row is the header
+            raise ValueError('{} rows of {} have no taxonID, the first on line {}'.format(
+                len(missing), fname, missing[0] + 2))
+        self.imgs = StringArray.from_list(cols['image_path'].tolist())
 
+        # classes are named "species (taxonID)", and sorted by name
+        taxon = cols['taxonID'].astype(np.int64)
+        _, sp_idx = np.unique(cols['species'], return_inverse=True)
+        _, tx_idx = np.unique(taxon, return_inverse=True)
+        _, first, inverse = np.unique(sp_idx.ravel() * (tx_idx.max(initial=0) + 1) + tx_idx.ravel(),
+                                      return_index=True, return_inverse=True)
+        names = ['{} ({})'.format(s, t) for s, t in
+                 zip(cols['species'][first].tolist(), taxon[first].tolist())]
+        classes, idx = np.unique(names, return_inverse=True)
+        self.classes = classes.tolist()
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.targets = idx[inverse.ravel()].astype(np.int32)
+
+
+class DanishFungi20(DanishFungi):
+    '''The full Danish Fungi 2020 (DF20) dataset, of which ``DanishFungi``
+    (DF20-Mini) is a subset.
+    https://sites.google.com/view/danish-fungi-dataset
+    Contains 266344 training images and 29594 test images across 1604 species.
+    '''
+    name = 'DanishFungi20'
+    TRAIN_FILE = registry.info('DanishFungi20').files['train'][0]
+    TEST_FILE  = registry.info('DanishFungi20').files['test'][0]
+    image_folders = registry.info('DanishFungi20').imfolder
@@ -1,8 +1,6 @@
 from pathlib import Path
 
-from PIL import Image
-import torch, torchvision
-
+from . import registry
 from .base import _BaseDataset
 
 
@@ -23,18 +21,22 @@ def _read_inat_file(fname):
 class InatCUB(_BaseDataset):
 
     name = 'iCub'
-    image_file = 'images.txt'
+    image_file = registry.info('InatCUB').files['train'][0]
     bounding_box_file = 'bounding_boxes.txt'
+    image_folders = registry.info('InatCUB').imfolder
 
-    def __init__(self, root, transform=None, target_transform=None, train=False, load_bboxes=False):
+    def __init__(self, root, transform=None, target_transform=None, train=False, **kwargs):
         # train is ignored, there for compatibility
-        self.root = Path(root)
-        if self.root.name in ['train', 'val', 'test']:
-            self.root = self.root.parent
-        self.transform = transform
-        self.target_transform = target_transform
+        super().__init__(root, transform, target_transform, train, **kwargs)
+
+    def _metadata_files(self):
+        files = [self.image_file]
+        if self.load_bboxes:
+            files.append(self.bounding_box_file)
+        return files
 
-        self.imfolder = 'images'
+    def _setup(self):
+        self.imfolder = self.image_folders['train' if self.train else 'test']
 
         images, labels = _read_inat_file(self.root/self.image_file)
         self.classes = sorted(list(set(labels)))
@@ -42,7 +44,7 @@ class InatCUB(_BaseDataset):
         self.targets = [self.class_to_idx[c] for c in labels]
         self.imgs = images
 
-        if load_bboxes:
+        if self.load_bboxes:
             boxes = open(self.root/self.bounding_box_file).read().strip().split('\n')
             bboxes = []
             for box in boxes:
@@ -0,0 +1,251 @@
+'''Caches of decoded images.
+
+Pass an instance as ``image_cache`` to any dataset to keep decoded RGB images
+in memory across epochs, within a byte budget:
+
+    cache = fgvcdata.imcache.SharedImageCache(8 << 30)
+    ds = fgvcdata.CUB(root, transform=..., image_cache=cache)
+
+``ImageCache`` lives in a single process and evicts least recently used
+images. ``SharedImageCache`` keeps images in shared memory, so every
+DataLoader worker on a node reads from and fills the same cache; it must be
+created (and passed to the dataset) in the main process, before the workers
+start. Both count hits, misses and evictions, see ``stats()``.
+
+Images are cached as returned by the dataset's decoder, so with the dataset's
+``decode_size`` set the cache holds reduced-size images. ``put`` also takes
+(H, W, C) arrays, and ``get_array`` returns one, as used by datasets with
+``output='tensor'``.
+'''
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+
+__all__ = ['ImageCache', 'SharedImageCache']
+
+
+class ImageCache(object):
+    '''Per-process LRU cache of decoded images, holding at most ``max_bytes``
+    of pixel data.'''
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def bind(self, size):
+        '''Called by the dataset with its number of images'''
+        pass
+
+    def _lookup(self, index):
+        with self._lock:
+            arr = self._images.get(index)
+            if arr is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._images.move_to_end(index)
+        return arr
+
+    def get(self, index):
+        arr = self._lookup(index)
+        return None if arr is None else Image.fromarray(arr)
+
+    def get_array(self, index):
+        '''Returns the pixels of image ``index`` as an (H, W[, C]) array, or
+        ``None`` if it isn't cached'''
+        arr = self._lookup(index)
+        return None if arr is None else arr.copy()
+
+    def put(self, index, img):
+        arr = np.asarray(img)
+        with self._lock:
+            if arr.nbytes > self.max_bytes or index in self._images:
+                return
+            while self.nbytes + arr.nbytes > self.max_bytes:
+                _, old = self._images.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+            self._images[index] = arr
+            self.nbytes += arr.nbytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    images=len(self), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+
+# slots of the shared control block
+_HEAD, _TAIL, _USED, _COUNT, _HITS, _MISSES, _EVICTIONS = range(7)
+# every entry in the arena starts with an (index, size) header
+_HEADER = 16
+
+
+class SharedImageCache(object):
+    '''Cache of decoded images in shared memory, holding at most ``max_bytes``
+    of pixel data and shared by all processes that use the dataset.
+
+    Images are stored back to back in a ring buffer and the oldest ones are
+    evicted first. When samples are drawn in shuffled order every image is
+    equally likely to be read next, so this gives the same hit rate as LRU
+    without any writes on a hit.
+
+    ``mp_context`` must match the DataLoader's ``multiprocessing_context``
+    when that is not the platform default (e.g. ``'spawn'``).
+    '''
+    def __init__(self, max_bytes, mp_context=None):
+        self.max_bytes = int(max_bytes) // _HEADER * _HEADER
+        self._lock = multiprocessing.get_context(mp_context).Lock()
+        self._arena = shared_memory.SharedMemory(create=True, size=max(self.max_bytes, 1))
+        self._control = shared_memory.SharedMemory(create=True, size=8 * 8)
+        self._table = None
+        self._size = 0
+        self._init_views()
+        self._ctl[:] = 0
+        self._finalizer = weakref.finalize(
+            self, SharedImageCache._unlink, os.getpid(), [self._arena, self._control])
+
+    @staticmethod
+    def _unlink(owner, segments):
+        if os.getpid() != owner:
+            return
+        for shm in segments:
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+
+    def _init_views(self):
+        self._ctl = np.ndarray((8,), dtype=np.int64, buffer=self._control.buf)
+        self._data = np.ndarray((self.max_bytes,), dtype=np.uint8, buffer=self._arena.buf)
+        if self._table is not None:
+            # per image: offset of entry (-1 if absent), height, width, channels
+            self._tab = np.ndarray((self._size, 4), dtype=np.int64, buffer=self._table.buf)
+
+    def bind(self, size):
+        '''Called by the dataset with its number of images; allocates the
+        shared lookup table.'''
+        if self._table is not None:
+            if size != self._size:
+                raise ValueError('SharedImageCache is already bound to a dataset '
+                                 'with {} images'.format(self._size))
+            return
+        self._size = size
+        self._table = shared_memory.SharedMemory(create=True, size=max(size * 32, 1))
+        self._finalizer.detach()
+        self._finalizer = weakref.finalize(
+            self, SharedImageCache._unlink, os.getpid(),
+            [self._arena, self._control, self._table])
+        self._init_views()
+        self._tab[:, 0] = -1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ['_arena', '_control', '_table', '_ctl', '_data', '_tab', '_finalizer']:
+            state.pop(k, None)
+        state['_names'] = (self._arena.name, self._control.name,
+                           None if self._table is None else self._table.name)
+        return state
+
+    def __setstate__(self, state):
+        arena, control, table = state.pop('_names')
+        self.__dict__.update(state)
+        self._arena, self._control = (shared_memory.SharedMemory(name=arena),
+                                      shared_memory.SharedMemory(name=control))
+        self._table = None if table is None else shared_memory.SharedMemory(name=table)
+        self._init_views()
+
+    def get(self, index):
+        arr = self.get_array(index)
+        return None if arr is None else Image.fromarray(arr)
+
+    def get_array(self, index):
+        '''Returns the pixels of image ``index`` as an (H, W[, C]) array, or
+        ``None`` if it isn't cached'''
+        with self._lock:
+            pos, h, w, c = self._tab[index]
+            if pos < 0:
+                self._ctl[_MISSES] += 1
+                return None
+            self._ctl[_HITS] += 1
+            start = pos + _HEADER
+            arr = self._data[start:start + h * w * c].copy()
+        return arr.reshape((h, w, c) if c > 1 else (h, w))
+
+    def put(self, index, img):
+        arr = np.ascontiguousarray(np.asarray(img))
+        h, w = arr.shape[:2]
+        c = arr.shape[2] if arr.ndim == 3 else 1
+        size = -(-(arr.nbytes + _HEADER) // _HEADER) * _HEADER
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._tab[index, 0] >= 0:
+                return
+            pos = self._alloc(size)
+            self._data[pos:pos + _HEADER].view(np.int64)[:] = (index, size)
+            self._data[pos + _HEADER:pos + _HEADER + arr.nbytes] = arr.reshape(-1)
+            self._tab[index] = (pos, h, w, c)
+            self._ctl[_COUNT] += 1
+
+    def _alloc(self, size):
+        ctl = self._ctl
+        while True:
+            head, tail, used = ctl[_HEAD], ctl[_TAIL], ctl[_USED]
+            if used == 0:
+                head = tail = ctl[_HEAD] = ctl[_TAIL] = 0
+            if used == 0 or head > tail:
+                if self.max_bytes - head >= size:
+                    break
+                # not enough room before the end: pad it out and wrap around
+                pad = self.max_bytes - head
+                self._data[head:head + _HEADER].view(np.int64)[:] = (-1, pad)
+                ctl[_USED] += pad
+                ctl[_HEAD] = 0
+            elif tail - head >= size:
+                break
+            else:
+                self._evict()
+        ctl[_HEAD] = (head + size) % self.max_bytes
+        ctl[_USED] += size
+        return head
+
+    def _evict(self):
+        ctl = self._ctl
+        tail = ctl[_TAIL]
+        index, size = self._data[tail:tail + _HEADER].view(np.int64)
+        if index >= 0:
+            self._tab[index, 0] = -1
+            ctl[_COUNT] -= 1
+            ctl[_EVICTIONS] += 1
+        ctl[_TAIL] = (tail + size) % self.max_bytes
+        ctl[_USED] -= size
+
+    def __len__(self):
+        return int(self._ctl[_COUNT])
+
+    def stats(self):
+        ctl = self._ctl
+        return dict(hits=int(ctl[_HITS]), misses=int(ctl[_MISSES]),
+                    evictions=int(ctl[_EVICTIONS]), images=int(ctl[_COUNT]),
+                    nbytes=int(ctl[_USED]), max_bytes=self.max_bytes)
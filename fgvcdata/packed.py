@@ -0,0 +1,161 @@
+'''Packed shard storage for FGVC datasets.
+
+Any dataset in this package can be exported into a few large shard files that
+hold the encoded image bytes back to back, alongside an index with the offset
+and length of every sample, the targets and the bounding boxes:
+
+    out/
+      meta.json              name, and classes and shard count per split
+      train.index.npz        offsets, lengths, targets, bboxes, ...
+      train-00000.shard      concatenated encoded images
+      ...
+
+A split with the same samples as another (InatCUB's train and test data) is
+not packed again; ``meta.json`` records that it shares the other's shards.
+
+``PackedDataset`` reads samples back from the shards through a memory-mapped
+``fgvcdata.store.ImageStore``, and has the same interface as the other
+datasets. The store can also back the regular dataset classes, through their
+``store`` argument. From the command line:
+
+    python -m fgvcdata.packed CUB path/to/CUB_200_2011 path/to/out
+'''
+import json
+from pathlib import Path
+
+import numpy as np
+
+from .base import _BaseDataset
+from .store import META_FILE, ImageStore, _index_name, _shard_name, _split_name
+from .utils import StringArray, flatten_bboxes, unflatten_bboxes
+
+
+__all__ = ['PackedDataset', 'pack']
+
+
+def pack(dataset, out, shard_size=1<<30):
+    '''Writes the images, targets and bounding boxes (if loaded) of ``dataset``
+    into shard files in the folder ``out``. A new shard is started once the
+    current one exceeds ``shard_size`` bytes; with ``shard_size=None`` the
+    whole split goes into one file. Train and test data are packed by calling
+    this once for each split.
+    '''
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    split = _split_name(dataset.train)
+
+    n = len(dataset)
+    shards = np.zeros(n, dtype=np.int32)
+    offsets = np.zeros(n, dtype=np.int64)
+    lengths = np.zeros(n, dtype=np.int64)
+    shard, pos = 0, 0
+    f = open(out/_shard_name(split, shard), 'wb')
+    try:
+        for i in range(n):
+            if shard_size is not None and pos >= shard_size:
+                f.close()
+                shard, pos = shard + 1, 0
+                f = open(out/_shard_name(split, shard), 'wb')
+            with open(dataset.filepath(i), 'rb') as im:
+                data = im.read()
+            f.write(data)
+            shards[i], offsets[i], lengths[i] = shard, pos, len(data)
+            pos += len(data)
+    finally:
+        f.close()
+
+    index = dict(shards=shards, offsets=offsets, lengths=lengths,
+                 targets=np.asarray(dataset.targets, dtype=np.int64),
+                 imgs=StringArray.from_list([str(x) for x in dataset.imgs]).data)
+    bboxes = getattr(dataset, 'bboxes', None)
+    multi = False
+    if bboxes is not None:
+        index['bboxes'], index['bbox_offsets'], multi = flatten_bboxes(bboxes)
+    np.savez(out/_index_name(split), **index)
+
+    meta_file = out/META_FILE
+    meta = json.load(open(meta_file)) if meta_file.is_file() else {'splits': {}}
+    meta.update(name=dataset.name, dataset=dataset.__class__.__name__)
+    # class lists can differ between splits
+    meta['splits'][split] = dict(
+        num_images=n, num_shards=shard + 1, bboxes=bboxes is not None,
+        multi_box=multi, classes=list(dataset.classes),
+        # stored as pairs so that non-string keys survive
+        class_to_idx=[[k, int(v)] for k, v in dataset.class_to_idx.items()])
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f, indent=1)
+    return out
+
+
+def _share_split(out, train, other):
+    '''Records in the folder ``out`` that the split ``train`` has the same
+    samples as the packed split ``other``, and is read from its shards'''
+    meta_file = Path(out)/META_FILE
+    meta = json.load(open(meta_file))
+    meta['splits'][_split_name(train)] = dict(meta['splits'][_split_name(other)],
+                                              shards_of=_split_name(other))
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class PackedDataset(_BaseDataset):
+    '''A dataset read from shards written by ``pack``.
+
+    ``root`` is the folder the shards were written to. Indexing returns the
+    same ``(img, target)`` pairs as the dataset that was packed.
+    '''
+    name = 'Packed'
+
+    def _setup(self):
+        self.store = ImageStore(self.root, self.train)
+        info, index = self.store.info, self.store.index
+        self.name = 'Packed {}'.format(self.store.meta['name'])
+        self.classes = info['classes']
+        self.class_to_idx = {k: v for k, v in info['class_to_idx']}
+        self.imfolder = ''
+        self.imgs = StringArray(index['imgs'])
+        self.targets = index['targets']
+
+        if self.load_bboxes:
+            if not info['bboxes']:
+                raise AttributeError('Bounding boxes were not packed for this dataset')
+            self.bboxes = unflatten_bboxes(
+                index['bboxes'], index['bbox_offsets'], info['multi_box'])
+
+
+def main(args=None):
+    import argparse
+    import fgvcdata
+
+    parser = argparse.ArgumentParser(description='Pack an FGVC dataset into shards')
+    parser.add_argument('dataset', choices=fgvcdata.datasets)
+    parser.add_argument('root', help='root folder of the dataset')
+    parser.add_argument('out', help='folder to write shards to')
+    parser.add_argument('--shard-size', type=int, default=1<<30,
+                        help='approximate shard size in bytes')
+    parser.add_argument('--no-bboxes', action='store_true')
+    args = parser.parse_args(args)
+
+    cls = getattr(fgvcdata, args.dataset)
+    packed = {}
+    for train in (True, False):
+        try:
+            ds = cls(args.root, train=train, load_bboxes=not args.no_bboxes)
+        except AttributeError:
+            # dataset has no bounding boxes
+            ds = cls(args.root, train=train)
+        # splits with the same samples (as in InatCUB) are packed once
+        same = [t for t, other in packed.items() if other.imfolder == ds.imfolder and
+                other.imgs == ds.imgs and np.array_equal(other.targets, ds.targets)]
+        if same:
+            _share_split(args.out, train, same[0])
+            print('{} images are the same as {} images'.format(
+                _split_name(train).capitalize(), _split_name(same[0])))
+            continue
+        pack(ds, args.out, args.shard_size)
+        packed[train] = ds
+        print('Packed {} {} images'.format(len(ds), _split_name(train)))
+
+
+if __name__ == '__main__':
+    main()
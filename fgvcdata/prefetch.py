@@ -0,0 +1,310 @@
+'''Read-ahead of encoded images.
+
+On network file systems, reading an image costs a round trip per file, and
+latency rather than bandwidth bounds the loading rate. A ``Prefetcher``
+passed as ``prefetcher`` to a dataset reads the encoded images of the
+upcoming samples ahead with a pool of ``threads`` threads, so that these
+round trips overlap with each other and with decoding and training. The
+dataset then decodes the prefetched bytes instead of opening the file, and
+still returns ``(img, target)``.
+
+The upcoming samples come from the sampler: ``PrefetchSampler`` wraps a
+sampler and hands each epoch's order to the prefetcher. The order is kept in
+shared memory, so DataLoader workers read ahead too, each the batches it
+will be sent (the DataLoader sends batch ``i`` to worker ``i % num_workers``).
+Like ``SharedImageCache``, the prefetcher must be created in the main process
+before the workers start.
+
+    prefetcher = fgvcdata.prefetch.Prefetcher(depth=64, threads=16)
+    ds = fgvcdata.CUB(root, transform=tf, prefetcher=prefetcher)
+    sampler = fgvcdata.prefetch.PrefetchSampler(RandomSampler(ds), prefetcher, batch_size=64)
+    loader = DataLoader(ds, batch_size=64, sampler=sampler, num_workers=4)
+    ...
+    print(prefetcher.stats())
+
+Each process reads at most ``depth`` images (or one batch) ahead, and stops reading ahead
+while it holds ``max_bytes`` of read data. ``stats`` reports, over all
+processes, how many images were ready when requested, the time spent
+waiting for reads still in flight, and the mean number of images ready and
+in flight at each request.
+'''
+import io
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+
+__all__ = ['PrefetchSampler', 'Prefetcher']
+
+
+# header of the order: generation, length, batch size
+_GENERATION, _LENGTH, _BATCH_SIZE = range(3)
+# per process and summed over requests
+_FIELDS = ('requests', 'hits', 'misses', 'stalls', 'stall_ns', 'ready', 'in_flight', 'bytes',
+           'wasted')
+_STAT = {f: i for i, f in enumerate(_FIELDS)}
+
+# guards setting up each process's state, which threads may race to do
+_setup_lock = threading.Lock()
+
+
+def _read(source):
+    '''Reads an encoded image. Raw ``.npy`` images are memory-mapped when
+    opened, so their paths are returned as they are.'''
+    if str(source).endswith('.npy'):
+        return source
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _buffered(future):
+    '''Bytes held by a read'''
+    if not future.done() or future.cancelled() or future.exception() is not None:
+        return 0
+    data = future.result()
+    return len(data) if isinstance(data, bytes) else 0
+
+
+class Prefetcher(object):
+    '''Reads the images of the order set by ``schedule`` (or a
+    ``PrefetchSampler``) ahead of their use, in the main process and up to
+    ``max_workers`` DataLoader workers. Orders hold up to ``max_samples``
+    indices.'''
+    def __init__(self, depth=16, threads=8, max_bytes=64 << 20, max_samples=1 << 20,
+                 max_workers=16):
+        self.depth = depth
+        self.threads = threads
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.rows = max_workers + 1
+        self._shm = shared_memory.SharedMemory(create=True, size=self._size() * 8)
+        self._init_views()
+        self._header[:] = 0
+        self._stats[:] = 0
+        self._finalizer = weakref.finalize(self, Prefetcher._unlink, os.getpid(), self._shm)
+
+    @staticmethod
+    def _unlink(owner, shm):
+        if os.getpid() != owner:
+            return
+        try:
+            shm.close()
+            shm.unlink()
+        except Exception:
+            pass
+
+    def _size(self):
+        return 3 + self.max_samples + self.rows * len(_FIELDS)
+
+    def _init_views(self):
+        buf = np.ndarray((self._size(),), dtype=np.int64, buffer=self._shm.buf)
+        self._header = buf[:3]
+        self._order = buf[3:3 + self.max_samples]
+        self._stats = buf[3 + self.max_samples:].reshape(self.rows, len(_FIELDS))
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ['_shm', '_header', '_order', '_stats', '_finalizer', '_lock', '_pool',
+                  '_plan', '_window']:
+            state.pop(k, None)
+        state['_name'] = self._shm.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('_name')
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._init_views()
+
+    def schedule(self, order, batch_size=1):
+        '''Sets the order in which the samples will be read, in batches of
+        ``batch_size``. Processes drop what they read ahead of the previous
+        order.'''
+        order = np.asarray(order, dtype=np.int64).reshape(-1)
+        if len(order) > self.max_samples:
+            raise ValueError('Cannot prefetch {} samples, max_samples is {}'.format(
+                len(order), self.max_samples))
+        self._order[:len(order)] = order
+        self._header[_LENGTH] = len(order)
+        self._header[_BATCH_SIZE] = batch_size
+        # last, so that processes see a complete order
+        self._header[_GENERATION] += 1
+
+    def _process_state(self):
+        # the main process uses row 0 and DataLoader worker i row i + 1;
+        # threads don't survive fork, so there is a pool per process
+        if self._pid == os.getpid():
+            return
+        with _setup_lock:
+            if self._pid == os.getpid():
+                return
+            worker = torch.utils.data.get_worker_info()
+            row = 0 if worker is None else worker.id + 1
+            if row >= self.rows:
+                raise ValueError('Prefetcher has room for {} workers, but this is worker '
+                                 '{}'.format(self.rows - 1, row - 1))
+            self._row = row
+            self._rank, self._world_size = (0, 1) if worker is None else (worker.id,
+                                                                         worker.num_workers)
+            self._lock = threading.Lock()
+            self._pool = ThreadPoolExecutor(self.threads)
+            self._generation = 0
+            self._plan = np.zeros(0, dtype=np.int64)
+            self._batch_size = 1
+            # (plan position, index, future) of the reads ahead, in plan order
+            self._window = deque()
+            self._next = 0
+            self._pid = os.getpid()
+
+    def _drop(self, num):
+        '''Drops the ``num`` oldest reads ahead'''
+        for _ in range(num):
+            self._window.popleft()[2].cancel()
+        self._stats[self._row, _STAT['wasted']] += num
+
+    def _load_plan(self):
+        '''Switches to a new order: this process reads the batches at its
+        rank, every ``world_size``-th batch'''
+        generation = int(self._header[_GENERATION])
+        if generation == self._generation:
+            return
+        self._drop(len(self._window))
+        n, b = int(self._header[_LENGTH]), int(self._header[_BATCH_SIZE])
+        pos = np.arange(n)
+        self._plan = self._order[pos[pos // b % self._world_size == self._rank]].copy()
+        self._batch_size, self._next, self._generation = b, 0, generation
+
+    def _take(self, index):
+        '''Removes and returns the read of ``index`` ahead, ``None`` if there
+        is none'''
+        window = self._window
+        for i, (pos, idx, future) in enumerate(window):
+            if idx == index:
+                del window[i]
+                break
+        else:
+            return None
+        # reads of earlier batches that were never requested (e.g. their
+        # images were in the image cache) only take up room
+        start = pos - pos % self._batch_size
+        stale = 0
+        while stale < len(window) and window[stale][0] < start:
+            stale += 1
+        self._drop(stale)
+        return future
+
+    def _resync(self, index):
+        '''Skips ahead to the batch of ``index``, if it comes soon in the
+        plan. Returns whether it does.'''
+        ahead = np.flatnonzero(self._plan[self._next:self._next + 8 * self._depth()] == index)
+        if not len(ahead):
+            return False
+        self._drop(len(self._window))
+        pos = self._next + int(ahead[0])
+        self._next = pos - pos % self._batch_size
+        return True
+
+    def _depth(self):
+        # a batch is requested in on-disk order, so all of it is read ahead
+        return max(self.depth, self._batch_size)
+
+    def _fetch(self, dataset, index):
+        return _read(dataset._raw_source(index))
+
+    def _top_up(self, dataset):
+        window = self._window
+        buffered = sum(_buffered(f) for _, _, f in window)
+        depth = self._depth()
+        while len(window) < depth and self._next < len(self._plan) and \
+                buffered < self.max_bytes:
+            index = int(self._plan[self._next])
+            window.append((self._next, index, self._pool.submit(self._fetch, dataset, index)))
+            self._next += 1
+
+    def open(self, dataset, index):
+        '''Returns the encoded image at ``index`` of ``dataset``: the bytes
+        read ahead as a file object, or the image's source if it wasn't read
+        ahead'''
+        self._process_state()
+        stats = self._stats[self._row]
+        with self._lock:
+            self._load_plan()
+            self._top_up(dataset)
+            future = self._take(index)
+            if future is None and self._resync(index):
+                self._top_up(dataset)
+                future = self._take(index)
+            self._top_up(dataset)
+            ready = sum(f.done() for _, _, f in self._window)
+            stats[_STAT['requests']] += 1
+            stats[_STAT['ready']] += ready
+            stats[_STAT['in_flight']] += len(self._window) - ready
+            if future is None:
+                stats[_STAT['misses']] += 1
+        if future is None:
+            return dataset._raw_source(index)
+        stalled = not future.done()
+        start = time.perf_counter_ns()
+        data = future.result()
+        stall = time.perf_counter_ns() - start
+        with self._lock:
+            stats[_STAT['hits']] += 1
+            if stalled:
+                stats[_STAT['stalls']] += 1
+                stats[_STAT['stall_ns']] += stall
+            if isinstance(data, bytes):
+                stats[_STAT['bytes']] += len(data)
+        return io.BytesIO(data) if isinstance(data, bytes) else data
+
+    def stats(self):
+        '''Returns the read-ahead statistics over all processes: requests,
+        hits (images read ahead) and misses (images read on request), the
+        number and total time of stalls on reads in flight, the mean number
+        of images ready and in flight at each request, the bytes read ahead,
+        and the reads ahead that were never used'''
+        s = {k: int(v) for k, v in zip(_FIELDS, self._stats.sum(axis=0))}
+        requests = max(s['requests'], 1)
+        return dict(requests=s['requests'], hits=s['hits'], misses=s['misses'],
+                    hit_rate=s['hits'] / requests, stalls=s['stalls'],
+                    stall_s=s['stall_ns'] / 1e9,
+                    mean_stall_ms=s['stall_ns'] / max(s['stalls'], 1) / 1e6,
+                    mean_ready=s['ready'] / requests, mean_in_flight=s['in_flight'] / requests,
+                    bytes=s['bytes'], wasted=s['wasted'])
+
+    def reset_stats(self):
+        self._stats[:] = 0
+
+
+class PrefetchSampler(torch.utils.data.Sampler):
+    '''Yields the indices of ``sampler``, after handing the epoch's order to
+    ``prefetcher``. ``batch_size`` is the DataLoader's.'''
+    def __init__(self, sampler, prefetcher, batch_size=1):
+        if len(sampler) > prefetcher.max_samples:
+            raise ValueError('Cannot prefetch {} samples, max_samples is {}'.format(
+                len(sampler), prefetcher.max_samples))
+        self.sampler = sampler
+        self.prefetcher = prefetcher
+        self.batch_size = batch_size
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        # a generator, so the order is drawn once iteration starts
+        order = np.fromiter(self.sampler, dtype=np.int64)
+        self.prefetcher.schedule(order, self.batch_size)
+        yield from order.tolist()
+
+    def __len__(self):
+        return len(self.sampler)
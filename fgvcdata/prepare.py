@@ -0,0 +1,185 @@
+'''Offline resizing and re-encoding of dataset images.
+
+Writes a derived copy of a dataset's image folder, with every image shrunk to
+a maximum side or short side length and re-encoded, using a process pool:
+
+    python -m fgvcdata.prepare CUB path/to/CUB_200_2011 path/to/cub-448 \\
+        --short-side 448 --format jpeg --quality 90
+
+The dataset classes read the derived copy when given ``image_root``, with
+their metadata still coming from ``root``; loaded bounding boxes are scaled
+to match the resized images:
+
+    ds = fgvcdata.CUB('path/to/CUB_200_2011', image_root='path/to/cub-448')
+
+Conversion can be interrupted and resumed: images that already exist in the
+output are skipped. The manifest ``prepared.json`` records the settings
+before any image is written, and is marked complete last. Resuming with
+other settings is refused; ``--overwrite`` converts all images again.
+'''
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .base import _derived_name, _image_size, _open_image
+
+
+__all__ = ['prepare', 'MANIFEST_FILE']
+
+
+MANIFEST_FILE = 'prepared.json'
+
+FORMATS = {
+    # format: (PIL format, file suffix); None keeps the original suffix
+    'jpeg': ('JPEG', None),
+    'webp': ('WEBP', '.webp'),
+    'png': ('PNG', '.png'),
+    'raw': (None, '.npy'),
+}
+
+
+def scales_file(split):
+    return 'scales-{}.npy'.format(split)
+
+
+def _target_size(size, max_side=None, short_side=None):
+    w, h = size
+    s = 1.0
+    if max_side is not None:
+        s = min(s, max_side / max(w, h))
+    if short_side is not None:
+        s = min(s, short_side / min(w, h))
+    return max(1, round(w * s)), max(1, round(h * s))
+
+
+def _convert(task):
+    '''Converts one image; returns the (x, y) scale factors that were applied.'''
+    src, dst, fmt, quality, max_side, short_side = task
+    size = Image.open(src).size
+    if not os.path.isfile(dst):
+        new_size = _target_size(size, max_side, short_side)
+        # decode no larger than needed, then resize exactly
+        img = _open_image(src, (new_size[1], new_size[0])).convert('RGB')
+        if img.size != new_size:
+            img = img.resize(new_size, Image.BICUBIC)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        pil_format, _ = FORMATS[fmt]
+        if pil_format is None:
+            with open(tmp, 'wb') as f:
+                np.save(f, np.asarray(img))
+        else:
+            img.save(tmp, pil_format, quality=quality)
+        os.replace(tmp, dst)
+    w, h = _image_size(dst)
+    return w / size[0], h / size[1]
+
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
+
+
+def _start(out, settings, dsts, overwrite):
+    '''Checks that the images already in ``out`` were written with
+    ``settings``, or removes them with ``overwrite``. Then records the
+    settings, before any image is written.'''
+    fname = out/MANIFEST_FILE
+    if overwrite:
+        # the manifest goes first, so that an interrupted removal is refused
+        _remove(fname)
+        for dst in dsts:
+            _remove(dst)
+    elif fname.is_file():
+        with open(fname) as f:
+            old = json.load(f)
+        changed = ['{} {!r} (not {!r})'.format(k, old.get(k), v)
+                   for k, v in settings.items() if old.get(k) != v]
+        if changed:
+            raise ValueError('{} was prepared with {}; use overwrite to convert all images '
+                             'again'.format(out, ', '.join(changed)))
+    elif out.is_dir() and any(out.iterdir()):
+        raise ValueError('{} is not empty and has no {}, so the settings of its images are '
+                         'unknown; use overwrite to convert all images again'.format(
+                             out, MANIFEST_FILE))
+    out.mkdir(parents=True, exist_ok=True)
+    with open(fname, 'w') as f:
+        json.dump(dict(settings, complete=False), f, indent=1)
+
+
+def prepare(cls, root, out, max_side=None, short_side=None, format='jpeg',
+            quality=90, workers=None, overwrite=False, **kwargs):
+    '''Writes resized and re-encoded copies of all images (train and test) of
+    the dataset class ``cls`` with data in ``root`` to the folder ``out``.
+    Images already in ``out`` are kept if they were written with the same
+    settings, and a ``ValueError`` is raised otherwise; with ``overwrite``
+    all images are converted again. Extra keyword arguments are passed to
+    the dataset constructor.'''
+    out = Path(out)
+    suffix = FORMATS[format][1]
+    settings = dict(dataset=cls.__name__, format=format, suffix=suffix,
+                    quality=quality, max_side=max_side, short_side=short_side)
+    splits = {}
+    for train in (True, False):
+        ds = cls(root, train=train, **kwargs)
+        splits['train' if train else 'test'] = ds
+
+    tasks, seen = [], set()
+    for ds in splits.values():
+        for i, img in enumerate(ds.imgs):
+            dst = out/ds.imfolder/_derived_name(img, suffix)
+            if dst in seen:
+                continue
+            seen.add(dst)
+            tasks.append((str(ds.filepath(i)), str(dst), format, quality,
+                          max_side, short_side))
+    _start(out, settings, [t[1] for t in tasks], overwrite)
+
+    with ProcessPoolExecutor(workers) as pool:
+        scales = pool.map(_convert, tasks, chunksize=64)
+        scales = {t[1]: s for t, s in zip(tasks, scales)}
+
+    for split, ds in splits.items():
+        s = [scales[str(out/ds.imfolder/_derived_name(img, suffix))] for img in ds.imgs]
+        np.save(out/scales_file(split), np.array(s, dtype=np.float32).reshape(-1, 2))
+
+    manifest = dict(settings, num_images={k: len(v) for k, v in splits.items()},
+                    complete=True)
+    with open(out/MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return out
+
+
+def main(args=None):
+    import argparse
+    import fgvcdata
+
+    parser = argparse.ArgumentParser(description='Resize and re-encode the images of an FGVC dataset')
+    parser.add_argument('dataset', choices=fgvcdata.datasets)
+    parser.add_argument('root', help='root folder of the dataset')
+    parser.add_argument('out', help='folder to write the derived images to')
+    parser.add_argument('--max-side', type=int, help='maximum length of the longer side')
+    parser.add_argument('--short-side', type=int, help='maximum length of the shorter side')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='jpeg')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG/WebP quality')
+    parser.add_argument('--workers', type=int, help='number of processes (default: all cores)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='convert all images again, even if they exist in out')
+    args = parser.parse_args(args)
+
+    try:
+        prepare(getattr(fgvcdata, args.dataset), args.root, args.out, args.max_side,
+                args.short_side, args.format, args.quality, args.workers, args.overwrite)
+    except ValueError as e:
+        parser.error(str(e))
+    print('Prepared images in {}'.format(args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+'''Per-stage timing of dataset reads.
+
+Pass a ``Profiler`` as ``profiler`` to any dataset (or set
+``dataset.profiler``) to time every stage of ``__getitem__``:
+
+- ``read``: reading the encoded image file, also counting the bytes read.
+  To time it apart from decoding, the file is read into memory first;
+  images from a packed store or a ``Prefetcher`` are in memory already, and
+  raw ``.npy`` images are read while opening them, so neither has this stage
+- ``open``: parsing the image header (and, with ``crop_to_bbox`` or a
+  non-JPEG ``decode_size``, cropping or reducing it, which decodes)
+- ``decode``: decoding the pixels (all of ``output='tensor'`` decoding)
+- ``convert``: ``.convert('RGB')``
+- ``transform``: the dataset's ``transform``
+- ``getitem``: all of ``__getitem__``; images served by the ``image_cache``
+  show up here without the other stages
+
+Timings go to log-spaced histograms in shared memory, so all DataLoader
+workers on a node record into the same profiler; like ``SharedImageCache``,
+it must be created in the main process before the workers start. The main
+process writes row 0 and DataLoader worker ``i`` row ``i + 1``, so there is
+no locking across processes; a profiler therefore serves one DataLoader at
+a time, as the workers of two concurrent loaders would share rows. With
+``trace_events``, the latest events of every process are also kept, and
+``write_trace`` saves them as a Chrome trace (open it in Perfetto or
+chrome://tracing):
+
+    profiler = fgvcdata.profiling.Profiler(max_workers=8, trace_events=100000)
+    ds = fgvcdata.CUB(root, transform=tf, profiler=profiler)
+    ...
+    print(profiler.report())
+    profiler.write_trace('trace.json')
+
+Datasets mark the stages of their own decode path through ``stages``, so
+the profiled path is the one that runs without a profiler; there, the marks
+are no-ops.
+'''
+import io
+import json
+import math
+import os
+import threading
+import time
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+__all__ = ['STAGES', 'Profiler']
+
+
+STAGES = ('getitem', 'read', 'open', 'decode', 'convert', 'transform')
+_STAGE = {s: i for i, s in enumerate(STAGES)}
+
+# histogram bins are quarter octaves of nanoseconds, from 1us to 32s
+_BINS_PER_OCTAVE = 4
+_FIRST_OCTAVE = 10
+_NUM_BINS = 25 * _BINS_PER_OCTAVE
+# per stage: count, total ns, bytes
+_COUNT, _TOTAL, _BYTES = range(3)
+# per event: stage, start ns, duration ns, sample index, thread id
+_EVENT_FIELDS = 5
+
+# guards setting up each process's row, which decode threads may race to do
+_setup_lock = threading.Lock()
+
+
+class _Timer(object):
+    '''Context manager that records the time spent in it as ``stage``'''
+    __slots__ = ('profiler', 'stage', 'index', 'start')
+
+    def __init__(self, profiler, stage, index):
+        self.profiler, self.stage, self.index = profiler, stage, index
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.profiler.record(self.stage, self.start, time.perf_counter_ns(), self.index)
+        return False
+
+
+class _Stages(object):
+    '''The stages of one sample, as returned by ``Profiler.stages``'''
+    def __init__(self, profiler, index):
+        self.profiler, self.index = profiler, index
+
+    def __call__(self, stage):
+        return _Timer(self.profiler, stage, self.index)
+
+    def read(self, source):
+        '''Reads an image file into memory, timed as the ``read`` stage'''
+        if hasattr(source, 'read') or str(source).endswith('.npy'):
+            return source
+        start = time.perf_counter_ns()
+        with open(source, 'rb') as f:
+            data = f.read()
+        self.profiler.record('read', start, time.perf_counter_ns(), self.index, len(data))
+        return io.BytesIO(data)
+
+
+class Profiler(object):
+    '''Histograms of stage timings of the main process and up to
+    ``max_workers`` DataLoader workers, in shared memory. With
+    ``trace_events``, the last ``trace_events`` events of each process are
+    kept for ``write_trace``. Use a separate profiler for each DataLoader
+    that runs at the same time.
+    '''
+    def __init__(self, max_workers=16, trace_events=0):
+        self.rows = max_workers + 1
+        self.trace_events = trace_events
+        sizes = self._sizes()
+        self._shm = shared_memory.SharedMemory(create=True, size=sum(sizes) * 8)
+        self._init_views()
+        self.reset()
+        self._finalizer = weakref.finalize(self, Profiler._unlink, os.getpid(), self._shm)
+
+    @staticmethod
+    def _unlink(owner, shm):
+        if os.getpid() != owner:
+            return
+        try:
+            shm.close()
+            shm.unlink()
+        except Exception:
+            pass
+
+    def _sizes(self):
+        n = len(STAGES)
+        # histograms, totals, pids, event counts, events
+        return [self.rows * n * _NUM_BINS, self.rows * n * 3, self.rows, self.rows,
+                self.rows * self.trace_events * _EVENT_FIELDS]
+
+    def _init_views(self):
+        views, offset = [], 0
+        for size in self._sizes():
+            views.append(np.ndarray((size,), dtype=np.int64, buffer=self._shm.buf, offset=offset * 8))
+            offset += size
+        n = len(STAGES)
+        self._hist = views[0].reshape(self.rows, n, _NUM_BINS)
+        self._totals = views[1].reshape(self.rows, n, 3)
+        self._pids = views[2]
+        self._num_events = views[3]
+        self._events = views[4].reshape(self.rows, self.trace_events, _EVENT_FIELDS)
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ['_shm', '_hist', '_totals', '_pids', '_num_events', '_events',
+                  '_finalizer', '_lock']:
+            state.pop(k, None)
+        state['_name'] = self._shm.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('_name')
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._init_views()
+
+    def reset(self):
+        '''Clears all recorded timings and events'''
+        self._hist[:] = 0
+        self._totals[:] = 0
+        self._pids[:] = 0
+        self._num_events[:] = 0
+
+    def _process_row(self):
+        # the main process uses row 0 and DataLoader worker i row i + 1
+        if self._pid == os.getpid():
+            return self._row
+        with _setup_lock:
+            if self._pid != os.getpid():
+                import torch.utils.data
+                worker = torch.utils.data.get_worker_info()
+                row = 0 if worker is None else worker.id + 1
+                if row >= self.rows:
+                    raise ValueError('Profiler has room for {} workers, but this is worker '
+                                     '{}'.format(self.rows - 1, row - 1))
+                self._pids[row] = os.getpid()
+                self._row, self._lock = row, threading.Lock()
+                # last, so that other threads only skip the lock once all is set
+                self._pid = os.getpid()
+        return self._row
+
+    def record(self, stage, start, end, index=-1, nbytes=0):
+        '''Records that ``stage`` of sample ``index`` ran from ``start`` to
+        ``end`` (``time.perf_counter_ns`` values), reading ``nbytes``'''
+        row, s, ns = self._process_row(), _STAGE[stage], end - start
+        b = min(_NUM_BINS - 1, max(0, int(_BINS_PER_OCTAVE * math.log2(max(ns, 1)))
+                                   - _BINS_PER_OCTAVE * _FIRST_OCTAVE))
+        with self._lock:
+            self._hist[row, s, b] += 1
+            totals = self._totals[row, s]
+            totals[_COUNT] += 1
+            totals[_TOTAL] += ns
+            totals[_BYTES] += nbytes
+            if self.trace_events:
+                n = self._num_events[row]
+                self._events[row, n % self.trace_events] = (
+                    s, start, ns, index, threading.get_native_id())
+                self._num_events[row] = n + 1
+
+    def stages(self, index):
+        '''Returns the stages of sample ``index``, which datasets mark while
+        reading it: ``with stages('decode'): ...`` times the block as the
+        ``decode`` stage, and ``stages.read(source)`` reads an image file.'''
+        return _Stages(self, index)
+
+    def histograms(self):
+        '''Returns the bin edges in milliseconds, and ``{stage: counts}``
+        summed over all processes'''
+        edges = 2.0 ** (np.arange(_NUM_BINS + 1) / _BINS_PER_OCTAVE + _FIRST_OCTAVE) / 1e6
+        hist = self._hist.sum(axis=0)
+        return edges, {s: hist[i].copy() for i, s in enumerate(STAGES)}
+
+    def summary(self):
+        '''Returns ``{stage: stats}`` over all processes: the count, total
+        and mean time, percentiles (upper edges of the histogram bins, in
+        ms) and bytes read'''
+        edges, hists = self.histograms()
+        totals = self._totals.sum(axis=0)
+        result = {}
+        for i, stage in enumerate(STAGES):
+            count, total, nbytes = (int(x) for x in totals[i])
+            if not count:
+                continue
+            cum = np.cumsum(hists[stage])
+            stats = dict(count=count, total_s=total / 1e9, mean_ms=total / count / 1e6)
+            for q in (50, 90, 99):
+                stats['p{}_ms'.format(q)] = float(edges[1 + np.searchsorted(cum, count * q / 100)])
+            if nbytes:
+                stats['bytes'] = nbytes
+                stats['mb_per_s'] = nbytes / 2**20 / (total / 1e9)
+            result[stage] = stats
+        return result
+
+    def report(self):
+        '''Returns the summary as a table'''
+        lines = ['{:<10} {:>8} {:>10} {:>9} {:>9} {:>9} {:>10}'.format(
+            'stage', 'count', 'total s', 'mean ms', 'p50 ms', 'p99 ms', 'MB/s')]
+        for stage, s in self.summary().items():
+            lines.append('{:<10} {:>8} {:>10.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10}'.format(
+                stage, s['count'], s['total_s'], s['mean_ms'], s['p50_ms'], s['p99_ms'],
+                '{:.1f}'.format(s['mb_per_s']) if 'mb_per_s' in s else ''))
+        return '\n'.join(lines)
+
+    def trace(self):
+        '''Returns the kept events as Chrome trace events'''
+        events = []
+        for row in range(self.rows):
+            n = int(self._num_events[row])
+            if not n:
+                continue
+            pid = int(self._pids[row])
+            name = 'main' if row == 0 else 'worker {}'.format(row - 1)
+            events.append(dict(name='process_name', ph='M', pid=pid, args=dict(name=name)))
+            kept = self._events[row, :min(n, self.trace_events)]
+            for stage, start, ns, index, tid in kept[np.argsort(kept[:, 1])].tolist():
+                events.append(dict(name=STAGES[stage], ph='X', ts=start / 1e3, dur=ns / 1e3,
+                                   pid=pid, tid=tid, args=dict(index=index)))
+        return events
+
+    def write_trace(self, fname):
+        '''Writes the kept events as a Chrome trace JSON file'''
+        with open(fname, 'w') as f:
+            json.dump(dict(traceEvents=self.trace(), displayTimeUnit='ms'), f)
@@ -0,0 +1,242 @@
+'''Static descriptions of the supported datasets.
+
+Every dataset is described by a ``DatasetInfo``: the module and class that
+implement it, its metadata files and image folder for each split, its download
+URLs, and the number of classes and samples. The registry imports none of the
+dataset modules, so scripts can pick datasets by name and check their roots
+without constructing a dataset or parsing any metadata:
+
+    fgvcdata.registry.names()
+    fgvcdata.registry.info('nabirds').num_samples
+    fgvcdata.registry.check('nabirds', root, count_images=True)
+    fgvcdata.registry.is_cached('nabirds', root, train=True)
+    ds = fgvcdata.get('nabirds', root, train=False)
+'''
+import importlib
+import os
+from pathlib import Path
+
+
+__all__ = ['DatasetInfo', 'check', 'get', 'info', 'is_cached', 'names', 'register']
+
+
+SPLITS = ('train', 'test')
+
+
+def _per_split(value):
+    if isinstance(value, dict):
+        return dict(value)
+    return {s: value for s in SPLITS}
+
+
+class DatasetInfo(object):
+    '''Description of the dataset class ``name`` in module ``module`` (an
+    absolute module name, or one relative to fgvcdata such as ``'.birds'``).
+
+    ``files`` (a list of paths relative to root), ``imfolder`` and
+    ``num_samples`` are given per split, as a dict with ``'train'`` and
+    ``'test'`` keys, or as one value shared by both splits. Counts are
+    ``None`` where they aren't known. ``checksums`` holds the published
+    checksums of the files in ``url_files``, as for
+    ``fgvcdata.download.download_files``.
+    '''
+    def __init__(self, name, module, title, files, imfolder, url_files=None,
+                 num_classes=None, num_samples=None, checksums=None):
+        self.name = name
+        self.module = module
+        self.title = title
+        self.files = _per_split(files)
+        self.imfolder = _per_split(imfolder)
+        self.url_files = dict(url_files or {})
+        self.num_classes = num_classes
+        self.num_samples = _per_split(num_samples)
+        self.checksums = dict(checksums or {})
+
+    @property
+    def cls(self):
+        '''The dataset class; imports its module'''
+        return getattr(importlib.import_module(self.module, __package__), self.name)
+
+    def __repr__(self):
+        return 'DatasetInfo({!r}, classes={}, samples={})'.format(
+            self.name, self.num_classes, self.num_samples)
+
+
+_registry = {}
+
+
+def register(info):
+    '''Adds a ``DatasetInfo`` to the registry, replacing any entry of the same
+    name. Returns ``info``.'''
+    _registry[info.name] = info
+    return info
+
+
+def names():
+    '''Returns the names of all registered datasets'''
+    return list(_registry)
+
+
+def info(name):
+    '''Returns the ``DatasetInfo`` of dataset ``name`` (case-insensitive)'''
+    if name in _registry:
+        return _registry[name]
+    for k, v in _registry.items():
+        if k.lower() == name.lower():
+            return v
+    raise KeyError('Unknown dataset {!r}; choose from {}'.format(name, ', '.join(_registry)))
+
+
+def _count_files(folder):
+    return sum(len(files) for _, _, files in os.walk(folder))
+
+
+def check(name, root, train=None, count_images=False):
+    '''Checks that ``root`` holds the metadata files and image folder of
+    dataset ``name``, for one split (``train``) or both (``None``). With
+    ``count_images``, image folders are also checked to hold at least as
+    many files as the dataset has images. Returns a list of problems, empty
+    if there are none.'''
+    desc = info(name)
+    root = Path(root)
+    if not root.is_dir():
+        return ['{} is not a folder'.format(root)]
+    splits = SPLITS if train is None else [SPLITS[0] if train else SPLITS[1]]
+    problems = []
+    folders = []
+    for split in splits:
+        for f in desc.files[split]:
+            if not (root/f).exists():
+                problems.append('Missing {} file {}'.format(split, root/f))
+        folder = desc.imfolder[split]
+        if not (root/folder).is_dir():
+            problems.append('Missing {} image folder {}'.format(split, root/folder))
+        elif folder not in folders:
+            folders.append(folder)
+    if count_images:
+        for folder in folders:
+            # a folder can hold the images of both splits
+            expected = [desc.num_samples[s] for s in SPLITS if desc.imfolder[s] == folder]
+            if None in expected:
+                continue
+            found = _count_files(root/folder)
+            if found < sum(expected):
+                problems.append('Found {} files in {}, expected at least {}'.format(
+                    found, root/folder, sum(expected)))
+    return problems
+
+
+def is_cached(name, root, train=True, load_bboxes=False):
+    '''Returns whether the parsed metadata of a split of dataset ``name`` is
+    in the metadata cache (see ``fgvcdata.cache``), so that constructing it
+    won't parse any annotation files. As for the dataset, a ``root`` ending
+    in ``/train`` or ``/test`` overrides ``train``.'''
+    from . import cache
+    from .base import _split_root
+    cls = info(name).cls
+    # only the attributes that key the cache are needed
+    ds = cls.__new__(cls)
+    ds.root, ds.train = _split_root(root, train)
+    ds.load_bboxes = load_bboxes
+    fname = cache._cache_file(ds)
+    return fname is not None and fname.is_file()
+
+
+def get(name, root, validate=False, **kwargs):
+    '''Constructs dataset ``name`` (case-insensitive) with data in ``root``.
+    Keyword arguments go to the dataset class. With ``validate``, ``root`` is
+    checked first (see ``check``), raising ``FileNotFoundError`` on problems.'''
+    desc = info(name)
+    if validate and not kwargs.get('download', False):
+        from .base import _split_root
+        split_root, train = _split_root(root, kwargs.get('train', True))
+        problems = check(desc.name, split_root, train)
+        if problems:
+            raise FileNotFoundError('{} in {}: {}'.format(desc.name, split_root, '; '.join(problems)))
+    return desc.cls(root, **kwargs)
+
+
+_BIRD_FILES = ['images.txt', 'train_test_split.txt', 'classes.txt',
+               'image_class_labels.txt']
+
+register(DatasetInfo(
+    'CUB', '.birds', 'Caltech UCSD Birds (CUB)', _BIRD_FILES, 'images',
+    url_files={
+        'CUB_200_2011.tgz':
+            'http://www.vision.caltech.edu/visipedia-data/CUB-200-2011/CUB_200_2011.tgz',
+        'README.txt':
+            'http://www.vision.caltech.edu/visipedia-data/CUB-200-2011/README.txt'},
+    checksums={'CUB_200_2011.tgz': 'md5:97eceeb196236b17998738112f37df78'},
+    num_classes=200, num_samples={'train': 5994, 'test': 5794}))
+
+register(DatasetInfo(
+    'CUBPlus', '.birds', 'Caltech UCSD Birds (CUB++)',
+    _BIRD_FILES[:3] + ['cubplus_image_class_labels.txt'], 'images', num_classes=200))
+
+register(DatasetInfo(
+    'NABirds', '.birds', 'NABirds', _BIRD_FILES, 'images',
+    num_classes=555, num_samples={'train': 23929, 'test': 24633}))
+
+register(DatasetInfo('InatCUB', '.icub', 'iCub', ['images.txt'], 'images'))
+
+register(DatasetInfo(
+    'StanfordCars', '.cars', 'Stanford Cars',
+    {'train': ['devkit/cars_train_annos.mat', 'devkit/cars_meta.mat'],
+     'test': ['devkit/cars_test_annos_withlabels.mat', 'devkit/cars_meta.mat']},
+    {'train': 'cars_train', 'test': 'cars_test'},
+    url_files={
+        'cars_train.tgz': 'http://imagenet.stanford.edu/internal/car196/cars_train.tgz',
+        'cars_test.tgz': 'http://imagenet.stanford.edu/internal/car196/cars_test.tgz',
+        'car_devkit.tgz': 'https://ai.stanford.edu/~jkrause/cars/car_devkit.tgz'},
+    checksums={
+        'cars_train.tgz': 'md5:065e5b463ae28d29e77c1b4b166cfe61',
+        'cars_test.tgz': 'md5:4ce7ebf6a94d07f1952d94dd34c4d501',
+        'car_devkit.tgz': 'md5:c3b158d763b6e2245038c8ad08e45376'},
+    num_classes=196, num_samples={'train': 8144, 'test': 8041}))
+
+register(DatasetInfo(
+    'StanfordDogs', '.dogs', 'Stanford Dogs',
+    {'train': ['train_list.mat'], 'test': ['test_list.mat']}, 'Images',
+    url_files={
+        'images.tar': 'http://vision.stanford.edu/aditya86/ImageNetDogs/images.tar',
+        'annotations.tar': 'http://vision.stanford.edu/aditya86/ImageNetDogs/annotation.tar',
+        'lists.tar': 'http://vision.stanford.edu/aditya86/ImageNetDogs/lists.tar',
+        'README.txt': 'http://vision.stanford.edu/aditya86/ImageNetDogs/README.txt'},
+    num_classes=120, num_samples={'train': 12000, 'test': 8580}))
+
+register(DatasetInfo(
+    'TsinghuaDogs', '.dogs', 'Tsinghua Dogs',
+    {'train': ['TrainAndValList/train.lst'], 'test': ['TrainAndValList/validation.lst']},
+    'low-resolution', num_classes=130, num_samples={'train': 65228, 'test': 5200}))
+
+register(DatasetInfo(
+    'Aircraft', '.aircraft', 'FGVC Aircraft',
+    {'train': ['data/images_variant_trainval.txt'], 'test': ['data/images_variant_test.txt']},
+    'data/images',
+    url_files={
+        'fgvc-aircraft-2013b.tar.gz':
+            'http://www.robots.ox.ac.uk/~vgg/data/fgvc-aircraft/archives/fgvc-aircraft-2013b.tar.gz'},
+    num_classes=100, num_samples={'train': 6667, 'test': 3333}))
+
+register(DatasetInfo(
+    'OxfordFlowers', '.flowers', 'Oxford Flowers 102', ['imagelabels.mat', 'setid.mat'], 'jpg',
+    url_files={
+        '102flowers.tgz': 'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/102flowers.tgz',
+        'imagelabels.mat': 'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/imagelabels.mat',
+        'setid.mat': 'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/setid.mat',
+        'README.txt': 'https://www.robots.ox.ac.uk/~vgg/data/flowers/102/README.txt'},
+    checksums={
+        '102flowers.tgz': 'md5:52808999861908f626f3c1f4e79d11fa',
+        'imagelabels.mat': 'md5:e0620be6f572b9609742df49c70aed4d',
+        'setid.mat': 'md5:a5357ecc9cb78c4bef273ce3793fc85c'},
+    num_classes=102, num_samples={'train': 2040, 'test': 6149}))
+
+register(DatasetInfo(
+    'DanishFungi', '.fungi', 'DanishFungi',
+    {'train': ['DF20M-train_metadata_PROD.csv'], 'test': ['DF20M-public_test_metadata_PROD.csv']},
+    'images', num_classes=139, num_samples={'train': 32753, 'test': 3640}))
+
+register(DatasetInfo(
+    'DanishFungi20', '.fungi', 'DanishFungi20',
+    {'train': ['DF20-train_metadata_PROD.csv'], 'test': ['DF20-public_test_metadata_PROD.csv']},
+    'images', num_classes=1604, num_samples={'train': 266344, 'test': 29594}))
@@ -0,0 +1,225 @@
+'''Class-aware samplers for imbalanced datasets.
+
+Every sampler groups the sample indices by class once, from the dataset's
+``targets`` array (see ``class_index``), and draws each epoch's indices with
+a few vectorized NumPy operations:
+
+- ``ClassBalancedSampler`` draws classes uniformly, then an image of the class
+- ``SqrtFrequencySampler`` draws classes in proportion to the square root of
+  their size, between instance-balanced and class-balanced sampling
+- ``ClassWeightedSampler`` draws classes in proportion to any power of their size
+- ``PKSampler`` yields batches of ``p`` distinct classes with ``k`` images
+  each, for metric learning
+
+Epochs are seeded with ``seed`` and ``set_epoch``, as for
+``DistributedSampler``. With ``shard`` set to ``'auto'`` or
+``(rank, world_size)``, every rank draws the same epoch and keeps every
+``world_size``-th index (or batch), so ranks don't overlap. Datasets that are
+already sharded should use the default ``shard=None``.
+
+    sampler = fgvcdata.samplers.SqrtFrequencySampler(ds, shard='auto')
+    loader = DataLoader(ds, batch_size=64, sampler=sampler)
+
+``python -m fgvcdata.samplers`` times the samplers on synthetic long-tailed
+targets.
+'''
+import time
+
+import numpy as np
+import torch
+
+from .distributed import resolve_shard
+from .utils import RaggedArray
+
+
+__all__ = ['ClassBalancedSampler', 'ClassWeightedSampler', 'PKSampler',
+           'SqrtFrequencySampler', 'class_index']
+
+
+def class_index(targets, num_classes=None):
+    '''Groups sample indices by class. Returns a ``RaggedArray`` whose item
+    ``c`` holds the indices of the samples of class ``c``, in order.'''
+    targets = np.asarray(targets, dtype=np.int64)
+    counts = np.bincount(targets, minlength=num_classes or 0)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return RaggedArray(np.argsort(targets, kind='stable'), offsets)
+
+
+def _targets(data):
+    '''The targets array of a dataset, or ``data`` itself'''
+    return np.asarray(getattr(data, 'targets', data), dtype=np.int64)
+
+
+class _ClassSampler(torch.utils.data.Sampler):
+    '''Base class of the class-aware samplers. Subclasses set
+    ``num_samples`` (per rank) and implement ``_draw(rng, size)``, drawing
+    ``size`` indices (``size`` batches for ``PKSampler``) for all ranks.'''
+    def __init__(self, data, shard=None, seed=0):
+        self.index = class_index(_targets(data))
+        self.counts = np.diff(self.index.offsets)
+        self.rank, self.world_size = (0, 1) if shard is None else resolve_shard(shard)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _rng(self):
+        # the same on every rank
+        return np.random.default_rng([self.seed, self.epoch])
+
+    def indices(self):
+        '''Returns this rank's indices for the current epoch, as an array'''
+        return self._draw(self._rng(), self.num_samples * self.world_size)[
+            self.rank::self.world_size]
+
+    def __iter__(self):
+        return iter(self.indices().tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class ClassWeightedSampler(_ClassSampler):
+    '''Samples with replacement, drawing a class with probability
+    proportional to its number of samples to the power ``power``, then a
+    sample of that class uniformly. ``power=1`` is the usual uniform
+    sampling of images and ``power=0`` class-balanced sampling.
+
+    Each epoch has ``num_samples`` samples in total (the dataset size by
+    default), split between the ranks.'''
+    def __init__(self, data, power=0.0, num_samples=None, shard=None, seed=0):
+        super().__init__(data, shard, seed)
+        self.power = power
+        n = num_samples or len(self.index.data)
+        self.num_samples = -(-n // self.world_size)
+        weights = np.where(self.counts > 0, self.counts.astype(np.float64) ** power, 0.0)
+        self.probs = weights / weights.sum()
+
+    def _draw(self, rng, size):
+        classes = rng.choice(len(self.probs), size=size, p=self.probs)
+        counts = self.counts[classes]
+        pos = self.index.offsets[classes] + (rng.random(size) * counts).astype(np.int64)
+        return self.index.data[pos]
+
+
+class ClassBalancedSampler(ClassWeightedSampler):
+    '''Draws every class equally often, see ``ClassWeightedSampler``'''
+    def __init__(self, data, num_samples=None, shard=None, seed=0):
+        super().__init__(data, 0.0, num_samples, shard, seed)
+
+
+class SqrtFrequencySampler(ClassWeightedSampler):
+    '''Draws classes in proportion to the square root of their number of
+    samples, see ``ClassWeightedSampler``'''
+    def __init__(self, data, num_samples=None, shard=None, seed=0):
+        super().__init__(data, 0.5, num_samples, shard, seed)
+
+
+class PKSampler(_ClassSampler):
+    '''Yields batches of ``p`` distinct classes with ``k`` distinct samples
+    each, one batch after the other; use it with ``batch_size=p * k``.
+    Classes with fewer than ``k`` samples repeat them.
+
+    Classes are drawn without replacement until each has been used once, and
+    samples within a class from a new permutation every epoch. Each epoch
+    has ``num_batches`` batches in total (by default as many as the dataset
+    fills), split between the ranks.'''
+    def __init__(self, data, p, k, num_batches=None, shard=None, seed=0):
+        super().__init__(data, shard, seed)
+        self.classes = np.flatnonzero(self.counts)
+        if p > len(self.classes):
+            raise ValueError('Cannot draw {} classes per batch from {} classes'.format(
+                p, len(self.classes)))
+        self.p, self.k = p, k
+        n = num_batches or max(1, len(self.index.data) // (p * k))
+        self.num_batches = -(-n // self.world_size)
+        self.num_samples = self.num_batches * p * k
+        # class of every position in the index, to regroup permutations
+        self._sorted_targets = np.repeat(np.arange(len(self.counts)), self.counts).astype(
+            np.uint16 if len(self.counts) <= 1 << 16 else np.int64)
+
+    def _shuffled_index(self, rng):
+        '''The class index with the samples of each class in a random order'''
+        perm = rng.permutation(len(self.index.data))
+        # a stable sort on uint16 keys is a linear-time radix sort
+        return self.index.data[perm[np.argsort(self._sorted_targets[perm], kind='stable')]]
+
+    def _draw(self, rng, size):
+        p, k, num_classes = self.p, self.k, len(self.classes)
+        # every permutation of the classes gives num_classes // p batches
+        per_perm = num_classes // p
+        perms = np.argsort(rng.random((-(-size // per_perm), num_classes)), axis=1)
+        classes = self.classes[perms[:, :per_perm * p].reshape(-1, p)[:size]]
+        # k consecutive samples of each class, from a random start
+        counts = self.counts[classes][..., None]
+        start = (rng.random(counts.shape) * counts).astype(np.int64)
+        pos = self.index.offsets[classes][..., None] + (start + np.arange(k)) % counts
+        return self._shuffled_index(rng)[pos].reshape(size, p * k)
+
+    def indices(self):
+        batches = self._draw(self._rng(), self.num_batches * self.world_size)
+        return batches[self.rank::self.world_size].reshape(-1)
+
+
+def _long_tail_targets(num_samples, num_classes, seed=0):
+    '''Synthetic targets with class sizes falling off as 1 / rank'''
+    rng = np.random.default_rng(seed)
+    probs = 1.0 / np.arange(1, num_classes + 1)
+    return rng.choice(num_classes, size=num_samples, p=probs / probs.sum())
+
+
+def _loop_balanced(targets, seed=0):
+    '''Class-balanced epoch built with Python loops, for comparison'''
+    import random
+    rng = random.Random(seed)
+    by_class = {}
+    for i, t in enumerate(targets.tolist()):
+        by_class.setdefault(t, []).append(i)
+    classes = list(by_class)
+    return [rng.choice(by_class[rng.choice(classes)]) for _ in range(len(targets))]
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(num_samples=300000, num_classes=1000, p=32, k=4, repeat=3):
+    '''Times building the class index and drawing an epoch of indices with
+    each sampler, on long-tailed targets. Returns ``{name: seconds}``.'''
+    targets = _long_tail_targets(num_samples, num_classes)
+    samplers = {
+        'ClassBalancedSampler': ClassBalancedSampler(targets),
+        'SqrtFrequencySampler': SqrtFrequencySampler(targets),
+        'PKSampler': PKSampler(targets, p, k),
+    }
+    results = {'class_index': _time(lambda: class_index(targets), repeat)}
+    for name, sampler in samplers.items():
+        results[name] = _time(sampler.indices, repeat)
+    results['python loop (balanced)'] = _time(lambda: _loop_balanced(targets), 1)
+    return results
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Time the class-aware samplers')
+    parser.add_argument('--num-samples', type=int, default=300000)
+    parser.add_argument('--num-classes', type=int, default=1000)
+    parser.add_argument('-p', type=int, default=32, help='classes per PKSampler batch')
+    parser.add_argument('-k', type=int, default=4, help='samples per class in PKSampler')
+    args = parser.parse_args(args)
+
+    results = benchmark(args.num_samples, args.num_classes, args.p, args.k)
+    print('{} samples, {} classes'.format(args.num_samples, args.num_classes))
+    for name, seconds in results.items():
+        print('{:<26} {:8.1f} ms'.format(name, seconds * 1e3))
+
+
+if __name__ == '__main__':
+    main()
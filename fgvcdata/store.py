@@ -0,0 +1,123 @@
+'''Memory-mapped access to packed image shards.
+
+The shards and index are written by ``fgvcdata.packed.pack``; packing with
+``shard_size=None`` puts all images of a split in a single file. An
+``ImageStore`` maps the shard files into memory, so samples are decoded
+straight out of the OS page cache, which is shared by every process (e.g.
+DataLoader workers) that reads the same store.
+'''
+import io
+import json
+import mmap
+from pathlib import Path
+
+import numpy as np
+
+
+META_FILE = 'meta.json'
+
+
+def _split_name(train):
+    return 'train' if train else 'test'
+
+
+def _shard_name(split, i):
+    return '{}-{:05d}.shard'.format(split, i)
+
+
+def _index_name(split):
+    return '{}.index.npz'.format(split)
+
+
+class _BufferReader(io.RawIOBase):
+    '''Read-only file object over a memoryview. Only the chunks requested by
+    the decoder are copied out of the buffer.'''
+    def __init__(self, buf):
+        self._buf = buf
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += len(self._buf)
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, b):
+        chunk = self._buf[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        end = len(self._buf) if size is None or size < 0 else self._pos + size
+        chunk = self._buf[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+class ImageStore(object):
+    '''Random access to the encoded images of one split of a packed dataset.
+
+    ``store[index]`` returns a zero-copy memoryview of the encoded bytes, and
+    ``store.open(index)`` a file object over them that can be passed to
+    ``PIL.Image.open``. Shards are mapped lazily on first access.
+    '''
+    def __init__(self, root, train=True):
+        self.root = Path(root)
+        self.meta = json.load(open(self.root/META_FILE))
+        self.info = self.meta['splits'][_split_name(train)]
+        # a split identical to another is read from that split's shards
+        self.split = self.info.get('shards_of', _split_name(train))
+        with np.load(self.root/_index_name(self.split)) as index:
+            self.index = dict(index)
+        self.shards = self.index['shards']
+        self.offsets = self.index['offsets']
+        self.lengths = self.index['lengths']
+        self.files = [self.root/_shard_name(self.split, i)
+                      for i in range(self.info['num_shards'])]
+        self._maps = [None] * len(self.files)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def take(self, indices):
+        '''Returns a store with only the images at ``indices``'''
+        store = self.__class__.__new__(self.__class__)
+        store.__dict__.update(self.__dict__)
+        store.shards = self.shards[indices]
+        store.offsets = self.offsets[indices]
+        store.lengths = self.lengths[indices]
+        return store
+
+    def _map(self, shard):
+        m = self._maps[shard]
+        if m is None:
+            with open(self.files[shard], 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = m = memoryview(m)
+        return m
+
+    def __getitem__(self, index):
+        start = int(self.offsets[index])
+        return self._map(int(self.shards[index]))[start:start + int(self.lengths[index])]
+
+    def open(self, index):
+        return _BufferReader(self[index])
+
+    def __getstate__(self):
+        # mappings are recreated in the receiving process
+        state = self.__dict__.copy()
+        state['_maps'] = [None] * len(self.files)
+        return state
@@ -0,0 +1,265 @@
+'''Streaming FGVC datasets from sequential tar shards.
+
+``write_tar_shards`` re-shards any dataset into tar files of a fixed number of
+samples, in shuffled order, each sample stored as an image member plus a
+``.json`` member with its target (and bounding boxes):
+
+    out/
+      streaming.json          name, classes and shard list per split
+      train-00000.tar
+      ...
+
+``StreamingDataset`` is an ``IterableDataset`` that reads those shards with
+purely sequential I/O, without extracting anything. Shards are shuffled per
+epoch and split across distributed ranks and DataLoader workers, and samples
+are shuffled further through an in-memory buffer.
+'''
+import io
+import itertools
+import json
+import os
+import random
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from .base import _open_image
+
+
+__all__ = ['StreamingDataset', 'write_tar_shards']
+
+
+META_FILE = 'streaming.json'
+
+
+def _split_name(train):
+    return 'train' if train else 'test'
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_tar_shards(dataset, out, samples_per_shard=1000, shuffle=True, seed=0):
+    '''Writes the samples of ``dataset`` to tar shards in the folder ``out``.
+    Samples are shuffled (with ``seed``) before sharding, so that every shard
+    holds a mix of classes. Train and test data are written by calling this
+    once for each split.'''
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    split = _split_name(dataset.train)
+    order = np.arange(len(dataset))
+    if shuffle:
+        np.random.RandomState(seed).shuffle(order)
+    bboxes = getattr(dataset, 'bboxes', None)
+
+    shards, counts = [], []
+    for start in range(0, len(order), samples_per_shard):
+        name = '{}-{:05d}.tar'.format(split, len(shards))
+        chunk = order[start:start + samples_per_shard]
+        with tarfile.open(out/(name + '.tmp'), 'w') as tar:
+            for i in chunk:
+                i = int(i)
+                path = dataset.filepath(i)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                key = '{:08d}'.format(i)
+                info = dict(target=int(dataset.targets[i]), path=dataset.imgs[i])
+                if bboxes is not None:
+                    info['bbox'] = np.asarray(bboxes[i]).tolist()
+                _add_member(tar, key + '.json', json.dumps(info).encode('utf-8'))
+                _add_member(tar, key + os.path.splitext(str(path))[1].lower(), data)
+        os.replace(out/(name + '.tmp'), out/name)
+        shards.append(name)
+        counts.append(len(chunk))
+
+    meta_file = out/META_FILE
+    meta = json.load(open(meta_file)) if meta_file.is_file() else {'splits': {}}
+    meta.update(name=dataset.name, dataset=dataset.__class__.__name__)
+    meta['splits'][split] = dict(
+        shards=shards, counts=counts, bboxes=bboxes is not None,
+        classes=list(dataset.classes),
+        # stored as pairs so that non-string keys survive
+        class_to_idx=[[k, int(v)] for k, v in dataset.class_to_idx.items()])
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f, indent=1)
+    return out
+
+
+def _dist_info(rank, world_size):
+    if rank is None or world_size is None:
+        import torch.distributed as dist
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        else:
+            rank, world_size = 0, 1
+    return rank, world_size
+
+
+def _quotas(counts, total):
+    '''Splits ``total`` samples between sources holding ``counts`` samples,
+    in proportion to their counts'''
+    counts = np.asarray(counts, dtype=np.int64)
+    quotas = counts * total // max(int(counts.sum()), 1)
+    # the remainder goes one each to the first sources with samples left
+    for i in np.flatnonzero(quotas < counts)[:total - int(quotas.sum())]:
+        quotas[i] += 1
+    return quotas.tolist()
+
+
+def _shard_has_bboxes(fname):
+    '''Whether the samples of the shard ``fname`` have bounding boxes, for
+    shards written before ``streaming.json`` recorded it'''
+    with tarfile.open(fname, 'r|') as tar:
+        for member in tar:
+            if member.name.endswith('.json'):
+                return 'bbox' in json.loads(tar.extractfile(member).read())
+    return False
+
+
+class StreamingDataset(torch.utils.data.IterableDataset):
+    '''Iterates over the samples in tar shards written by
+    ``write_tar_shards``, yielding ``(img, target)`` pairs.
+
+    Every epoch (see ``set_epoch``) the shard order is reshuffled from
+    ``seed``, then shards are dealt out to the distributed ranks (taken from
+    torch.distributed unless ``rank``/``world_size`` are given) and to the
+    DataLoader workers of each rank. Each worker shuffles samples through a
+    buffer of ``buffer_size`` samples. For even work across ranks and workers,
+    the number of shards should be a multiple of their total number; there
+    must be at least one shard for every rank and every worker, and a
+    ``ValueError`` is raised otherwise.
+
+    Since ranks read whole shards, they hold different numbers of samples;
+    every rank yields only as many as the rank with the fewest, so that
+    distributed ranks run the same number of steps. ``len`` is that number,
+    for the current epoch.
+
+    If ``load_bboxes``, targets are ``(target, bbox)`` pairs; the shards must
+    have been written from a dataset with bounding boxes.
+    '''
+    def __init__(self, root, transform=None, target_transform=None, train=True,
+                 shuffle=True, buffer_size=1000, seed=0, rank=None, world_size=None,
+                 load_bboxes=False, decode_size=None):
+        self.root = Path(root)
+        self.transform = transform
+        self.target_transform = target_transform
+        self.train = train
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.rank, self.world_size = _dist_info(rank, world_size)
+        self.load_bboxes = load_bboxes
+        self.decode_size = decode_size
+        self.epoch = 0
+
+        meta = json.load(open(self.root/META_FILE))
+        info = meta['splits'][_split_name(train)]
+        self.name = meta['name']
+        self.shards = info['shards']
+        self.counts = info['counts']
+        self.classes = info['classes']
+        self.class_to_idx = {k: v for k, v in info['class_to_idx']}
+        if len(self.shards) < self.world_size:
+            raise ValueError('{} has {} {} shards, fewer than the {} ranks; write it with a '
+                             'smaller samples_per_shard'.format(
+                                 self.root, len(self.shards), _split_name(train),
+                                 self.world_size))
+        if load_bboxes:
+            has_bboxes = info.get('bboxes')
+            if has_bboxes is None:
+                has_bboxes = _shard_has_bboxes(self.root/self.shards[0])
+            if not has_bboxes:
+                raise ValueError('{} was written without bounding boxes, so load_bboxes '
+                                 'cannot be used'.format(self.root))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _rank_shards(self, rank):
+        '''Positions in ``shards`` of the shards of ``rank`` this epoch'''
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        return order[rank::self.world_size]
+
+    def _worker_shards(self):
+        '''Returns the shards of this DataLoader worker, and the number of
+        samples it yields'''
+        shards = self._rank_shards(self.rank)
+        num_samples = len(self)
+        worker = torch.utils.data.get_worker_info()
+        if worker is not None:
+            n = worker.num_workers
+            if len(self.shards) < self.world_size * n:
+                raise ValueError('{} shards are too few for {} ranks of {} DataLoader workers; '
+                                 'use fewer workers or a smaller samples_per_shard'.format(
+                                     len(self.shards), self.world_size, n))
+            counts = [sum(self.counts[i] for i in shards[w::n]) for w in range(n)]
+            num_samples = _quotas(counts, num_samples)[worker.id]
+            shards = shards[worker.id::n]
+        return [self.shards[i] for i in shards], num_samples
+
+    def _samples(self, shards):
+        for shard in shards:
+            with tarfile.open(self.root/shard, 'r|') as tar:
+                info = None
+                for member in tar:
+                    data = tar.extractfile(member).read()
+                    if member.name.endswith('.json'):
+                        info = json.loads(data)
+                    else:
+                        yield data, info
+
+    def __iter__(self):
+        worker = torch.utils.data.get_worker_info()
+        wid = 0 if worker is None else worker.id
+        rng = random.Random('{}-{}-{}-{}'.format(self.seed, self.epoch, self.rank, wid))
+        shards, num_samples = self._worker_shards()
+        # the samples beyond the common count of all ranks are dropped
+        samples = itertools.islice(self._samples(shards), num_samples)
+        if self.shuffle and self.buffer_size > 1:
+            samples = self._shuffled(samples, rng)
+        for data, info in samples:
+            yield self._load(data, info)
+
+    def _shuffled(self, samples, rng):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            buffer[i], sample = sample, buffer[i]
+            yield sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _load(self, data, info):
+        img = _open_image(io.BytesIO(data), self.decode_size).convert('RGB')
+        target = info['target']
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        if self.load_bboxes:
+            return img, (target, info['bbox'])
+        return img, target
+
+    def __len__(self):
+        # samples of the rank with the fewest this epoch
+        return min(sum(self.counts[i] for i in self._rank_shards(rank))
+                   for rank in range(self.world_size))
+
+    def __repr__(self):
+        head = '{} Streaming Dataset ({}.{})'.format(
+            self.name, self.__class__.__module__, self.__class__.__name__)
+        body = ['Shards: {}'.format(len(self.shards)),
+                'Root: {}'.format(str(self.root)),
+                'Transform: {}'.format(self.transform)]
+        lines = [head]+[' '*2 + line for line in body]
+        return '\n'.join(lines)
@@ -0,0 +1,124 @@
+'''Decoding images straight to uint8 tensors, and collating them into batches.
+
+With ``output='tensor'``, datasets return every image as an RGB uint8
+tensor of shape (3, H, W), decoded by ``torchcodec`` if it is installed, or
+else by ``torchvision.io`` (deprecated there since torchvision 0.29), rather
+than through a PIL image. Grayscale, CMYK, palette and alpha images are
+converted to RGB by the decoder. Float conversion and normalization can then
+be done once per batch, or left to the GPU:
+
+    ds = fgvcdata.CUB(root, output='tensor')
+    collate = fgvcdata.tensors.TensorCollate((224, 224), *fgvcdata.IMAGENET_STATS)
+    loader = DataLoader(ds, batch_size=64, collate_fn=collate)
+
+Without ``mean`` and ``std``, ``TensorCollate`` returns channels-last uint8
+batches, a quarter the size of float ones; normalize them on the device with
+``normalize``.
+
+Images decoded with ``decode_size`` or ``crop_to_bbox`` still go through PIL,
+whose JPEG draft mode decodes them reduced, as do formats the decoder can't
+decode.
+'''
+import io
+
+import numpy as np
+import torch
+from torchvision.transforms.v2 import functional as F
+
+from .base import _open_image
+
+
+__all__ = ['TensorCollate', 'decode_tensor', 'normalize', 'to_tensor']
+
+
+_decode_image = None
+
+
+def _decoder():
+    global _decode_image
+    if _decode_image is None:
+        try:
+            from torchcodec.decoders import decode_image
+        except ImportError:
+            from torchvision.io import decode_image
+        _decode_image = decode_image
+    return _decode_image
+
+
+def _encoded_bytes(fp):
+    '''Reads an encoded image (a path or file object) into a writable buffer'''
+    if not hasattr(fp, 'read'):
+        with open(fp, 'rb') as f:
+            return _encoded_bytes(f)
+    size = fp.seek(0, io.SEEK_END)
+    fp.seek(0)
+    buf = bytearray(size)
+    fp.readinto(buf)
+    return buf
+
+
+def to_tensor(img):
+    '''Converts a PIL image to a uint8 tensor of shape (3, H, W), laid out
+    channels-last (a view of the (H, W, 3) pixels)'''
+    return torch.from_numpy(np.array(img.convert('RGB'))).permute(2, 0, 1)
+
+
+def decode_tensor(fp, decode_size=None, box=None, padding=0.0):
+    '''Decodes an image (a path or file object) to an RGB uint8 tensor of
+    shape (3, H, W). Arguments are as for ``_open_image``: with
+    ``decode_size`` or ``box`` the image is decoded by PIL.'''
+    if decode_size is None and box is None and not str(fp).endswith('.npy'):
+        data = _encoded_bytes(fp)
+        try:
+            return _decoder()(torch.frombuffer(data, dtype=torch.uint8), mode='RGB')
+        except (RuntimeError, ValueError):
+            # a format the decoder doesn't handle, e.g. BMP
+            fp = io.BytesIO(data)
+    return to_tensor(_open_image(fp, decode_size, box, padding))
+
+
+def normalize(batch, mean, std):
+    '''Converts a uint8 batch (of any layout, on any device) to float and
+    normalizes it with per-channel ``mean`` and ``std`` given in [0, 1]
+    units, as ``ToTensor`` followed by ``Normalize`` would'''
+    shape = (-1, 1, 1)
+    mean = torch.as_tensor(mean, dtype=torch.float32, device=batch.device).view(shape)
+    std = torch.as_tensor(std, dtype=torch.float32, device=batch.device).view(shape)
+    # (x / 255 - mean) / std as one multiply and one add
+    scale = 1 / (255 * std)
+    return batch.float().mul_(scale).sub_(mean / std)
+
+
+class TensorCollate(object):
+    '''DataLoader ``collate_fn`` for datasets with ``output='tensor'``.
+
+    Resizes every image to ``size`` (an (h, w) pair, or an int for square
+    images), skipping those already that size, and copies them into one
+    channels-last uint8 batch. If ``mean`` and ``std`` are given the batch is
+    then normalized to float (see ``normalize``). Returns ``(imgs, targets)``.
+    '''
+    def __init__(self, size=None, mean=None, std=None, antialias=True):
+        if isinstance(size, int):
+            size = (size, size)
+        self.size = None if size is None else tuple(size)
+        self.mean = mean
+        self.std = std
+        self.antialias = antialias
+
+    def __call__(self, batch):
+        imgs = [x[0] for x in batch]
+        targets = torch.utils.data.default_collate([x[1] for x in batch])
+        size = self.size or tuple(imgs[0].shape[-2:])
+        out = torch.empty((len(imgs), 3) + size, dtype=torch.uint8,
+                          memory_format=torch.channels_last)
+        for i, img in enumerate(imgs):
+            if tuple(img.shape[-2:]) != size:
+                img = F.resize(img, list(size), antialias=self.antialias)
+            out[i].copy_(img)
+        if self.mean is not None:
+            out = normalize(out, self.mean, self.std)
+        return out, targets
+
+    def __repr__(self):
+        return '{}(size={}, mean={}, std={})'.format(
+            self.__class__.__name__, self.size, self.mean, self.std)
@@ -0,0 +1,182 @@
+'''Compact, array-backed containers for dataset metadata.
+
+Python lists of str/int/list objects are touched (refcounted) every time they
+are read, so forked DataLoader workers gradually copy the pages holding them.
+The containers here keep the metadata in a handful of NumPy arrays instead,
+while still behaving like read-only lists.
+
+``read_columns`` and ``lookup`` parse and join ``id value`` annotation files
+column-wise, without a Python loop over the records.
+'''
+import numpy as np
+
+
+def _ranges(starts, ends):
+    '''Concatenation of ``arange(s, e)`` for all pairs, without a Python loop'''
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum()) + shifts
+
+
+def take(values, indices):
+    '''Selects ``indices`` from an array, ``StringArray`` or ``RaggedArray``'''
+    if isinstance(values, np.ndarray):
+        return values[indices]
+    return values.take(indices)
+
+
+class StringArray(object):
+    '''A read-only list of strings, stored as one UTF-8 buffer of
+    newline-terminated strings plus arrays of offsets.'''
+    def __init__(self, data):
+        data = np.asarray(data, dtype=np.uint8)
+        if len(data) and data[-1] != ord('\n'):
+            data = np.append(data, np.uint8(ord('\n')))
+        self.data = data
+        self._ends = np.flatnonzero(data == ord('\n'))
+        self._starts = np.zeros(len(self._ends), dtype=np.int64)
+        self._starts[1:] = self._ends[:-1] + 1
+
+    @classmethod
+    def from_list(cls, strings):
+        buf = ''.join(s + '\n' for s in strings).encode('utf-8')
+        return cls(np.frombuffer(buf, dtype=np.uint8))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.data[self._starts[index]:self._ends[index]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def take(self, indices):
+        '''Returns a new ``StringArray`` with the strings at ``indices``'''
+        indices = np.asarray(indices, dtype=np.int64)
+        # every string is gathered together with its newline
+        return StringArray(self.data[_ranges(self._starts[indices], self._ends[indices] + 1)])
+
+    def tolist(self):
+        txt = self.data.tobytes().decode('utf-8')
+        return txt.split('\n')[:-1]
+
+    def __repr__(self):
+        return 'StringArray({} strings)'.format(len(self))
+
+
+class RaggedArray(object):
+    '''A read-only list of variable-length arrays, such as (k,4) box arrays,
+    stored as one (M,...) array plus (N+1) offsets.'''
+    def __init__(self, data, offsets):
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices):
+        '''Returns a new ``RaggedArray`` with the items at ``indices``'''
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, ends = self.offsets[indices], self.offsets[indices + 1]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        return RaggedArray(self.data[_ranges(starts, ends)], offsets)
+
+    def tolist(self):
+        return [x.tolist() for x in self]
+
+    def __repr__(self):
+        return 'RaggedArray({} items, {} boxes)'.format(len(self), len(self.data))
+
+
+def flatten_bboxes(bboxes):
+    '''Flattens single or multi-box annotations into an (M,4) array plus
+    (N+1) offsets. Also returns whether the boxes were multi-box lists.'''
+    if isinstance(bboxes, RaggedArray):
+        return bboxes.data, bboxes.offsets, True
+    if isinstance(bboxes, np.ndarray):
+        return bboxes, np.arange(len(bboxes) + 1, dtype=np.int64), False
+    multi = len(bboxes) > 0 and isinstance(bboxes[0][0], (list, tuple))
+    if not multi:
+        bboxes = [[b] for b in bboxes]
+    counts = [len(b) for b in bboxes]
+    offsets = np.zeros(len(bboxes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    flat = np.array([x for b in bboxes for x in b], dtype=np.float32).reshape(-1, 4)
+    return flat, offsets, multi
+
+
+def unflatten_bboxes(flat, offsets, multi):
+    '''Inverse of ``flatten_bboxes``: an (N,4) array for single boxes, or a
+    ``RaggedArray`` for multi-box annotations.'''
+    if multi:
+        return RaggedArray(flat, offsets)
+    return np.asarray(flat)[offsets[:-1]]
+
+
+def bbox_array(bboxes):
+    '''Converts bounding box lists to their compact array form'''
+    if isinstance(bboxes, (np.ndarray, RaggedArray)):
+        return bboxes
+    return unflatten_bboxes(*flatten_bboxes(bboxes))
+
+
+def read_columns(fname, dtype=None):
+    '''Reads an annotation file with one ``key value`` record per line, and
+    returns an array of keys (as strings) and an array of values. With
+    ``dtype``, every value is a fixed number of numeric fields, returned as an
+    (N,k) array of that type; otherwise the values are the rest of each line.'''
+    with open(fname) as f:
+        txt = f.read().strip()
+    if dtype is not None:
+        fields = txt.split()
+        ncols = len(txt.partition('\n')[0].split())
+        keys = np.array(fields[::ncols])
+        del fields[::ncols]
+        # parsed as float64 so that float32 values round like float(x)
+        values = np.array(fields, dtype=np.float64).reshape(len(keys), ncols - 1)
+        return keys, values.astype(dtype)
+    parts = np.char.partition(np.array(txt.split('\n')), ' ')
+    return parts[:, 0], parts[:, 2]
+
+
+def int_keys(keys):
+    '''Converts an array of keys to int64 if they are all integers'''
+    try:
+        return keys.astype(np.int64)
+    except ValueError:
+        return keys
+
+
+def lookup(keys, values, query):
+    '''Returns the ``values`` of ``query`` keys, like ``[dict(zip(keys,
+    values))[q] for q in query]`` but vectorized. Raises ``KeyError`` for
+    missing keys.'''
+    if len(keys) == len(query) and (keys == query).all():
+        # annotation files usually list the same keys in the same order
+        return values
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    # the last of duplicate keys wins, as in a dict
+    pos = np.searchsorted(keys, query, side='right') - 1
+    found = pos >= 0
+    found[found] = keys[pos[found]] == query[found]
+    if not found.all():
+        raise KeyError(query[~found][0])
+    return values[order[pos]]
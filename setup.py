@@ -22,6 +22,7 @@ VERSION = '0.1.0'
 
 # What packages are required for this module to be executed?
 REQUIRED = [
+    'numpy',
     'pillow',
     'scipy',
     'torch',
@@ -30,7 +31,10 @@ REQUIRED = [
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    # faster CSV parsing for the Danish Fungi metadata
+    'arrow': ['pyarrow'],
+    # image decoding for output='tensor', replacing torchvision.io
+    'codec': ['torchcodec'],
 }
 
 # The rest you shouldn't have to touch too much :)
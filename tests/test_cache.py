@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+import fgvcdata
+from fgvcdata import cache
+from fgvcdata.fixtures import make_fixture
+
+
+def _write_lines(fname, lines):
+    fname.write_text(''.join(line + '\n' for line in lines))
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    '''CUB metadata files for 12 images of 3 classes; the images themselves
+    aren't needed to parse them'''
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = tmp_path/'CUB'
+    root.mkdir()
+    ids = range(1, 13)
+    _write_lines(root/'images.txt', ['{} c{}/{}.jpg'.format(i, i % 3, i) for i in ids])
+    _write_lines(root/'train_test_split.txt', ['{} {}'.format(i, i % 2) for i in ids])
+    _write_lines(root/'image_class_labels.txt', ['{} {}'.format(i, i % 3 + 1) for i in ids])
+    _write_lines(root/'classes.txt', ['{} {:03d}.Class_{}'.format(c, c, c) for c in (1, 2, 3)])
+    _write_lines(root/'bounding_boxes.txt', ['{} 1.0 2.0 3.0 4.0'.format(i) for i in ids])
+    return root
+
+
+def test_metadata_is_cached(root):
+    ds = fgvcdata.CUB(root, load_bboxes=True)
+    assert cache._cache_file(ds).is_file()
+    cached = fgvcdata.CUB(root, load_bboxes=True)
+    assert cache.load_metadata(cached)
+    assert list(cached.imgs) == list(ds.imgs)
+    assert list(cached.targets) == list(ds.targets)
+    assert cached.classes == ds.classes
+    assert [list(b) for b in cached.bboxes] == [list(b) for b in ds.bboxes]
+
+
+def test_metadata_cache_invalidated_by_mtime(root):
+    ds = fgvcdata.CUB(root)
+    old = cache._cache_file(ds)
+    fname = root/ds.class_names_file
+    lines = fname.read_text().split('\n')
+    lines[0] = lines[0].split(' ')[0] + ' 001.Renamed'
+    st = fname.stat()
+    fname.write_text('\n'.join(lines))
+    os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache._cache_file(ds) != old
+    assert fgvcdata.CUB(root).classes[0] == '001.Renamed'
+
+
+def test_is_cached_split_root(root):
+    assert not fgvcdata.registry.is_cached('CUB', root, train=False)
+    fgvcdata.CUB(root/'test')
+    assert fgvcdata.registry.is_cached('CUB', root, train=False)
+    assert fgvcdata.registry.is_cached('CUB', root/'test')
+    assert not fgvcdata.registry.is_cached('CUB', root/'train', train=False)
+
+
+def test_get_validate_split_root(root):
+    (root/'images').mkdir()
+    ds = fgvcdata.registry.get('CUB', root/'test', validate=True)
+    assert not ds.train and ds.root == root
+    (root/'classes.txt').unlink()
+    with pytest.raises(FileNotFoundError, match='classes.txt'):
+        fgvcdata.registry.get('CUB', root/'train', validate=True)
+
+
+def test_dog_boxes_key_stable(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('StanfordDogs', tmp_path/'dogs', num_images=8, num_classes=2)
+    bare = fgvcdata.StanfordDogs.__new__(fgvcdata.StanfordDogs)
+    bare.root, bare.train, bare.load_bboxes = root, True, True
+    key = cache._cache_file(bare)
+    # the first construction caches the boxes and the metadata under the same key
+    ds = fgvcdata.StanfordDogs(root, load_bboxes=True)
+    assert cache._cache_file(ds) == key and key.is_file()
+    assert fgvcdata.registry.is_cached('StanfordDogs', root, load_bboxes=True)
+
+
+def test_dog_boxes_invalidated(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('TsinghuaDogs', tmp_path/'dogs', num_images=4, num_classes=2)
+    ds = fgvcdata.TsinghuaDogs(root, load_bboxes=True, cache_metadata=False)
+    xmin = ds.bboxes[0].ravel()[0]
+    assert xmin > 0
+    fname = root/'Low-Annotations'/(ds.imgs[0] + '.xml')
+    fname.write_text(fname.read_text().replace(
+        '<xmin>{}</xmin>'.format(int(xmin)), '<xmin>0</xmin>', 1))
+    # the cached boxes are used while their sources are unchanged
+    again = fgvcdata.TsinghuaDogs(root, load_bboxes=True, cache_metadata=False)
+    assert again.bboxes[0].ravel()[0] == xmin
+    # as when the annotations are extracted again
+    folder = root/'Low-Annotations'
+    st = folder.stat()
+    os.utime(folder, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    changed = fgvcdata.TsinghuaDogs(root, load_bboxes=True, cache_metadata=False)
+    assert changed.bboxes[0].ravel()[0] == 0
+    assert changed.bboxes[1].tolist() == ds.bboxes[1].tolist()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import fgvcdata
+from fgvcdata.combined import normalize_class_name
+from fgvcdata.fixtures import make_fixture
+
+
+@pytest.fixture
+def parts(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    cub = make_fixture('CUB', tmp_path/'cub', num_images=6, num_classes=3)
+    dogs = make_fixture('StanfordDogs', tmp_path/'dogs', num_images=8, num_classes=4)
+    return [fgvcdata.CUB(cub), fgvcdata.StanfordDogs(dogs), fgvcdata.CUB(cub, train=False)]
+
+
+def test_offsets_and_labels(parts):
+    ds = fgvcdata.CombinedDataset(parts)
+    sizes = [len(p) for p in parts]
+    assert len(ds) == sum(sizes) and ds.offsets.tolist() == np.cumsum([0] + sizes).tolist()
+    # every dataset keeps its classes; datasets of the same name are numbered
+    assert len(ds.classes) == 3 + 4 + 3
+    assert ds.classes[0] == 'Caltech UCSD Birds (CUB) #0/001.Bird_1'
+    assert ds.classes[3] == 'Stanford Dogs/n02000000-breed_0'
+    assert ds.classes[7] == 'Caltech UCSD Birds (CUB) #2/001.Bird_1'
+    prefixes = ['Caltech UCSD Birds (CUB) #0', 'Stanford Dogs', 'Caltech UCSD Birds (CUB) #2']
+    index = 0
+    for prefix, part in zip(prefixes, parts):
+        for i in range(len(part)):
+            source, local = ds.source(index)
+            assert source is part and local == i
+            img, target = ds[index]
+            assert target == ds.targets[index]
+            assert ds.classes[target] == prefix + '/' + part.classes[part.targets[i]]
+            assert np.array_equal(np.asarray(img), np.asarray(part[i][0]))
+            assert ds.filepath(index) == part.filepath(i)
+            index += 1
+
+
+def test_unify_classes(parts):
+    ds = fgvcdata.CombinedDataset([parts[0], parts[2]], unify_classes=True)
+    assert ds.classes == ['bird 1', 'bird 2', 'bird 3']
+    n = len(parts[0])
+    assert ds.targets[:n].tolist() == parts[0].targets.tolist()
+    assert ds.targets[n:].tolist() == parts[2].targets.tolist()
+    assert normalize_class_name('001.Black_footed_Albatross') == \
+        normalize_class_name('Black-footed Albatross') == 'black footed albatross'
+    # a dict renames some classes, and leaves the others
+    rename = {'001.Bird_1': 'dog', 'n02000000-breed_0': 'dog'}
+    ds = fgvcdata.CombinedDataset(parts[:2], unify_classes=rename)
+    assert ds.classes[0] == 'dog' and len(ds.classes) == 3 + 4 - 1
+    dogs = ds.targets[len(parts[0]):]
+    assert (dogs[parts[1].targets == 0] == 0).all()
+    with pytest.raises(ValueError):
+        fgvcdata.CombinedDataset(parts, unify_classes='yes')
+
+
+def test_getitems(parts):
+    ds = fgvcdata.CombinedDataset(parts)
+    indices = np.random.default_rng(0).integers(0, len(ds), 15).tolist()
+    for i, (img, target) in zip(indices, ds.__getitems__(indices)):
+        assert target == ds[i][1]
+        assert np.array_equal(np.asarray(img), np.asarray(ds[i][0]))
+
+
+def test_weights(parts):
+    with pytest.raises(ValueError):
+        fgvcdata.CombinedDataset(parts, weights=[1, 2])
+    ds = fgvcdata.CombinedDataset(parts, weights=[3, 1, 0])
+    weights = ds.sample_weights()
+    shares = [weights[ds.sources == k].sum() for k in range(3)]
+    assert np.allclose(shares, [3, 1, 0])
+    sampler = ds.sampler(num_samples=40000, seed=1)
+    drawn = np.bincount(ds.sources[sampler.indices()], minlength=3) / 40000
+    assert np.abs(drawn - [0.75, 0.25, 0]).max() < 0.01
+    # samples are drawn uniformly within each dataset
+    assert len(set(sampler.indices().tolist())) == len(parts[0]) + len(parts[1])
+    ranks = [ds.sampler(num_samples=40000, seed=1, shard=(r, 2)) for r in range(2)]
+    assert [len(r) for r in ranks] == [20000, 20000]
+    assert ranks[0].indices().tolist() == sampler.indices()[::2].tolist()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import fgvcdata
+from fgvcdata.base import _crop_region, _open_image, _reduction
+from fgvcdata.fixtures import make_fixture
+
+
+def test_crop_region():
+    size = (200, 100)
+    assert _crop_region([10, 20, 30, 40], size) == (10, 20, 40, 60)
+    # fractional boxes are grown to whole pixels
+    assert _crop_region([10.5, 20.5, 30, 40], size) == (10, 20, 41, 61)
+    # padding is relative to the box size, and clipped to the image
+    assert _crop_region([10, 20, 30, 40], size, 0.5) == (0, 0, 55, 80)
+    # the union of several boxes
+    assert _crop_region([[10, 20, 30, 40], [100, 5, 10, 10]], size) == (10, 5, 110, 60)
+    # empty or degenerate boxes give the whole image
+    assert _crop_region(np.zeros((0, 4)), size) == (0, 0, 200, 100)
+    assert _crop_region([300, 20, 30, 40], size) == (0, 0, 200, 100)
+
+
+@pytest.mark.parametrize('decode_size', [None, 40, 100, (30, 90)])
+@pytest.mark.parametrize('padding', [0.0, 0.25])
+def test_crop_decode(tmp_path, decode_size, padding):
+    w, h = 803, 601
+    x, y = np.meshgrid(np.linspace(0, 1, w), np.linspace(0, 1, h))
+    pixels = np.stack([x * 255, y * 255, (x + y) * 127], axis=-1).astype(np.uint8)
+    fname = tmp_path/'img.jpg'
+    Image.fromarray(pixels).save(fname, quality=95)
+    box = np.array([101.5, 250, 400, 300], dtype=np.float32)
+    region = _crop_region(box, (w, h), padding)
+    rw, rh = region[2] - region[0], region[3] - region[1]
+    img = _open_image(fname, decode_size, box, padding).convert('RGB')
+    f = 1 if decode_size is None else _reduction((rw, rh), decode_size)
+    # the region scaled by the reduction; its edges are rounded outwards
+    assert rw / f <= img.width <= rw / f + 2 and rh / f <= img.height <= rh / f + 2
+    if isinstance(decode_size, int):
+        assert min(img.size) >= decode_size
+    elif decode_size is not None:
+        assert img.height >= decode_size[0] and img.width >= decode_size[1]
+    full = Image.open(fname).convert('RGB').crop(region).resize(img.size, Image.BOX)
+    diff = np.abs(np.asarray(img, dtype=np.float64) - np.asarray(full, dtype=np.float64))
+    assert diff.mean() < 3
+
+
+@pytest.fixture
+def dogs(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    return make_fixture('StanfordDogs', tmp_path/'dogs', num_images=8, num_classes=2)
+
+
+def test_crop_each(dogs):
+    full = fgvcdata.StanfordDogs(dogs, load_bboxes=True)
+    counts = [len(b) for b in full.bboxes]
+    assert max(counts) > 1
+    union = fgvcdata.StanfordDogs(dogs, crop_to_bbox='union')
+    each = fgvcdata.StanfordDogs(dogs, crop_to_bbox='each')
+    assert len(union) == len(full)
+    # one sample per box, in the order of the images
+    assert len(each) == sum(counts)
+    assert each.indices.tolist() == np.repeat(np.arange(len(full)), counts).tolist()
+    boxes = np.concatenate([np.asarray(b).reshape(-1, 4) for b in full.bboxes])
+    for i in range(len(each)):
+        img, target = each[i]
+        assert target == full.targets[each.indices[i]]
+        left, upper, right, lower = _crop_region(boxes[i], full[each.indices[i]][0].size)
+        assert img.size == (right - left, lower - upper)
+        # the box is in the coordinates of the crop
+        assert np.allclose(each.bbox(i), boxes[i] - [left, upper, 0, 0])
+    for i in range(len(union)):
+        left, upper, right, lower = _crop_region(full.bboxes[i], full[i][0].size)
+        assert union[i][0].size == (right - left, lower - upper)
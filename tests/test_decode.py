@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import fgvcdata
+from fgvcdata.base import _open_image, _reduction
+from fgvcdata.fixtures import make_fixture
+
+
+def _write_image(fname, size=(803, 601)):
+    w, h = size
+    x, y = np.meshgrid(np.linspace(0, 1, w), np.linspace(0, 1, h))
+    pixels = np.stack([x * 255, y * 255, (x + y) * 127], axis=-1).astype(np.uint8)
+    Image.fromarray(pixels).save(fname, quality=95)
+    return fname
+
+
+@pytest.mark.parametrize('suffix', ['.jpg', '.png'])
+@pytest.mark.parametrize('decode_size,factor', [
+    (1000, 1), (500, 1), (300, 2), (150, 4), (75, 8), (20, 8), ((150, 400), 2), ((70, 100), 8)])
+def test_reduced_decode(tmp_path, suffix, decode_size, factor):
+    fname = _write_image(tmp_path/('img' + suffix))
+    assert _reduction((803, 601), decode_size) == factor
+    img = _open_image(fname, decode_size).convert('RGB')
+    # reduced sizes are rounded up, and still cover decode_size
+    assert img.size == (-(-803 // factor), -(-601 // factor))
+    if isinstance(decode_size, int):
+        assert min(img.size) >= min(decode_size, 601)
+    else:
+        assert img.height >= decode_size[0] and img.width >= decode_size[1]
+    full = Image.open(fname).convert('RGB').resize(img.size, Image.BOX)
+    diff = np.abs(np.asarray(img, dtype=np.float64) - np.asarray(full, dtype=np.float64))
+    assert diff.mean() < 2
+
+
+def test_dataset_decode_size(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('CUB', tmp_path/'cub', num_images=4, num_classes=2)
+    full = fgvcdata.CUB(root, load_bboxes=True)
+    reduced = fgvcdata.CUB(root, load_bboxes=True, decode_size=64)
+    for i in range(len(full)):
+        img, size = reduced[i][0], full[i][0].size
+        f = _reduction(size, 64)
+        assert f > 1 and img.size == (-(-size[0] // f), -(-size[1] // f))
+        # boxes are given in the coordinates of the reduced image
+        assert np.allclose(reduced.bbox(i), full.bbox(i) / f)
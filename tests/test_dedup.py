@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from fgvcdata.dedup import DedupIndex, _index_file, _popcount, build_index
+
+
+def _index(rng, n, planted=()):
+    hashes = rng.integers(0, 1 << 63, n, dtype=np.int64).astype(np.uint64)
+    sha1 = rng.integers(0, 256, (n, 20), dtype=np.uint8)
+    for i, j, bits in planted:
+        flip = np.uint64(sum(1 << int(b) for b in rng.choice(64, bits, replace=False)))
+        hashes[j] = hashes[i] ^ flip
+        if bits == 0:
+            sha1[j] = sha1[i]
+    return DedupIndex(['img{}'.format(i) for i in range(n)], np.arange(n), sha1, hashes)
+
+
+def _brute_force(a, b, max_distance, same):
+    found = []
+    for i in range(len(a)):
+        for j in range(i + 1 if same else 0, len(b)):
+            if max_distance is None:
+                if (a.sha1[i] == b.sha1[j]).all():
+                    found.append((i, j, 0))
+            else:
+                d = int(_popcount(np.array([a.hashes[i] ^ b.hashes[j]]))[0])
+                if d <= max_distance:
+                    found.append((i, j, d))
+    return found
+
+
+@pytest.mark.parametrize('max_distance', [None, 0, 3, 8])
+def test_pairs_match_brute_force(max_distance):
+    rng = np.random.default_rng(0)
+    a = _index(rng, 300, [(0, 5, 0), (3, 200, 2), (7, 8, 4), (10, 11, 8), (10, 12, 9)])
+    b = _index(rng, 120)
+    b.hashes[:20] = a.hashes[:20] ^ np.uint64(3)
+    b.hashes[20:22] = a.hashes[40:42]
+    b.sha1[20:25] = a.sha1[30:35]
+    for other in (None, b):
+        i, j, d = a.pairs(other, max_distance)
+        expected = _brute_force(a, a if other is None else other, max_distance, other is None)
+        assert list(zip(i.tolist(), j.tolist(), d.tolist())) == expected
+        assert expected
+
+
+def test_duplicates_keep_one_image():
+    rng = np.random.default_rng(1)
+    index = _index(rng, 50, [(1, 4, 0), (1, 9, 0), (4, 9, 0)])
+    assert index.duplicates().tolist() == [4, 9]
+
+
+@pytest.fixture
+def dogs(tmp_path, monkeypatch):
+    from PIL import Image
+    from fgvcdata.fixtures import make_fixture
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('StanfordDogs', tmp_path/'dogs', num_images=8, num_classes=2)
+    # fixtures reuse a few images; make every one distinct
+    rng = np.random.default_rng(0)
+    for path in sorted((root/'Images').rglob('*.jpg')):
+        Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)).save(path)
+    return root
+
+
+def test_build_index_hashes_each_image_once(dogs):
+    import fgvcdata
+    ds = fgvcdata.StanfordDogs(dogs, crop_to_bbox='each')
+    assert len(ds) > 8
+    index = build_index(ds, workers=1)
+    assert index.indices.tolist() == list(range(8))
+    assert index.names == [ds.imgs[i] for i in np.searchsorted(ds.indices, range(8))]
+    assert len(index.duplicates()) == 0
+
+
+def test_build_index_cache_invalidated_by_images(dogs):
+    import fgvcdata
+    ds = fgvcdata.StanfordDogs(dogs)
+    index = build_index(ds, workers=1)
+    assert _index_file(ds, np.arange(len(ds))).is_file()
+    # a copy of image 0, with a later mtime
+    path = ds.filepath(3)
+    path.write_bytes(ds.filepath(0).read_bytes())
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert len(index.duplicates()) == 0
+    assert build_index(ds, workers=1).duplicates().tolist() == [3]
@@ -0,0 +1,21 @@
+import pytest
+import torch
+
+from fgvcdata.distributed import sampler_indices
+
+
+@pytest.mark.parametrize('n', [1, 7, 10, 33])
+@pytest.mark.parametrize('world_size', [1, 3, 4])
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_sampler_indices_match_distributed_sampler(n, world_size, shuffle, drop_last):
+    if drop_last and n < world_size:
+        return
+    data = list(range(n))
+    for epoch in (0, 3):
+        for rank in range(world_size):
+            sampler = torch.utils.data.DistributedSampler(
+                data, world_size, rank, shuffle=shuffle, seed=5, drop_last=drop_last)
+            sampler.set_epoch(epoch)
+            indices = sampler_indices(n, rank, world_size, epoch, 5, shuffle, drop_last)
+            assert indices.tolist() == list(sampler)
@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+
+from fgvcdata import registry
+from fgvcdata.download import MANIFEST_FILE, download_files, fetch
+
+
+def _make_tar(path, files):
+    with tarfile.open(path, 'w') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    src = tmp_path/'mirror'/'images.tar'
+    src.parent.mkdir()
+    files = {'images/a.jpg': os.urandom(3000), 'images/b/c.jpg': os.urandom(70000)}
+    return src, files, _make_tar(src, files)
+
+
+def test_fetch_extracts_verified(tmp_path, archive):
+    src, files, sha256 = archive
+    root = tmp_path/'root'
+    digest, extracted = fetch(src.as_uri(), root/'images.tar', sha256, extract_to=root)
+    assert digest == sha256 and extracted
+    for name, data in files.items():
+        assert (root/name).read_bytes() == data
+    assert sorted(p.name for p in root.iterdir()) == ['images', 'images.tar']
+
+
+def test_fetch_resumes(tmp_path, archive):
+    src, files, sha256 = archive
+    root = tmp_path/'root'
+    root.mkdir()
+    data = src.read_bytes()
+    (root/'images.tar.part').write_bytes(data[:10000])
+    digest, extracted = fetch(src.as_uri(), root/'images.tar', sha256, extract_to=root)
+    assert digest == sha256 and not extracted
+    assert (root/'images.tar').read_bytes() == data
+    assert not (root/'images.tar.part').exists()
+
+
+def test_fetch_checksum_mismatch(tmp_path, archive):
+    src, files, sha256 = archive
+    root = tmp_path/'root'
+    with pytest.raises(ValueError):
+        fetch(src.as_uri(), root/'images.tar', '0' * 64, extract_to=root)
+    # neither the download nor its unverified contents are kept
+    assert list(root.iterdir()) == []
+
+
+def test_fetch_restarts_longer_part(tmp_path, archive):
+    src, files, sha256 = archive
+    root = tmp_path/'root'
+    root.mkdir()
+    data = src.read_bytes()
+    # e.g. left over from a larger file at the same URL
+    (root/'images.tar.part').write_bytes(data + os.urandom(5000))
+    digest, extracted = fetch(src.as_uri(), root/'images.tar', sha256, extract_to=root)
+    assert digest == sha256 and extracted
+    assert (root/'images.tar').read_bytes() == data
+
+
+def test_download_md5(tmp_path, archive):
+    src, files, sha256 = archive
+    md5 = hashlib.md5(src.read_bytes()).hexdigest()
+    root = tmp_path/'root'
+    with pytest.raises(ValueError, match='MD5'):
+        download_files({'images.tar': src.as_uri()}, root, {'images.tar': 'md5:' + '0' * 32})
+    assert sorted(p.name for p in root.iterdir()) == [MANIFEST_FILE]
+    manifest = download_files({'images.tar': src.as_uri()}, root, {'images.tar': 'md5:' + md5})
+    assert manifest['images.tar']['md5'] == md5 and manifest['images.tar']['sha256'] == sha256
+    for name, data in files.items():
+        assert (root/name).read_bytes() == data
+
+
+def test_registry_checksums():
+    for name in registry.names():
+        info = registry.info(name)
+        assert set(info.checksums) <= set(info.url_files)
+        for checksum in info.checksums.values():
+            kind, digest = checksum.split(':') if ':' in checksum else ('sha256', checksum)
+            assert len(digest) == {'md5': 32, 'sha256': 64}[kind]
+            int(digest, 16)
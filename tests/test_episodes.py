@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import fgvcdata
+from fgvcdata import episodes
+from fgvcdata.episodes import (EpisodeSampler, EpisodicDataset, load_class_split,
+                               make_class_split, save_class_split)
+from fgvcdata.fixtures import make_fixture
+
+
+@pytest.fixture
+def targets():
+    # 10 classes of 20 to 38 samples
+    sizes = 20 + 2 * np.arange(10)
+    return np.random.default_rng(0).permutation(np.repeat(np.arange(10), sizes))
+
+
+def _check_episodes(eps, targets, classes, k_shot, n_query):
+    for episode in eps:
+        labels = targets[episode]
+        # n_way distinct classes, with distinct samples of each
+        assert (labels == labels[:, :1]).all()
+        assert len(set(labels[:, 0].tolist())) == len(labels)
+        assert set(labels[:, 0].tolist()) <= set(classes)
+        assert all(len(set(row.tolist())) == k_shot + n_query for row in episode)
+
+
+def test_episodes(targets):
+    sampler = EpisodeSampler(targets, n_way=4, k_shot=2, n_query=3, num_episodes=2000)
+    eps = sampler.episodes()
+    assert eps.shape == (2000, 4, 5) and len(sampler) == 2000
+    _check_episodes(eps, targets, range(10), 2, 3)
+    # classes are drawn uniformly, and samples uniformly within a class
+    class_freq = np.bincount(targets[eps[:, :, 0]].ravel(), minlength=10) / eps[:, :, 0].size
+    assert np.abs(class_freq - 0.1).max() < 0.01
+    per_sample = np.bincount(eps.ravel(), minlength=len(targets))
+    expected = 2000 * 4 / 10 * 5 / np.bincount(targets)[targets]
+    assert np.abs(per_sample / expected - 1).max() < 0.35
+    # support samples of each class first, then the query samples
+    flat = sampler.flat_episodes()
+    assert flat.shape == (2000, 20)
+    assert flat[:, :8].tolist() == eps[:, :, :2].reshape(2000, -1).tolist()
+    assert flat[:, 8:].tolist() == eps[:, :, 2:].reshape(2000, -1).tolist()
+    assert list(sampler) == flat.tolist()
+
+
+def test_episodes_deterministic(targets, monkeypatch):
+    a = EpisodeSampler(targets, num_episodes=50, n_query=5, seed=1)
+    b = EpisodeSampler(targets, num_episodes=50, n_query=5, seed=1)
+    first = a.episodes()
+    assert np.array_equal(first, b.episodes())
+    a.set_epoch(1)
+    assert not np.array_equal(a.episodes(), first)
+    a.set_epoch(0)
+    assert np.array_equal(a.episodes(), first)
+    # episodes drawn in several chunks
+    monkeypatch.setattr(episodes, '_CHUNK', 100)
+    eps = a.episodes()
+    assert eps.shape == first.shape
+    _check_episodes(eps, targets, range(10), 1, 5)
+
+
+def test_classes(targets):
+    sampler = EpisodeSampler(targets, n_way=3, n_query=4, num_episodes=200, classes=[1, 4, 6, 8])
+    _check_episodes(sampler.episodes(), targets, [1, 4, 6, 8], 1, 4)
+    with pytest.raises(ValueError, match='fewer than'):
+        EpisodeSampler(targets, k_shot=5, n_query=16)
+    with pytest.raises(ValueError, match='5-way'):
+        EpisodeSampler(targets, classes=[1, 2, 3])
+
+
+def test_class_split(tmp_path):
+    names = ['class {}'.format(i) for i in range(10)]
+    split = make_class_split(names, sizes=(0.5, 3, 0.2), seed=4)
+    assert [len(split[k]) for k in ('base', 'val', 'novel')] == [5, 3, 2]
+    assert sorted(sum(split.values(), [])) == sorted(names)
+    assert make_class_split(names, sizes=(0.5, 3, 0.2), seed=4) == split
+    save_class_split(tmp_path/'split.json', split)
+    assert load_class_split(tmp_path/'split.json') == split
+
+
+def test_episodic_dataset(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('CUB', tmp_path/'cub', num_images=24, num_classes=4)
+    ds = fgvcdata.CUB(root, decode_threads=2)
+    novel = ds.classes[1:]
+    eps = EpisodicDataset(ds, n_way=2, k_shot=1, n_query=2, num_episodes=6, classes=novel)
+    assert len(eps) == 6
+    for i in range(len(eps)):
+        support, support_labels, query, query_labels = eps[i]
+        assert support_labels.tolist() == [0, 1] and query_labels.tolist() == [0, 0, 1, 1]
+        indices = eps.episodes[i]
+        classes = eps.classes(i)
+        assert [ds.classes[c] for c in classes] == [ds.classes[c] for c in
+                                                    ds.targets[indices[:2]]]
+        assert set(ds.classes[c] for c in classes) <= set(novel)
+        assert ds.targets[indices[2:]].tolist() == np.repeat(classes, 2).tolist()
+        for img, j in zip(support + query, indices):
+            assert np.array_equal(np.asarray(img), np.asarray(ds[j][0]))
+    with pytest.raises(KeyError):
+        EpisodicDataset(ds, classes=['no such class'])
@@ -0,0 +1,54 @@
+import sys
+
+import pytest
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+
+
+@pytest.fixture(params=['pyarrow', 'csv'])
+def backend(request, monkeypatch):
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow.csv')
+    else:
+        # read_csv_columns falls back to the csv module without pyarrow
+        monkeypatch.setitem(sys.modules, 'pyarrow', None)
+        monkeypatch.setitem(sys.modules, 'pyarrow.csv', None)
+    return request.param
+
+
+@pytest.fixture
+def root(tmp_path):
+    return make_fixture('DanishFungi', tmp_path/'fungi', num_images=12, num_classes=4)
+
+
+def test_read(root, backend):
+    ds = fgvcdata.DanishFungi(root, cache_metadata=False)
+    assert len(ds) == 12 and len(ds.classes) == 4
+    assert ds.classes[0] == 'Fungus species 0 (10000)'
+    assert ds.targets.tolist() == [i % 4 for i in range(12)]
+
+
+def test_missing_taxon_id(root, backend):
+    fname = root/fgvcdata.DanishFungi.TRAIN_FILE
+    lines = fname.read_text().split('\n')
+    fields = lines[3].split(',')
+    fields[-3] = ''
+    lines[3] = ','.join(fields)
+    fname.write_text('\n'.join(lines))
+    with pytest.raises(ValueError, match='line 4'):
+        fgvcdata.DanishFungi(root, cache_metadata=False)
+
+
+def test_key_list(root, backend):
+    ds = fgvcdata.DanishFungi(root, cache_metadata=False)
+    rows = fgvcdata.fungi.parse_csv(root/ds.TRAIN_FILE, ds.KEY_LIST)
+    assert ds.imgs.tolist() == [r['image_path'] for r in rows]
+    assert [ds.classes[t] for t in ds.targets] == [
+        '{} ({})'.format(r['species'], r['taxonID']) for r in rows]
+
+
+@pytest.mark.parametrize('kwargs', [{'load_bboxes': True}, {'crop_to_bbox': True}])
+def test_no_bboxes(root, kwargs):
+    with pytest.raises(ValueError, match='bounding boxes'):
+        fgvcdata.DanishFungi(root, **kwargs)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.packed import main as pack
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    return make_fixture('CUB', tmp_path/'cub', num_images=12, num_classes=3)
+
+
+def _same(a, b):
+    assert a[1] == b[1]
+    assert np.array_equal(np.asarray(a[0]), np.asarray(b[0]))
+
+
+@pytest.mark.parametrize('decode_threads', [0, 3])
+@pytest.mark.parametrize('output', ['pil', 'tensor'])
+@pytest.mark.parametrize('packed', [False, True])
+def test_getitems_matches_getitem(root, tmp_path, decode_threads, output, packed):
+    store = None
+    if packed:
+        store = tmp_path/'packed'
+        pack(['CUB', str(root), str(store)])
+    ds = fgvcdata.CUB(root, store=store, decode_threads=decode_threads, output=output,
+                      decode_size=32)
+    rng = np.random.default_rng(0)
+    # shuffled, with repeats
+    indices = rng.integers(0, len(ds), 20).tolist()
+    batch = ds.__getitems__(indices)
+    assert len(batch) == len(indices)
+    for i, sample in zip(indices, batch):
+        _same(sample, ds[i])
+
+
+def test_loader_batches(root):
+    ds = fgvcdata.CUB(root, output='tensor', decode_size=(24, 24), decode_threads=2)
+    order = np.random.default_rng(0).permutation(len(ds)).tolist()
+    loader = DataLoader(ds, batch_size=5, sampler=order, collate_fn=lambda batch: batch)
+    seen = [sample for batch in loader for sample in batch]
+    assert len(seen) == len(order) == len(ds)
+    for i, sample in zip(order, seen):
+        _same(sample, ds[i])
@@ -0,0 +1,64 @@
+import numpy as np
+from torch.utils.data import DataLoader
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.imcache import SharedImageCache
+
+
+def _image(index, shape):
+    return np.full(shape, index, dtype=np.uint8)
+
+
+def test_ring_buffer_wraparound():
+    # room for three 10x10 RGB images: 300 bytes and a header, rounded up to 320
+    cache = SharedImageCache(3 * 320)
+    cache.bind(20)
+    for i in range(10):
+        cache.put(i, _image(i, (10, 10, 3)))
+        assert cache.stats()['nbytes'] <= cache.max_bytes
+    # the oldest images are evicted first
+    assert [i for i in range(10) if cache.get_array(i) is not None] == [7, 8, 9]
+    assert cache.stats()['evictions'] == 7 and len(cache) == 3
+    # too large to cache at all
+    cache.put(10, _image(10, (20, 20, 3)))
+    assert cache.get_array(10) is None and len(cache) == 3
+
+
+def test_ring_buffer_mixed_sizes():
+    # images that don't fit before the end of the buffer wrap around
+    rng = np.random.default_rng(0)
+    cache = SharedImageCache(4000)
+    cache.bind(300)
+    for i in range(300):
+        shape = (int(rng.integers(1, 20)), int(rng.integers(1, 20)), int(rng.choice([1, 3])))
+        cache.put(i, _image(i % 256, shape[:2] if shape[2] == 1 else shape))
+        assert cache.get_array(i) is not None
+        assert cache.stats()['nbytes'] <= cache.max_bytes
+    cached = [i for i in range(300) if cache.get_array(i) is not None]
+    # the most recent images are kept, and hold the right pixels
+    assert cached == list(range(300 - len(cached), 300))
+    assert all((cache.get_array(i) == i % 256).all() for i in cached)
+    stats = cache.stats()
+    assert stats['evictions'] == 300 - len(cached) == 300 - stats['images']
+
+def test_shared_between_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('CUB', tmp_path/'cub', num_images=8, num_classes=2)
+    cache = SharedImageCache(64 << 20)
+    ds = fgvcdata.CUB(root, image_cache=cache, output='tensor')
+    loader = DataLoader(ds, batch_size=None, num_workers=2, shuffle=True)
+    for epoch in range(2):
+        for _ in loader:
+            pass
+        if epoch == 0:
+            first = cache.stats()
+    # the second epoch reads every image from the cache, whichever worker
+    # decoded it in the first
+    stats = cache.stats()
+    assert first['misses'] == len(ds) and first['images'] == len(ds)
+    assert stats['hits'] - first['hits'] == len(ds)
+    assert stats['misses'] == first['misses']
+    plain = fgvcdata.CUB(root, output='tensor')
+    for i in range(len(ds)):
+        assert np.array_equal(cache.get_array(i), plain[i][0].permute(1, 2, 0).numpy())
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import fgvcdata
+elapsed = time.perf_counter() - start
+fgvcdata.datasets
+print(elapsed)
+print(' '.join(m for m in ('torch', 'torchvision', 'scipy', 'PIL') if m in sys.modules))
+'''
+
+
+def test_import_is_lazy():
+    out = subprocess.run([sys.executable, '-c', SCRIPT], check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True).stdout.split('\n')
+    assert out[1] == ''
+    # generous, but far below what importing torch takes
+    assert float(out[0]) < 2.0
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.packed import PackedDataset, main
+
+
+def test_pack_and_read(tmp_path):
+    # train and test images have the same names, in different folders
+    root = make_fixture('StanfordCars', tmp_path/'cars', num_images=6, num_classes=2)
+    main(['StanfordCars', str(root), str(tmp_path/'packed')])
+    assert len(list((tmp_path/'packed').glob('test-*.shard'))) == 1
+    for train in (True, False):
+        ds = fgvcdata.StanfordCars(root, train=train, cache_metadata=False)
+        packed = PackedDataset(tmp_path/'packed', train=train, cache_metadata=False)
+        assert packed.imgs == ds.imgs
+        assert packed.targets.tolist() == ds.targets.tolist()
+        assert packed.store[0].tobytes() == ds.filepath(0).read_bytes()
+
+
+def test_identical_splits_packed_once(tmp_path):
+    root = make_fixture('InatCUB', tmp_path/'icub', num_images=6, num_classes=2)
+    out = tmp_path/'packed'
+    main(['InatCUB', str(root), str(out)])
+    assert sorted(p.name for p in out.glob('*.shard')) == ['train-00000.shard']
+    assert json.load(open(out/'meta.json'))['splits']['test']['shards_of'] == 'train'
+    ds = fgvcdata.InatCUB(root, cache_metadata=False)
+    for train in (True, False):
+        packed = PackedDataset(out, train=train, load_bboxes=True, cache_metadata=False)
+        assert packed.imgs == ds.imgs
+        assert np.array_equal(packed.bboxes, fgvcdata.InatCUB(root, load_bboxes=True).bboxes)
+        stored = fgvcdata.InatCUB(root, train=train, store=out, cache_metadata=False)
+        assert stored.store[5].tobytes() == ds.filepath(5).read_bytes()
+
+
+def test_store_of_other_dataset(tmp_path):
+    root = make_fixture('StanfordCars', tmp_path/'cars', num_images=6, num_classes=2)
+    main(['StanfordCars', str(root), str(tmp_path/'packed')])
+    other = make_fixture('CUB', tmp_path/'cub', num_images=6, num_classes=2)
+    # same number of images, different names
+    assert len(fgvcdata.CUB(other, cache_metadata=False)) == 6
+    with pytest.raises(ValueError, match='different images'):
+        fgvcdata.CUB(other, store=tmp_path/'packed', cache_metadata=False)
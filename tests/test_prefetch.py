@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.prefetch import PrefetchSampler, Prefetcher
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    return make_fixture('CUB', tmp_path/'cub', num_images=20, num_classes=4)
+
+
+def _collate(batch):
+    return batch
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_loader_hits(root, num_workers):
+    prefetcher = Prefetcher(depth=4, threads=2, max_workers=2)
+    ds = fgvcdata.CUB(root, prefetcher=prefetcher, output='tensor')
+    plain = fgvcdata.CUB(root, output='tensor')
+    order = np.random.default_rng(0).permutation(len(ds)).tolist()
+    sampler = PrefetchSampler(order, prefetcher, batch_size=3)
+    loader = DataLoader(ds, batch_size=3, sampler=sampler, num_workers=num_workers,
+                        collate_fn=_collate)
+    for epoch in range(2):
+        samples = [sample for batch in loader for sample in batch]
+        for i, (img, target) in zip(order, samples):
+            assert target == plain.targets[i] and torch.equal(img, plain[i][0])
+        stats = prefetcher.stats()
+        # every image of the epoch was read ahead, by the process it was sent to
+        assert stats['requests'] == stats['hits'] == (epoch + 1) * len(ds)
+        assert stats['misses'] == 0 and stats['wasted'] == 0
+        assert stats['bytes'] == (epoch + 1) * sum(plain.filepath(i).stat().st_size
+                                                   for i in range(len(ds)))
+    prefetcher.reset_stats()
+    assert prefetcher.stats()['requests'] == 0
+
+
+def test_images_and_misses(root):
+    prefetcher = Prefetcher(depth=4, threads=2)
+    ds = fgvcdata.CUB(root, prefetcher=prefetcher)
+    plain = fgvcdata.CUB(root)
+    prefetcher.schedule([5, 0, 7, 3])
+    # images outside the order are read on request
+    for i in [5, 0, 1, 7, 3]:
+        assert np.array_equal(np.asarray(ds[i][0]), np.asarray(plain[i][0]))
+    stats = prefetcher.stats()
+    assert (stats['requests'], stats['hits'], stats['misses']) == (5, 4, 1)
+    # skipping ahead drops the reads of the skipped images
+    prefetcher.schedule(range(len(ds)))
+    ds[0]
+    ds[12]
+    stats = prefetcher.stats()
+    assert stats['hits'] == 6 and stats['misses'] == 1 and stats['wasted'] > 0
+
+
+def test_too_many_samples(root):
+    prefetcher = Prefetcher(max_samples=8)
+    with pytest.raises(ValueError):
+        prefetcher.schedule(range(9))
+    with pytest.raises(ValueError):
+        PrefetchSampler(range(9), prefetcher)
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pytest
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.prepare import MANIFEST_FILE, main
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    return make_fixture('CUB', tmp_path/'cub', num_images=6, num_classes=2)
+
+
+def _prepare(root, out, *args):
+    main(['CUB', str(root), str(out), '--workers', '1'] + list(args))
+
+
+def _mtimes(out):
+    return {p: p.stat().st_mtime_ns for p in out.rglob('*.jpg')}
+
+
+def test_prepare_and_resume(root, tmp_path, capsys):
+    out = tmp_path/'out'
+    _prepare(root, out, '--short-side', '32')
+    manifest = json.load(open(out/MANIFEST_FILE))
+    assert manifest['complete'] and manifest['short_side'] == 32
+    full = fgvcdata.CUB(root, load_bboxes=True)
+    ds = fgvcdata.CUB(root, load_bboxes=True, image_root=out)
+    for i in range(len(ds)):
+        assert min(ds[i][0].size) == 32
+        scale = ds[i][0].size[0] / full[i][0].size[0]
+        assert np.allclose(ds.bboxes[i], full.bboxes[i] * scale, rtol=0.05)
+
+    # an interrupted run is resumed, converting only the missing images
+    images = _mtimes(out)
+    missing = sorted(images)[0]
+    missing.unlink()
+    json.dump(dict(manifest, complete=False), open(out/MANIFEST_FILE, 'w'))
+    with pytest.raises(ValueError, match='partly prepared'):
+        fgvcdata.CUB(root, image_root=out)
+    _prepare(root, out, '--short-side', '32')
+    assert json.load(open(out/MANIFEST_FILE))['complete']
+    resumed = _mtimes(out)
+    assert missing.is_file()
+    assert all(resumed[p] == t for p, t in images.items() if p != missing)
+
+
+def test_resume_other_settings(root, tmp_path, capsys):
+    out = tmp_path/'out'
+    _prepare(root, out, '--short-side', '32')
+    images = _mtimes(out)
+    with pytest.raises(SystemExit):
+        _prepare(root, out, '--short-side', '48')
+    assert 'short_side 32 (not 48)' in capsys.readouterr().err
+    assert _mtimes(out) == images
+    _prepare(root, out, '--short-side', '48', '--overwrite')
+    assert json.load(open(out/MANIFEST_FILE))['short_side'] == 48
+    ds = fgvcdata.CUB(root, image_root=out)
+    assert all(min(ds[i][0].size) == 48 for i in range(len(ds)))
+
+
+def test_unknown_output(root, tmp_path, capsys):
+    out = tmp_path/'out'
+    (out/'images').mkdir(parents=True)
+    with pytest.raises(SystemExit):
+        _prepare(root, out, '--short-side', '32')
+    assert 'has no {}'.format(MANIFEST_FILE) in capsys.readouterr().err
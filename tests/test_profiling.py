@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+import pytest
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.profiling import Profiler
+
+
+def test_record_from_threads():
+    profiler = Profiler(max_workers=0)
+    barrier = threading.Barrier(8)
+
+    def work():
+        barrier.wait()
+        for i in range(500):
+            profiler.record('decode', 0, 1000 + i, i)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # threads setting up the process's row concurrently lose no records
+    assert profiler.summary()['decode']['count'] == 4000
+    assert profiler.histograms()[1]['decode'].sum() == 4000
+
+
+@pytest.mark.parametrize('output', ['pil', 'tensor'])
+def test_profiled_dataset(tmp_path, monkeypatch, output):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('CUB', tmp_path/'cub', num_images=6, num_classes=2)
+    profiler = Profiler(max_workers=0)
+    kwargs = dict(output=output, crop_to_bbox=True, decode_size=16)
+    ds = fgvcdata.CUB(root, profiler=profiler, transform=lambda img: img, **kwargs)
+    plain = fgvcdata.CUB(root, **kwargs)
+    # the profiled samples come from the same decode path
+    for i in range(len(ds)):
+        img, target = ds[i]
+        assert target == plain[i][1]
+        assert np.array_equal(np.asarray(img), np.asarray(plain[i][0]))
+    summary = profiler.summary()
+    n = len(ds)
+    stages = ['getitem', 'read', 'decode', 'transform']
+    if output == 'pil':
+        stages += ['open', 'convert']
+    assert sorted(summary) == sorted(stages)
+    assert all(summary[s]['count'] == n for s in stages)
+    assert summary['read']['bytes'] == sum(ds.filepath(i).stat().st_size for i in range(n))
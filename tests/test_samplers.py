@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from fgvcdata.samplers import (ClassBalancedSampler, ClassWeightedSampler, PKSampler,
+                               SqrtFrequencySampler, class_index)
+
+
+@pytest.fixture
+def targets():
+    # class sizes 200, 100, ..., 200 // 8; class 3 is empty
+    sizes = [200 // (c + 1) if c != 3 else 0 for c in range(8)]
+    targets = np.repeat(np.arange(8), sizes)
+    return np.random.default_rng(0).permutation(targets)
+
+
+def test_class_index(targets):
+    index = class_index(targets)
+    assert len(index) == 8
+    for c in range(8):
+        assert index[c].tolist() == np.flatnonzero(targets == c).tolist()
+
+
+@pytest.mark.parametrize('cls,power', [
+    (ClassBalancedSampler, 0.0), (SqrtFrequencySampler, 0.5), (ClassWeightedSampler, 1.0)])
+def test_class_distribution(targets, cls, power):
+    n = 200000
+    if cls is ClassWeightedSampler:
+        sampler = cls(targets, power, num_samples=n)
+    else:
+        sampler = cls(targets, num_samples=n)
+    indices = sampler.indices()
+    assert len(indices) == len(sampler) == n
+    counts = np.bincount(targets, minlength=8).astype(np.float64)
+    expected = np.where(counts > 0, counts ** power, 0)
+    expected /= expected.sum()
+    drawn = np.bincount(targets[indices], minlength=8) / n
+    assert drawn[3] == 0
+    assert np.abs(drawn - expected).max() < 0.01
+    # images are drawn uniformly within their class
+    per_image = np.bincount(indices[targets[indices] == 0], minlength=len(targets))
+    assert per_image[targets == 0].min() > 0
+
+
+def test_epochs_deterministic(targets):
+    a, b = SqrtFrequencySampler(targets, seed=1), SqrtFrequencySampler(targets, seed=1)
+    assert list(a) == list(b)
+    first = list(a)
+    a.set_epoch(1)
+    assert list(a) != first
+    b.set_epoch(1)
+    assert list(a) == list(b)
+    a.set_epoch(0)
+    assert list(a) == first
+    assert list(SqrtFrequencySampler(targets, seed=2)) != first
+
+
+@pytest.mark.parametrize('world_size', [2, 3])
+def test_sharded(targets, world_size):
+    n = len(targets)
+    full = ClassBalancedSampler(targets, num_samples=n + 1, seed=3)
+    # every rank draws the same epoch and keeps every world_size-th index
+    ranks = [ClassBalancedSampler(targets, num_samples=n + 1, shard=(r, world_size), seed=3)
+             for r in range(world_size)]
+    for r in ranks:
+        r.set_epoch(2)
+    full.set_epoch(2)
+    drawn = full._draw(full._rng(), len(ranks[0]) * world_size)
+    assert all(len(r) == -(-(n + 1) // world_size) for r in ranks)
+    for rank, sampler in enumerate(ranks):
+        assert sampler.indices().tolist() == drawn[rank::world_size].tolist()
+
+
+def test_pk_batches(targets):
+    p, k = 3, 4
+    sampler = PKSampler(targets, p, k, num_batches=50)
+    indices = sampler.indices()
+    assert len(indices) == len(sampler) == 50 * p * k
+    counts = np.bincount(targets, minlength=8)
+    used = []
+    for batch in indices.reshape(-1, p * k):
+        classes = targets[batch].reshape(p, k)
+        # p distinct classes of k samples each
+        assert (classes == classes[:, :1]).all()
+        assert len(set(classes[:, 0].tolist())) == p
+        for c, group in zip(classes[:, 0], batch.reshape(p, k)):
+            assert len(set(group.tolist())) == min(k, counts[c])
+        used += classes[:, 0].tolist()
+    # every class is used once before any is used again: 7 classes give
+    # 2 batches of 3 per permutation
+    used = np.array(used).reshape(-1, 6)
+    assert 3 not in used
+    assert all(len(set(row.tolist())) == 6 for row in used)
+
+
+def test_pk_sharded(targets):
+    full = PKSampler(targets, 2, 2, num_batches=10)
+    ranks = [PKSampler(targets, 2, 2, num_batches=10, shard=(r, 2)) for r in range(2)]
+    batches = full.indices().reshape(-1, 4)
+    for r, sampler in enumerate(ranks):
+        assert sampler.indices().reshape(-1, 4).tolist() == batches[r::2].tolist()
+
+
+def test_pk_too_many_classes(targets):
+    with pytest.raises(ValueError):
+        PKSampler(targets, 8, 2)
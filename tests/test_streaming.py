@@ -0,0 +1,66 @@
+import json
+
+import pytest
+import torch
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.streaming import StreamingDataset, write_tar_shards
+
+
+@pytest.fixture(scope='module')
+def shards(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('streaming')
+    root = make_fixture('CUB', tmp/'CUB', num_images=22, num_classes=3, image_size=(32, 24))
+    ds = fgvcdata.CUB(root, cache_metadata=False)
+    # 6 shards for 4 ranks, so some ranks read twice as many samples
+    return write_tar_shards(ds, tmp/'tars', samples_per_shard=4)
+
+
+def _paths(ds, num_workers=0):
+    loader = torch.utils.data.DataLoader(ds, batch_size=None, num_workers=num_workers)
+    return [target for _, target in loader]
+
+
+@pytest.mark.parametrize('world_size,num_workers', [(4, 0), (4, 1), (3, 2)])
+def test_ranks_yield_len_samples(shards, world_size, num_workers):
+    for epoch in range(3):
+        sizes = []
+        for rank in range(world_size):
+            ds = StreamingDataset(shards, rank=rank, world_size=world_size, buffer_size=3)
+            ds.set_epoch(epoch)
+            sizes.append(len(ds))
+            assert len(_paths(ds, num_workers)) == len(ds)
+        assert len(set(sizes)) == 1 and 0 < sizes[0] <= 22 // world_size
+
+
+def test_single_rank_yields_everything(shards):
+    ds = StreamingDataset(shards, rank=0, world_size=1)
+    assert len(ds.shards) == 6
+    assert len(ds) == sum(ds.counts)
+    assert len(_paths(ds, 2)) == len(ds)
+
+
+def test_too_few_shards(shards):
+    with pytest.raises(ValueError, match='fewer than the 7 ranks'):
+        StreamingDataset(shards, rank=0, world_size=7)
+    # 4 ranks of 2 workers need 8 shards
+    ds = StreamingDataset(shards, rank=0, world_size=4)
+    with pytest.raises(Exception, match='too few for 4 ranks of 2'):
+        _paths(ds, 2)
+
+
+def test_load_bboxes(shards, tmp_path):
+    # the shards of the fixture were written without boxes
+    with pytest.raises(ValueError, match='without bounding boxes'):
+        StreamingDataset(shards, rank=0, world_size=1, load_bboxes=True)
+    root = make_fixture('CUB', tmp_path/'CUB', num_images=4, num_classes=2)
+    ds = fgvcdata.CUB(root, load_bboxes=True, cache_metadata=False)
+    boxed = write_tar_shards(ds, tmp_path/'tars')
+    for _, (target, bbox) in StreamingDataset(boxed, rank=0, world_size=1, load_bboxes=True):
+        assert len(bbox) == 4
+    # shards written before streaming.json recorded whether they have boxes
+    meta = json.load(open(boxed/'streaming.json'))
+    del meta['splits']['train']['bboxes']
+    json.dump(meta, open(boxed/'streaming.json', 'w'))
+    assert StreamingDataset(boxed, rank=0, world_size=1, load_bboxes=True).load_bboxes
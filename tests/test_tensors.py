@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import fgvcdata
+from fgvcdata.fixtures import make_fixture
+from fgvcdata.tensors import TensorCollate, decode_tensor, normalize, to_tensor
+
+
+def _pixels(w=67, h=45):
+    x, y = np.meshgrid(np.linspace(0, 1, w), np.linspace(0, 1, h))
+    return np.stack([x * 255, y * 255, (x + y) * 127, (1 - x) * 255], axis=-1).astype(np.uint8)
+
+
+def _assert_matches(tensor, img, tol=0):
+    # JPEG decoders may round a few pixels differently
+    expected = to_tensor(img)
+    assert tensor.dtype == torch.uint8 and tensor.shape == expected.shape
+    assert (tensor.int() - expected.int()).abs().max() <= tol
+
+
+@pytest.mark.parametrize('mode,fmt', [
+    ('L', 'JPEG'), ('L', 'PNG'), ('P', 'PNG'), ('P', 'GIF'), ('CMYK', 'JPEG'),
+    ('RGBA', 'PNG'), ('LA', 'PNG'), ('RGB', 'JPEG'), ('RGB', 'BMP')])
+def test_decode_matches_pil(mode, fmt):
+    pixels = _pixels()
+    if mode not in ('RGBA', 'LA'):
+        pixels = pixels[..., :3]
+    img = Image.fromarray(pixels).convert(mode)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    tensor = decode_tensor(io.BytesIO(buf.getvalue()))
+    buf.seek(0)
+    _assert_matches(tensor, Image.open(buf), tol=1 if fmt == 'JPEG' else 0)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'decode_size': 32}, {'crop_to_bbox': True}, {'crop_to_bbox': True, 'decode_size': 16}])
+def test_dataset_output(tmp_path, monkeypatch, kwargs):
+    monkeypatch.setenv('FGVCDATA_CACHE_DIR', str(tmp_path/'cache'))
+    root = make_fixture('CUB', tmp_path/'cub', num_images=4, num_classes=2)
+    pil = fgvcdata.CUB(root, **kwargs)
+    tensor = fgvcdata.CUB(root, output='tensor', **kwargs)
+    for i in range(len(pil)):
+        img, target = tensor[i]
+        assert target == pil[i][1]
+        _assert_matches(img, pil[i][0], tol=1)
+
+
+def test_collate_and_normalize():
+    imgs = [torch.from_numpy(_pixels(w, h)[..., :3]).permute(2, 0, 1) for w, h in
+            [(67, 45), (32, 24)]]
+    collate = TensorCollate((24, 32), mean=[0.5, 0.4, 0.3], std=[0.2, 0.25, 0.3])
+    out, targets = collate([(imgs[0], 0), (imgs[1], 1)])
+    assert out.shape == (2, 3, 24, 32) and out.dtype == torch.float32
+    assert targets.tolist() == [0, 1]
+    # an image of the batch size is copied as is
+    expected = (imgs[1].float() / 255 - torch.tensor([0.5, 0.4, 0.3]).view(3, 1, 1)) \
+        / torch.tensor([0.2, 0.25, 0.3]).view(3, 1, 1)
+    assert torch.allclose(out[1], expected, atol=1e-5)
+    raw, _ = TensorCollate((24, 32))([(imgs[1], 0)])
+    assert raw.dtype == torch.uint8 and raw.is_contiguous(memory_format=torch.channels_last)
+    assert torch.allclose(normalize(raw, [0.5, 0.4, 0.3], [0.2, 0.25, 0.3])[0], expected,
+                          atol=1e-5)
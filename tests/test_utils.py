@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from fgvcdata.utils import RaggedArray, StringArray, lookup, read_columns
+
+
+def _read_lines(fname):
+    '''The line-by-line parser that ``read_columns`` replaces'''
+    with open(fname) as f:
+        rows = [line.split(' ', 1) for line in f.read().strip().split('\n')]
+    return [r[0] for r in rows], [r[1] if len(r) > 1 else '' for r in rows]
+
+
+@pytest.mark.parametrize('txt', [
+    '1 0.5 2 3.25 4\n',
+    '1 0.5 2 3.25 4',
+    '1 1 2 3 4\n2 5 6 7 8\n3 0.1 0.2 0.3 0.4',
+    '1 1 2 3 4\n2 5 6 7 8\n\n\n',
+])
+def test_read_columns_numeric(tmp_path, txt):
+    fname = tmp_path/'boxes.txt'
+    fname.write_text(txt)
+    keys, values = read_columns(fname, np.float32)
+    ref_keys, ref_values = _read_lines(fname)
+    assert keys.tolist() == ref_keys
+    assert values.tolist() == [[np.float32(float(x)) for x in v.split()] for v in ref_values]
+
+
+@pytest.mark.parametrize('txt', [
+    '1 001.Black_footed_Albatross/img.jpg\n',
+    '7 a b c',
+    '1 x.jpg\n2 y z.jpg\n\n',
+])
+def test_read_columns_strings(tmp_path, txt):
+    fname = tmp_path/'images.txt'
+    fname.write_text(txt)
+    keys, values = read_columns(fname)
+    assert (keys.tolist(), values.tolist()) == _read_lines(fname)
+
+
+def test_lookup():
+    keys = np.array([3, 1, 2, 1])
+    values = np.array([30, 10, 20, 11])
+    assert lookup(keys, values, np.array([1, 2, 3])).tolist() == [11, 20, 30]
+    with pytest.raises(KeyError):
+        lookup(keys, values, np.array([4]))
+
+
+def test_string_array_round_trip():
+    strings = ['a', '', 'b/c d.jpg', 'd\u00e9j\u00e0']
+    arr = StringArray.from_list(strings)
+    assert len(arr) == len(strings)
+    assert arr.tolist() == strings
+    assert [arr[i] for i in range(len(arr))] == strings
+    assert arr[1:3] == strings[1:3]
+    assert arr.take([3, 0, 0]).tolist() == [strings[3], strings[0], strings[0]]
+    assert StringArray(arr.data).tolist() == strings
+    assert StringArray.from_list([]).tolist() == []
+
+
+def test_ragged_array_round_trip():
+    items = [np.zeros((0, 4)), np.arange(4.0).reshape(1, 4), np.arange(8.0).reshape(2, 4)]
+    offsets = np.cumsum([0] + [len(x) for x in items])
+    arr = RaggedArray(np.concatenate(items), offsets)
+    assert len(arr) == len(items)
+    assert arr.tolist() == [x.tolist() for x in items]
+    taken = arr.take([2, 0, 2])
+    assert taken.tolist() == [items[2].tolist(), [], items[2].tolist()]
+    assert taken.offsets.tolist() == [0, 2, 2, 4]